@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+# statement, milliseconds allowed, modules it must not load
+SCENARIOS = {
+    'package': ('import postal_py', 25, ('niquests', 'pydantic', 'smtplib', 'aiosmtplib', 'asyncio')),
+    'smtp': ('from postal_py import PostalPySMTP', 250, ('niquests', 'aiosmtplib', 'asyncio')),
+    'api': ('from postal_py import PostalPyAPI', 500, ('smtplib', 'aiosmtplib')),
+    'async-api': ('from postal_py import AsyncPostalPyAPI', 550, ('smtplib', 'aiosmtplib')),
+    'schemas': ('import postal_py.api.schemas, postal_py.smtp.schemas', 250, ('niquests', 'smtplib', 'asyncio'))
+}
+
+
+def run_importtime(code: str) -> tuple[list[tuple[int, int, bool, str]], str]:
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True,
+                               text=True)
+    if completed.returncode:
+        raise RuntimeError(f'{code!r} failed:\n{completed.stderr}')
+    entries = []
+    for line in completed.stderr.splitlines():
+        if (match := IMPORTTIME_LINE.match(line)) is not None:
+            own, cumulative, indent, name = match.groups()
+            entries.append((int(own), int(cumulative), not indent, name))
+    return entries, completed.stdout
+
+
+def measure(statement: str, forbidden: tuple[str, ...], startup: set[str]) -> dict[str, Any]:
+    """
+    Imports in a fresh interpreter under `-X importtime`. The time is the cumulative time of the top-level
+    imports that interpreter `startup` does not make.
+    """
+    code = f'{statement}\nimport sys\nprint(sorted(name for name in {forbidden!r} if name in sys.modules))'
+    entries, stdout = run_importtime(code=code)
+    return {
+        'ms': sum(cumulative for _, cumulative, top, name in entries if top and name not in startup) / 1000,
+        'loaded': json.loads(stdout.splitlines()[-1].replace("'", '"')),
+        'slowest': sorted(((own, name) for own, _, _, name in entries if name not in startup), reverse=True)[:5]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of postal_py entry points against fixed budgets.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'comma-separated subset of {list(SCENARIOS)}')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario, the fastest one counts')
+    parser.add_argument('--scale', type=float, default=1.0, help='budget multiplier for slower machines')
+    parser.add_argument('--verbose', action='store_true', help='show the slowest modules of each scenario')
+    args = parser.parse_args()
+
+    startup = {name for _, _, _, name in run_importtime(code='pass')[0]}
+    failures = []
+    print(f'{"scenario":<12}{"ms":>10}{"budget":>10}  unwanted modules')
+    for name in args.scenarios.split(','):
+        statement, budget, forbidden = SCENARIOS[name]
+        budget *= args.scale
+        # Later runs find the bytecode cached, and the fastest run is the least disturbed by other processes
+        result = min((measure(statement=statement, forbidden=forbidden, startup=startup) for _ in range(args.repeat)),
+                     key=lambda r: r['ms'])
+        print(f'{name:<12}{result["ms"]:>10.1f}{budget:>10.0f}  {", ".join(result["loaded"]) or "-"}')
+        if args.verbose:
+            for own, module in result['slowest']:
+                print(f'{"":<12}{own / 1000:>10.1f}  {module}')
+        if result['ms'] > budget or result['loaded']:
+            failures.append(name)
+    if failures:
+        print(f'Over budget or loading unwanted modules: {", ".join(failures)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import Any
+
+from benchmarks.run import (get_api_message,
+                            get_percentile,
+                            parse_size)
+from benchmarks.servers import (FakePostalServer,
+                                SMTPSink)
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.offload import MessageOffload
+from postal_py.smtp.schemas import SMTPMessageSchema
+
+CLIENTS = ('async-api', 'async-smtp')
+# Inline runs without an offload, as clients did before it
+MODES = ('inline', 'thread', 'process')
+TICK = 0.001
+
+
+async def measure_lag(stopped: asyncio.Event) -> list[float]:
+    """
+    How late the loop wakes up a coroutine sleeping `TICK` seconds, which is how long any other coroutine,
+    such as one reading a response, waits for its turn.
+    """
+    lags = []
+    while not stopped.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+    return lags
+
+
+async def run_scenario(client: str, mode: str, size: int, count: int, concurrency: int, min_size: int,
+                       api_url: str, smtp_port: int) -> dict[str, Any]:
+    from postal_py.smtp.async_wrapper import PostalPySMTP as AsyncPostalPySMTP
+
+    offload = None if mode == 'inline' else MessageOffload(mode=mode, min_size=min_size, max_workers=concurrency)
+    attachment = os.urandom(size) if size else None
+    if client == 'async-api':
+        postal = AsyncPostalPyAPI(base_url=api_url, api_key='benchmark', level=logging.WARNING, offload=offload)
+        schema = RequestMessageSchema
+    else:
+        postal = AsyncPostalPySMTP(hostname='127.0.0.1', port=smtp_port, username='benchmark', password='benchmark',
+                                   use_tls=False, pool_size=concurrency, offload=offload, level=logging.WARNING)
+        schema = SMTPMessageSchema
+    # Validated beforehand, only what send_message does on the loop is measured
+    messages = [schema.model_validate(get_api_message(index=index, attachment=attachment))
+                for index in range(count + concurrency)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(message: Any):
+        async with semaphore:
+            await postal.send_message(message)
+
+    # Warms up connections and worker processes
+    await asyncio.gather(*(send(message) for message in messages[count:]))
+    stopped = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_lag(stopped=stopped))
+    started = time.perf_counter()
+    await asyncio.gather(*(send(message) for message in messages[:count]))
+    elapsed = time.perf_counter() - started
+    stopped.set()
+    lags = await lag_task
+    await postal.close()
+    if offload is not None:
+        offload.shutdown()
+    return {
+        'messages_per_second': count / elapsed,
+        'lag_p50_ms': get_percentile(lags, 50) * 1000,
+        'lag_p99_ms': get_percentile(lags, 99) * 1000,
+        'lag_max_ms': max(lags) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Event loop lag of async clients sending large messages, '
+                                                 'with message preparation inline or offloaded.')
+    parser.add_argument('--clients', default=','.join(CLIENTS), help=f'comma-separated subset of {CLIENTS}')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'comma-separated subset of {MODES}')
+    parser.add_argument('--sizes', default='10k,1m,4m', help='attachment sizes, such as 10k,1m')
+    parser.add_argument('--messages', type=int, default=100, help='messages sent per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent senders and offload workers')
+    parser.add_argument('--min-size', default='256k', help='smallest message prepared off the loop')
+    args = parser.parse_args()
+
+    api = FakePostalServer().start()
+    sink = SMTPSink().start()
+    print(f'{"client":<12}{"size":<8}{"mode":<10}{"msg/s":>10}{"lag p50":>10}{"lag p99":>10}{"lag max":>10}')
+    try:
+        for client in args.clients.split(','):
+            for size in args.sizes.split(','):
+                for mode in args.modes.split(','):
+                    result = asyncio.run(run_scenario(
+                        client=client, mode=mode, size=parse_size(size), count=args.messages,
+                        concurrency=args.concurrency, min_size=parse_size(args.min_size), api_url=api.url,
+                        smtp_port=sink.port
+                    ))
+                    print(f'{client:<12}{size:<8}{mode:<10}{result["messages_per_second"]:>10.1f}'
+                          f'{result["lag_p50_ms"]:>10.2f}{result["lag_p99_ms"]:>10.2f}{result["lag_max_ms"]:>10.2f}')
+    finally:
+        api.stop()
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
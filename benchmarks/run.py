@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections.abc import (Callable,
+                             Iterable)
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from benchmarks.servers import (FakePostalServer,
+                                SMTPSink)
+
+CLIENTS = ('api', 'async-api', 'smtp', 'async-smtp')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def parse_size(value: str) -> int:
+    units = {'k': 1024, 'm': 1024 ** 2}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def get_peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def get_api_message(index: int, attachment: bytes | None) -> dict[str, Any]:
+    message = {
+        'to': [f'user{index}@example.com'],
+        'from': 'Benchmark <bench@example.com>',
+        'subject': f'Benchmark message {index}',
+        'plain_body': 'Plain body ' * 20,
+        'html_body': '<p>HTML body</p>' * 20
+    }
+    if attachment:
+        message['attachments'] = [{'name': 'payload.bin', 'content_type': 'application/octet-stream',
+                                   'data': attachment}]
+    return message
+
+
+def run_sync(send: Callable[[int], Any], count: int, concurrency: int) -> tuple[list[float], int]:
+    errors = 0
+
+    def timed(index: int) -> float:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            send(index)
+        except Exception:
+            errors += 1
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(count)))
+    return latencies, errors
+
+
+async def run_async(send: Callable[[int], Any], count: int, concurrency: int) -> tuple[list[float], int]:
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(index: int) -> float:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await send(index)
+            except Exception:
+                errors += 1
+            return time.perf_counter() - started
+
+    latencies = await asyncio.gather(*(timed(index) for index in range(count)))
+    return list(latencies), errors
+
+
+def run_scenario(client: str, size: int, concurrency: int, count: int, api_url: str,
+                 smtp_port: int) -> dict[str, Any]:
+    """
+    Runs one scenario in the current process: warms the client up, then sends `count` messages,
+    building and validating each message schema as part of its send.
+    """
+    from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+    from postal_py.api.schemas import RequestMessageSchema
+    from postal_py.api.wrapper import PostalPyAPI
+    from postal_py.smtp.schemas import SMTPMessageSchema
+    from postal_py.smtp.wrapper import PostalPySMTP
+
+    attachment = os.urandom(size) if size else None
+    warmup = min(count, concurrency)
+    if client in ('api', 'smtp'):
+        if client == 'api':
+            postal = PostalPyAPI(base_url=api_url, api_key='benchmark', level=logging.WARNING)
+            schema = RequestMessageSchema
+        else:
+            postal = PostalPySMTP(hostname='127.0.0.1', port=smtp_port, username='benchmark', password='benchmark',
+                                  use_tls=False, pool_size=concurrency, level=logging.WARNING)
+            schema = SMTPMessageSchema
+
+        def send(index: int):
+            postal.send_message(schema.model_validate(get_api_message(index=index, attachment=attachment)))
+
+        run_sync(send=send, count=warmup, concurrency=concurrency)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        latencies, errors = run_sync(send=send, count=count, concurrency=concurrency)
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        postal.close()
+    else:
+        if client == 'async-api':
+            postal = AsyncPostalPyAPI(base_url=api_url, api_key='benchmark', level=logging.WARNING)
+            schema = RequestMessageSchema
+        else:
+            from postal_py.smtp.async_wrapper import PostalPySMTP as AsyncPostalPySMTP
+            postal = AsyncPostalPySMTP(hostname='127.0.0.1', port=smtp_port, username='benchmark',
+                                       password='benchmark', use_tls=False, pool_size=concurrency,
+                                       level=logging.WARNING)
+            schema = SMTPMessageSchema
+
+        async def send(index: int):
+            await postal.send_message(schema.model_validate(get_api_message(index=index, attachment=attachment)))
+
+        async def main() -> tuple[list[float], int, float, float]:
+            await run_async(send=send, count=warmup, concurrency=concurrency)
+            started, cpu_started = time.perf_counter(), time.process_time()
+            latencies, errors = await run_async(send=send, count=count, concurrency=concurrency)
+            elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+            await postal.close()
+            return latencies, errors, elapsed, cpu
+
+        latencies, errors, elapsed, cpu = asyncio.run(main())
+    peak_rss = get_peak_rss()
+    return {
+        'messages_per_second': count / elapsed,
+        'p50_ms': get_percentile(latencies, 50) * 1000,
+        'p99_ms': get_percentile(latencies, 99) * 1000,
+        'cpu_seconds': cpu,
+        'peak_rss_mb': None if peak_rss is None else peak_rss / 1024 ** 2,
+        'errors': errors
+    }
+
+
+def run_isolated(client: str, size: int, concurrency: int, count: int, api_url: str,
+                 smtp_port: int) -> dict[str, Any]:
+    # Each scenario runs in a fresh interpreter, so its CPU time and peak RSS are its own,
+    # and the stand-in servers in this process do not count towards them
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker', json.dumps({
+        'client': client, 'size': size, 'concurrency': concurrency, 'count': count, 'api_url': api_url,
+        'smtp_port': smtp_port
+    })]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode:
+        raise RuntimeError(f'Scenario {client} failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def compare(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]],
+            tolerance: float) -> list[str]:
+    """
+    Names of the scenarios whose throughput dropped, or whose p99 latency grew, by more than `tolerance`.
+    """
+    regressions = []
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if result['messages_per_second'] < base['messages_per_second'] * (1 - tolerance) or \
+                result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_change(value: float, base: float | None) -> str:
+    return '' if not base else f' ({(value - base) / base:+.0%})'
+
+
+def print_results(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]]):
+    print(f'{"scenario":<28}{"msgs/s":>18}{"p50 ms":>18}{"p99 ms":>18}{"cpu s":>9}{"rss MB":>9}{"errors":>8}')
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        rss = result['peak_rss_mb']
+        print(f'{name:<28}'
+              f'{result["messages_per_second"]:>10.1f}'
+              f'{format_change(result["messages_per_second"], base.get("messages_per_second")):>8}'
+              f'{result["p50_ms"]:>10.2f}{format_change(result["p50_ms"], base.get("p50_ms")):>8}'
+              f'{result["p99_ms"]:>10.2f}{format_change(result["p99_ms"], base.get("p99_ms")):>8}'
+              f'{result["cpu_seconds"]:>9.2f}{"-" if rss is None else f"{rss:.0f}":>9}{result["errors"]:>8}')
+
+
+def run(clients: Iterable[str], sizes: Iterable[int], concurrencies: Iterable[int], count: int,
+        latency: float, error_rate: float) -> dict[str, dict[str, Any]]:
+    server = FakePostalServer(latency=latency, error_rate=error_rate).start()
+    sink = SMTPSink(latency=latency, error_rate=error_rate).start()
+    results = {}
+    try:
+        for client in clients:
+            for size in sizes:
+                for concurrency in concurrencies:
+                    name = f'{client}/{size}B/c{concurrency}'
+                    print(f'Running {name}...', file=sys.stderr)
+                    results[name] = run_isolated(client=client, size=size, concurrency=concurrency, count=count,
+                                                 api_url=server.url, smtp_port=sink.port)
+    finally:
+        server.stop()
+        sink.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmarks for the postal_py clients '
+                                                 'against local stand-in Postal API and SMTP servers.')
+    parser.add_argument('--clients', default=','.join(CLIENTS), help=f'comma-separated subset of {CLIENTS}')
+    parser.add_argument('--sizes', default='0,100k,1m', help='attachment sizes, such as 0,100k,1m')
+    parser.add_argument('--concurrency', default='1,16', help='concurrent senders, such as 1,16')
+    parser.add_argument('--messages', type=int, default=200, help='messages sent per scenario')
+    parser.add_argument('--latency', type=float, default=0, help='server reply delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests the servers fail')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed regression, 0.1 being 10%%')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_scenario(**json.loads(args.worker))))
+        return
+
+    clients = [client for client in args.clients.split(',') if client]
+    if unknown := set(clients) - set(CLIENTS):
+        parser.error(f'unknown clients: {", ".join(sorted(unknown))}')
+    results = run(clients=clients, sizes=[parse_size(size) for size in args.sizes.split(',')],
+                  concurrencies=[int(concurrency) for concurrency in args.concurrency.split(',')],
+                  count=args.messages, latency=args.latency, error_rate=args.error_rate)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results=results, baseline=baseline)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({**baseline, **results}, file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+    elif regressions := compare(results=results, baseline=baseline, tolerance=args.tolerance):
+        print(f'Regressions beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json as jsonlib
+import os
+import time
+from collections.abc import Callable
+from typing import Any
+
+from benchmarks.run import (get_api_message,
+                            parse_size)
+from postal_py.api.base import PostalPyAPIBase
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.streaming import (MessageBodyStream,
+                                     PreparedMessage)
+
+try:
+    # niquests encodes request JSON with orjson when it is installed
+    from orjson import dumps
+except ImportError:
+    def dumps(json: dict[str, Any]) -> bytes:
+        return jsonlib.dumps(json).encode()
+
+
+def encode(json: dict[str, Any], body: MessageBodyStream | bytes | None) -> bytes:
+    return body if body is not None else dumps(json)
+
+
+def validated(message: dict[str, Any]) -> bytes:
+    json, body = PostalPyAPIBase._get_message_json(data=RequestMessageSchema.model_validate(message))
+    return encode(json=json, body=body)
+
+
+def trusted(message: dict[str, Any]) -> bytes:
+    attachments = [(item['name'], item['content_type'], item['data']) for item in message.get('attachments', ())]
+    json, body = PostalPyAPIBase._get_message_json(data=PreparedMessage.build(
+        to=message['to'], from_=message['from'], subject=message['subject'], plain_body=message['plain_body'],
+        html_body=message['html_body'], attachments=attachments or None
+    ))
+    return encode(json=json, body=body)
+
+
+# Both paths start from the same plain message, so building the payload is timed along with the send
+PATHS: dict[str, Callable[[dict[str, Any]], bytes]] = {
+    'validated': validated,
+    'trusted': trusted
+}
+
+
+def measure(path: Callable[[dict[str, Any]], bytes], messages: list[dict[str, Any]]) -> float:
+    """
+    CPU seconds per message to build, serialize and encode a send request body, without sending it.
+    """
+    path(messages[0])
+    started = time.process_time()
+    for message in messages:
+        path(message)
+    return (time.process_time() - started) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU per message of validated and trusted sends.')
+    parser.add_argument('--sizes', default='0,10k,100k', help='comma-separated attachment sizes, such as 0,100k,1m')
+    parser.add_argument('--count', type=int, default=5000, help='messages per path and size')
+    args = parser.parse_args()
+
+    print(f'{"size":<10}{"path":<12}{"us/msg":>10}{"saved":>10}')
+    for size in args.sizes.split(','):
+        attachment = os.urandom(parse_size(size)) if parse_size(size) else None
+        messages = [get_api_message(index=index, attachment=attachment) for index in range(args.count)]
+        # The paths differ in whitespace only
+        assert len({jsonlib.dumps(jsonlib.loads(path(messages[0])), sort_keys=True) for path in PATHS.values()}) == 1
+        baseline = None
+        for name, path in PATHS.items():
+            seconds = measure(path=path, messages=messages)
+            baseline = baseline or seconds
+            print(f'{size:<10}{name:<12}{seconds * 1e6:>10.1f}{1 - seconds / baseline:>10.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer)
+from typing import Any
+
+
+class _PostalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would otherwise delay
+    disable_nagle_algorithm = True
+    server: 'FakePostalServer'
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def _read_body(self) -> bytes:
+        if (length := self.headers.get('Content-Length')) is not None:
+            return self.rfile.read(int(length))
+        chunks = []
+        while size := int(self.rfile.readline().strip(), 16):
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        self.rfile.readline()
+        return b''.join(chunks)
+
+    def _send(self, status_code: int, body: bytes):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self._read_body())
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            return self._send(503, b'Service Unavailable')
+        if (handler := self.server.routes.get(self.path)) is None:
+            return self._send(404, b'Not Found')
+        response = {'status': 'success', 'time': 0.01, 'flags': {}, 'data': handler(request)}
+        self._send(200, json.dumps(response).encode())
+
+
+def _send_message(request: dict[str, Any]) -> dict[str, Any]:
+    recipients = [recipient for key in ('to', 'cc', 'bcc', 'rcpt_to') for recipient in request.get(key, ())]
+    return {
+        'message_id': f'{random.getrandbits(64):016x}@postal.example',
+        'messages': {recipient: {'id': index + 1, 'token': f'{index:08x}'}
+                     for index, recipient in enumerate(recipients)}
+    }
+
+
+def _get_message(request: dict[str, Any]) -> dict[str, Any]:
+    return {
+        'id': request['id'],
+        'token': 'token',
+        'status': {'status': 'Sent', 'last_delivery_attempt': time.time(), 'held': False, 'hold_expiry': None},
+        'plain_body': 'Plain body'
+    }
+
+
+def _get_deliveries(request: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{
+        'id': 1, 'status': 'Sent', 'details': 'Message accepted', 'output': '250 OK', 'sent_with_ssl': True,
+        'log_id': 'log', 'time': 0.1, 'timestamp': time.time()
+    }]
+
+
+class FakePostalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, error_rate: float = 0):
+        """
+        Stand-in for the Postal HTTP API, answering the send and message endpoints with valid responses
+        after `latency` seconds, or with HTTP 503 for an `error_rate` fraction of requests.
+        """
+        super().__init__((host, port), _PostalHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.routes = {
+            '/api/v1/send/message': _send_message,
+            '/api/v1/send/raw': _send_message,
+            '/api/v1/messages/message': _get_message,
+            '/api/v1/messages/deliveries': _get_deliveries
+        }
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakePostalServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPSinkProtocol(asyncio.Protocol):
+    def __init__(self, sink: 'SMTPSink'):
+        self._sink = sink
+        self._transport = None
+        self._buffer = bytearray()
+        self._in_data = False
+        self._data_started = False
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._sink.connections += 1
+        transport.write(b'220 sink.example ESMTP\r\n')
+
+    def _reply(self, reply: bytes):
+        if self._sink.latency:
+            asyncio.get_running_loop().call_later(self._sink.latency, self._transport.write, reply)
+        else:
+            self._transport.write(reply)
+
+    def data_received(self, data: bytes):
+        self._buffer.extend(data)
+        while True:
+            if self._in_data:
+                if self._data_started and self._buffer.startswith(b'.\r\n'):
+                    end, skip = 0, 3
+                elif (end := self._buffer.find(b'\r\n.\r\n')) != -1:
+                    skip = 5
+                else:
+                    # The message is not kept, only what may hold the start of the terminator
+                    if len(self._buffer) > 4:
+                        self._sink.bytes_received += len(self._buffer) - 4
+                        del self._buffer[:-4]
+                        self._data_started = False
+                    return
+                self._sink.bytes_received += end
+                del self._buffer[:end + skip]
+                self._in_data = False
+                if self._sink.error_rate and random.random() < self._sink.error_rate:
+                    self._reply(b'451 Temporary failure\r\n')
+                else:
+                    self._sink.messages += 1
+                    self._reply(b'250 Queued\r\n')
+                continue
+            if (end := self._buffer.find(b'\r\n')) == -1:
+                return
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end + 2]
+            verb = line.split(b' ', 1)[0].upper()
+            if verb in (b'EHLO', b'HELO'):
+                self._transport.write(b'250-sink.example\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN\r\n')
+            elif verb == b'AUTH':
+                self._transport.write(b'235 Authenticated\r\n')
+            elif verb in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self._transport.write(b'250 OK\r\n')
+            elif verb == b'DATA':
+                # An empty message ends with the terminator right away, without the preceding line break
+                self._in_data = self._data_started = True
+                self._transport.write(b'354 Go ahead\r\n')
+            elif verb == b'QUIT':
+                self._transport.write(b'221 Bye\r\n')
+                self._transport.close()
+                return
+            else:
+                self._transport.write(b'502 Not implemented\r\n')
+
+
+class SMTPSink:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, error_rate: float = 0):
+        """
+        SMTP server that accepts and discards every message, advertising PIPELINING and AUTH PLAIN.
+        The reply to each message comes after `latency` seconds, or is a 451 for an `error_rate` fraction of them.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.connections = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self._loop = None
+        self._server = None
+
+    def start(self) -> 'SMTPSink':
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        async def serve():
+            self._server = await asyncio.get_running_loop().create_server(
+                lambda: _SMTPSinkProtocol(sink=self), self.host, self.port
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+        threading.Thread(target=self._loop.run_until_complete, args=(serve(),), daemon=True).start()
+        started.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._server.close)
@@ -1,8 +1,33 @@
-from contextlib import suppress
+from importlib import import_module
+from typing import (TYPE_CHECKING,
+                    Any)
 
-from .api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
-from .api.wrapper import PostalPyAPI
-from .smtp.wrapper import PostalPySMTP
-
-with suppress(ImportError):
+if TYPE_CHECKING:
+    from .api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+    from .api.wrapper import PostalPyAPI
     from .smtp.async_wrapper import PostalPySMTP as AsyncPostalPySMTP
+    from .smtp.wrapper import PostalPySMTP
+
+# Clients are imported on first access, so a process that only sends over SMTP never loads niquests,
+# and one that only uses the API never loads smtplib or aiosmtplib
+_LAZY_ATTRIBUTES = {
+    'PostalPyAPI': ('.api.wrapper', 'PostalPyAPI'),
+    'AsyncPostalPyAPI': ('.api.async_wrapper', 'PostalPyAPI'),
+    'PostalPySMTP': ('.smtp.wrapper', 'PostalPySMTP'),
+    'AsyncPostalPySMTP': ('.smtp.async_wrapper', 'PostalPySMTP')
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> Any:
+    if (target := _LAZY_ATTRIBUTES.get(name)) is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module, attribute = target
+    value = getattr(import_module(module, __name__), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
@@ -1,49 +1,183 @@
+import asyncio
 import logging
+import time
+from collections.abc import (AsyncIterable,
+                             AsyncIterator,
+                             Hashable,
+                             Iterable)
+from email.message import EmailMessage
 from typing import Any
-from uuid import uuid4
 
 from niquests import AsyncSession
-from niquests.exceptions import ConnectTimeout
+from niquests.exceptions import (ConnectTimeout,
+                                 ReadTimeout)
 
+from ..attachments import AttachmentSource
+from ..instrumentation import Observer
+from ..offload import MessageOffload
+from ..smtp.schemas import SMTPMessageSchema
+from ..ratelimit import RateLimiter
 from .base import PostalPyAPIBase
-from .exceptions import PostalPyConnectTimeoutError
-from .schemas import (MessageExpansion,
-                      RequestMessageDetailsSchema,
+from .cache import ResponseCache
+from .concurrency import bounded_map
+from .exceptions import (PostalPyAPIError,
+                         PostalPyConnectTimeoutError,
+                         PostalPyReadTimeoutError)
+from .hedging import HedgingPolicy
+from .retry import (CircuitBreaker,
+                    RetryPolicy)
+from .schemas import (RequestMessageDetailsSchema,
                       RequestMessageSchema,
                       RequestRawMessageSchema,
+                      ResponseChunkedMessagesSchema,
                       ResponseSchema)
+from .streaming import (MessageBodyStream,
+                        PreparedMessage)
 
 
 class PostalPyAPI(PostalPyAPIBase):
-    def __init__(self, base_url: str, api_key: str, timeout: int = 5, level: logging = logging.INFO):
-        super().__init__(base_url=base_url, api_key=api_key, timeout=timeout, level=level)
+    def __init__(self, base_url: str, api_key: str, timeout: int = 5, level: logging = logging.INFO,
+                 retry_policy: RetryPolicy | None = None, circuit_breaker: CircuitBreaker | None = None,
+                 rate_limiter: RateLimiter | None = None, cache: ResponseCache | None = None,
+                 observer: Observer | None = None, hedging: HedgingPolicy | None = None,
+                 offload: MessageOffload | None = None):
+        super().__init__(base_url=base_url, api_key=api_key, timeout=timeout, level=level,
+                         retry_policy=retry_policy, circuit_breaker=circuit_breaker, rate_limiter=rate_limiter,
+                         cache=cache, observer=observer, hedging=hedging)
         self._session = AsyncSession(base_url=self._base_url, timeout=self._timeout)
         self._session.headers = self._headers
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._offload = offload
 
-    async def _send_request(self, url: str, json: dict[str, Any]) -> ResponseSchema:
-        log_json = self._get_log_json(json=json)
-        request_id = uuid4().hex
-        self._logger.info('Request=%s url=%s json=%s', request_id, url, log_json)
+    async def _send_request_once(self, url: str, json: dict[str, Any], body: MessageBodyStream | bytes | None = None,
+                                 attempt: int = 0, timeout: float | None = None) -> ResponseSchema:
+        request_id = self._log_request(url=url, json=json, body=body)
+        started = time.perf_counter()
         try:
-            response = await self._session.post(url=url, json=json)
+            response = await self._session.post(url=url, json=json if body is None else None, data=body,
+                                                timeout=timeout)
         except ConnectTimeout as e:
             self._logger.exception('Response=%s: %s', request_id, PostalPyConnectTimeoutError.__doc__)
-            raise PostalPyConnectTimeoutError(e)
-        return self._handle_response(response=response, request_id=request_id)
+            error = PostalPyConnectTimeoutError(e)
+            if self._observer is not None:
+                self._observe(url=url, started=started, attempt=attempt, error=error)
+            raise error
+        except ReadTimeout as e:
+            self._logger.exception('Response=%s: %s', request_id, PostalPyReadTimeoutError.__doc__)
+            error = PostalPyReadTimeoutError(e)
+            if self._observer is not None:
+                self._observe(url=url, started=started, attempt=attempt, error=error)
+            raise error
+        return self._handle_response(response=response, request_id=request_id, url=url, started=started,
+                                     attempt=attempt)
+
+    async def _send_request(self, url: str, json: dict[str, Any], rate_limited: bool = False,
+                            body: MessageBodyStream | bytes | None = None, timeout: float | None = None,
+                            endpoint: str | None = None) -> ResponseSchema:
+        """
+        `endpoint` records the latency of each attempt of a read with the hedging policy, without retry delays.
+        """
+        if rate_limited and self._rate_limiter is not None:
+            await self._rate_limiter.acquire_async(recipients=self._count_recipients(json=json))
+        attempt = 0
+        while True:
+            self._check_circuit()
+            attempt_started = time.perf_counter()
+            try:
+                result = await self._send_request_once(url=url, json=json, body=body, attempt=attempt,
+                                                       timeout=timeout)
+            except asyncio.CancelledError:
+                self._record_read(endpoint=endpoint, started=attempt_started)
+                raise
+            except PostalPyAPIError as e:
+                if isinstance(e, PostalPyReadTimeoutError):
+                    self._record_read(endpoint=endpoint, started=attempt_started)
+                self._record_outcome(error=e)
+                if (delay := self._get_retry_delay(error=e, attempt=attempt)) is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._record_read(endpoint=endpoint, started=attempt_started)
+            self._record_outcome()
+            return result
+
+    async def _send_hedged_request(self, url: str, json: dict[str, Any], endpoint: str, delay: float | None,
+                                   timeout: float) -> ResponseSchema:
+        if delay is None:
+            return await self._send_request(url=url, json=json, timeout=timeout, endpoint=endpoint)
+        tasks = [asyncio.ensure_future(self._send_request(url=url, json=json, timeout=timeout,
+                                                         endpoint=endpoint))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._hedging.acquire_hedge(endpoint=endpoint):
+                self._logger.info('Hedging url=%s after %.3fs', url, delay)
+                tasks.append(asyncio.ensure_future(self._send_request(url=url, json=json, timeout=timeout,
+                                                                     endpoint=endpoint)))
+            error = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except PostalPyAPIError as e:
+                    error = e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+                # Retrieved here so that a loser that failed as the winner completed is not reported as unhandled
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _send_read_request(self, url: str, json: dict[str, Any]) -> ResponseSchema:
+        """
+        Sends an idempotent read, hedged with a duplicate request when it is slower than usual.
+        The first response wins and the other request is cancelled. A read cut short by an adaptive timeout
+        is sent once more with the client's `timeout`.
+        """
+        if self._hedging is None:
+            return await self._send_request(url=url, json=json)
+        endpoint, delay, timeout = self._get_read_plan(url=url)
+        try:
+            return await self._send_hedged_request(url=url, json=json, endpoint=endpoint, delay=delay,
+                                                   timeout=timeout)
+        except PostalPyReadTimeoutError:
+            if timeout >= self._timeout:
+                raise
+        self._logger.warning('Retry url=%s after the adaptive timeout of %.3fs', url, timeout)
+        return await self._send_request(url=url, json=json, timeout=self._timeout, endpoint=endpoint)
+
+    async def _fetch_and_cache(self, url: str, json: dict[str, Any], key: Hashable, ttl: float) -> ResponseSchema:
+        result = await self._send_read_request(url=url, json=json)
+        self._cache.set(key=key, result=result, ttl=ttl)
+        return result
+
+    def _forget_inflight(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Retrieved here so that a failure nobody waited for is not reported as unhandled
+            task.exception()
+
+    async def _send_cached_request(self, url: str, json: dict[str, Any], key: Hashable,
+                                   ttl: float) -> ResponseSchema:
+        if (result := self._cache.get(key=key)) is not None:
+            return result
+        if (task := self._inflight.get(key)) is None:
+            task = self._inflight[key] = asyncio.ensure_future(
+                self._fetch_and_cache(url=url, json=json, key=key, ttl=ttl)
+            )
+            task.add_done_callback(lambda t: self._forget_inflight(key=key, task=t))
+        # Shielded, so a cancelled caller does not cancel the request other callers are waiting on
+        return await asyncio.shield(task)
 
     async def get_message_details(self, data: RequestMessageDetailsSchema) -> ResponseSchema:
         """
         https://apiv1.postalserver.io/controllers/messages/message.html
         """
         url = '/api/v1/messages/message'
-        expansions = [e for e in data.expansions or ()]
-        if MessageExpansion.all in data.expansions:
-            expansions = True
-        json = {
-            'id': data.id,
-            '_expansions': expansions
-        }
-        return await self._send_request(url=url, json=json)
+        json = self._get_message_details_json(data=data)
+        if self._cache is None:
+            return await self._send_read_request(url=url, json=json)
+        key = self._cache.get_details_key(data=data, server=self._server)
+        return await self._send_cached_request(url=url, json=json, key=key, ttl=self._cache.get_details_ttl(data=data))
 
     async def get_message_deliveries(self, id: int) -> ResponseSchema:
         """
@@ -51,15 +185,63 @@ class PostalPyAPI(PostalPyAPIBase):
         """
         url = '/api/v1/messages/deliveries'
         json = {'id': id}
-        return await self._send_request(url=url, json=json)
+        if self._cache is None:
+            return await self._send_read_request(url=url, json=json)
+        key = self._cache.get_deliveries_key(id=id, server=self._server)
+        return await self._send_cached_request(url=url, json=json, key=key, ttl=self._cache.get_deliveries_ttl())
 
-    async def send_message(self, data: RequestMessageSchema) -> ResponseSchema:
+    async def send_message(self, data: RequestMessageSchema | PreparedMessage) -> ResponseSchema:
         """
         https://apiv1.postalserver.io/controllers/send/message.html
         """
         url = '/api/v1/send/message'
-        json = data.model_dump(exclude_none=True, by_alias=True)
-        return await self._send_request(url=url, json=json)
+        if self._offload is not None and isinstance(data, RequestMessageSchema) and \
+                not any(isinstance(attachment.data, AttachmentSource) for attachment in data.attachments or ()):
+            # Only a message handed over is encoded ahead, one sent inline takes the plain path
+            json, body = await self._offload.run(self._get_encoded_message_json,
+                                                 size=self._offload.get_message_size(data=data),
+                                                 inline=self._get_message_json, data=data)
+        else:
+            json, body = self._get_message_json(data=data)
+        return await self._send_request(url=url, json=json, rate_limited=True, body=body)
+
+    async def send_messages(self, data: Iterable[RequestMessageSchema | PreparedMessage] |
+                            AsyncIterable[RequestMessageSchema | PreparedMessage],
+                            concurrency: int = 10,
+                            ordered: bool = True) -> AsyncIterator[tuple[int, ResponseSchema | PostalPyAPIError]]:
+        """
+        Sends messages through the shared session with at most `concurrency` requests in flight.
+        Yields `(index, result)` pairs in input order, or as they complete when `ordered` is False;
+        a failed message yields its `PostalPyAPIError` instead of stopping the others.
+        """
+        async for result in bounded_map(self.send_message, data, concurrency=concurrency, ordered=ordered):
+            yield result
+
+    async def send_message_chunked(self, data: RequestMessageSchema, chunk_size: int = 50,
+                                   concurrency: int = 10) -> ResponseChunkedMessagesSchema:
+        """
+        Sends a message to more recipients than Postal takes per request, such as a `RequestBulkMessageSchema`,
+        as requests with at most `chunk_size` addresses in each of `to`, `cc` and `bcc`, with at most
+        `concurrency` in flight. Each request only shows its own chunk of recipients in the headers.
+        Recipients of failed requests are mapped to their error in `failed_recipients`.
+        """
+        url = '/api/v1/send/message'
+        if self._offload is None:
+            requests = self._get_chunked_message_requests(data=data, chunk_size=chunk_size)
+        else:
+            local = any(isinstance(attachment.data, AttachmentSource) for attachment in data.attachments or ())
+            requests = await self._offload.run(self._get_chunked_message_requests,
+                                               size=self._offload.get_message_size(data=data), local=local,
+                                               data=data, chunk_size=chunk_size)
+        results = [None] * len(requests)
+
+        async def send(request: tuple[dict[str, Any], bytes]) -> ResponseSchema:
+            json, body = request
+            return await self._send_request(url=url, json=json, rate_limited=True, body=body)
+
+        async for index, result in bounded_map(send, requests, concurrency=concurrency, ordered=False):
+            results[index] = result
+        return self._merge_chunk_results(requests=requests, results=results)
 
     async def send_raw_message(self, data: RequestRawMessageSchema) -> ResponseSchema:
         """
@@ -67,7 +249,29 @@ class PostalPyAPI(PostalPyAPIBase):
         """
         url = '/api/v1/send/raw'
         json = data.model_dump(exclude_none=True)
-        return await self._send_request(url=url, json=json)
+        return await self._send_request(url=url, json=json, rate_limited=True)
+
+    async def send_raw_message_fanout(self, data: SMTPMessageSchema | EmailMessage | bytes,
+                                      rcpt_to: Iterable[str] | None = None, mail_from: str | None = None,
+                                      bounce: bool | None = None, chunk_size: int = 50,
+                                      concurrency: int = 10) -> ResponseChunkedMessagesSchema:
+        """
+        Sends one message to many recipients through `/api/v1/send/raw`, as requests with at most `chunk_size`
+        envelope recipients, with at most `concurrency` in flight. The message is built and base64-encoded once
+        for all requests. Recipients of failed requests are mapped to their error in `failed_recipients`.
+        """
+        url = '/api/v1/send/raw'
+        requests = self._get_raw_fanout_requests(data=data, rcpt_to=rcpt_to, mail_from=mail_from, bounce=bounce,
+                                                 chunk_size=chunk_size)
+        results = [None] * len(requests)
+
+        async def send(request: tuple[dict[str, Any], bytes]) -> ResponseSchema:
+            json, body = request
+            return await self._send_request(url=url, json=json, rate_limited=True, body=body)
+
+        async for index, result in bounded_map(send, requests, concurrency=concurrency, ordered=False):
+            results[index] = result
+        return self._merge_chunk_results(requests=requests, results=results)
 
     async def close(self):
         await self._session.close()
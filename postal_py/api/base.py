@@ -1,12 +1,41 @@
+import base64
+import copy
+import hashlib
+import json as jsonlib
 import logging
+import time
+from collections.abc import Iterable
+from email.message import EmailMessage
+from email.utils import (getaddresses,
+                         parseaddr,
+                         parsedate_to_datetime)
 from typing import Any
+from uuid import uuid4
 
 from niquests.models import Response
+from pydantic import ValidationError
 
-from .exceptions import (PostalPyAccessDeniedError,
+try:
+    # niquests encodes request JSON with orjson when it is installed, and a body encoded ahead is encoded alike
+    from orjson import dumps as _dumps
+except ImportError:
+    def _dumps(json: dict[str, Any]) -> bytes:
+        return jsonlib.dumps(json, allow_nan=False).encode()
+
+from ..attachments import AttachmentSource
+from ..instrumentation import (Observer,
+                               RequestEvent)
+from ..ratelimit import RateLimiter
+from ..smtp.base import PostalPySMTPBase
+from ..smtp.schemas import SMTPMessageSchema
+from .cache import ResponseCache
+from .exceptions import (PostalPyAPIError,
+                         PostalPyAccessDeniedError,
                          PostalPyAttachmentMissingDataError,
                          PostalPyAttachmentMissingNameError,
+                         PostalPyBadGatewayError,
                          PostalPyFromAddressMissingError,
+                         PostalPyGatewayTimeoutError,
                          PostalPyInternalServerError,
                          PostalPyInvalidServerAPIKeyError,
                          PostalPyMessageNotFoundError,
@@ -21,19 +50,51 @@ from .exceptions import (PostalPyAccessDeniedError,
                          PostalPyUnauthenticatedFromAddressError,
                          PostalPyUnknownError,
                          PostalPyValidationError)
-from .schemas import (ResponseCode,
+from .hedging import HedgingPolicy
+from .retry import (CircuitBreaker,
+                    RetryPolicy)
+from .schemas import (MessageExpansion,
+                      RequestMessageDetailsSchema,
+                      RequestMessageSchema,
+                      ResponseChunkedMessagesSchema,
+                      ResponseCode,
+                      ResponseDeliveriesSchema,
+                      ResponseMessageDetailsSchema,
+                      ResponseMessagesSchema,
                       ResponseSchema,
                       ResponseStatus)
+from .streaming import (RECIPIENT_FIELDS,
+                        MessageBodyStream,
+                        PreparedMessage,
+                        SharedMessageBody)
+
+RESPONSE_SCHEMAS: dict[str, type[ResponseSchema]] = {
+    '/api/v1/messages/message': ResponseMessageDetailsSchema,
+    '/api/v1/messages/deliveries': ResponseDeliveriesSchema,
+    '/api/v1/send/message': ResponseMessagesSchema,
+    '/api/v1/send/raw': ResponseMessagesSchema
+}
 
 
 class PostalPyAPIBase:
-    def __init__(self, base_url: str, api_key: str, timeout: int, level: logging):
+    def __init__(self, base_url: str, api_key: str, timeout: int, level: logging,
+                 retry_policy: RetryPolicy | None = None, circuit_breaker: CircuitBreaker | None = None,
+                 rate_limiter: RateLimiter | None = None, cache: ResponseCache | None = None,
+                 observer: Observer | None = None, hedging: HedgingPolicy | None = None):
         self._base_url = base_url
         self._timeout = timeout
+        self._retry_policy = retry_policy
+        self._circuit_breaker = circuit_breaker
+        self._rate_limiter = rate_limiter
+        self._cache = cache
+        self._observer = observer
+        self._hedging = hedging
         self._headers = {
             'X-Server-API-Key': api_key,
             'Content-Type': 'application/json'
         }
+        # The mail server an API key belongs to, without keeping the key itself in cache keys
+        self._server = base_url, hashlib.sha256(api_key.encode()).hexdigest()
         self._logger = logging.getLogger('PostalPyAPI')
         self._logger.setLevel(level)
 
@@ -45,19 +106,257 @@ class PostalPyAPIBase:
                 log_json[key] = f'<{value[:20]}...{value[-20:]}> ({length} chars)'
         return log_json
 
-    def _handle_response(self, response: Response, request_id: str) -> ResponseSchema:
+    def _log_request(self, url: str, json: dict[str, Any], body: MessageBodyStream | bytes | None = None) -> str:
+        """
+        Logs the request and returns its id. The id only ties log records together,
+        so neither the id nor the log JSON is built when INFO records are not emitted.
+        """
+        if not self._logger.isEnabledFor(logging.INFO):
+            return '-'
+        request_id = uuid4().hex
+        log_json = self._get_log_json(json=json)
+        if isinstance(body, bytes):
+            log_json['body'] = f'<{len(body)} bytes>'
+        elif body is not None:
+            log_json['attachments'] = body
+        self._logger.info('Request=%s url=%s json=%s', request_id, url, log_json)
+        return request_id
+
+    @staticmethod
+    def _get_log_content(content: bytes, limit: int = 1000) -> str:
+        text = content[:limit].decode('utf-8', 'replace')
+        return text if len(content) <= limit else f'{text}... ({len(content)} bytes)'
+
+    @staticmethod
+    def _count_recipients(json: dict[str, Any]) -> int:
+        return sum(len(json.get(key) or ()) for key in ('to', 'cc', 'bcc', 'rcpt_to'))
+
+    @staticmethod
+    def _get_message_json(
+            data: RequestMessageSchema | PreparedMessage
+    ) -> tuple[dict[str, Any], MessageBodyStream | bytes | None]:
+        """
+        The request JSON, or the JSON without attachments plus a streaming body when an attachment has to be read.
+        A prepared message is sent as its body, with its short fields as the JSON.
+        """
+        if isinstance(data, PreparedMessage):
+            return data.json, data.body
+        if not any(isinstance(attachment.data, AttachmentSource) for attachment in data.attachments or ()):
+            return data.model_dump(exclude_none=True, by_alias=True), None
+        json = data.model_dump(exclude_none=True, by_alias=True, exclude={'attachments'})
+        return json, MessageBodyStream(json=json, attachments=data.attachments)
+
+    @staticmethod
+    def _get_encoded_message_json(data: RequestMessageSchema) -> tuple[dict[str, Any], bytes]:
+        """
+        The request JSON, without attachments, and the request body encoded ahead of the send, as niquests
+        would encode it, for a message prepared off the event loop.
+        """
+        json = data.model_dump(exclude_none=True, by_alias=True)
+        body = _dumps(json)
+        json.pop('attachments', None)
+        return json, body
+
+    @staticmethod
+    def _get_chunked_message_requests(data: RequestMessageSchema,
+                                      chunk_size: int = 50) -> list[tuple[dict[str, Any], bytes]]:
+        """
+        `(json, body)` pairs with at most `chunk_size` addresses per recipient field, the n-th request taking
+        the n-th chunk of each field. Every body is spliced from one serialization of the rest of the message;
+        the JSON, without attachments, is only used for logging and rate limiting.
+        """
+        if not 1 <= chunk_size <= 50:
+            raise ValueError('chunk_size must be between 1 and 50')
+        if not any(getattr(data, name) for name in RECIPIENT_FIELDS):
+            raise ValueError('A message needs at least one recipient in to, cc or bcc')
+        shared = SharedMessageBody.from_message(data=data)
+        meta = data.model_dump(exclude_none=True, by_alias=True, exclude={*RECIPIENT_FIELDS, 'attachments'})
+        fields = {name: getattr(data, name) or [] for name in RECIPIENT_FIELDS}
+        count = max(1, *((len(addresses) + chunk_size - 1) // chunk_size for addresses in fields.values()))
+        requests = []
+        for index in range(count):
+            recipients = {name: chunk for name, addresses in fields.items()
+                          if (chunk := addresses[index * chunk_size:(index + 1) * chunk_size])}
+            requests.append(({**recipients, **meta}, shared.with_fields(fields=recipients)))
+        return requests
+
+    @staticmethod
+    def _get_raw_fanout_requests(data: SMTPMessageSchema | EmailMessage | bytes, rcpt_to: Iterable[str] | None,
+                                 mail_from: str | None, bounce: bool | None,
+                                 chunk_size: int) -> list[tuple[dict[str, Any], bytes]]:
+        """
+        `(json, body)` pairs for `/api/v1/send/raw` with at most `chunk_size` envelope recipients each,
+        all spliced around one base64 encoding of the message. Recipients and sender default to those
+        of the schema or the message headers; Bcc headers are left out of the message.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        if isinstance(data, SMTPMessageSchema):
+            rcpt_to = PostalPySMTPBase._get_recipients(data=data) if rcpt_to is None else rcpt_to
+            mail_from = mail_from or data.from_
+            data = PostalPySMTPBase._prepare_message(data=data)
+        if isinstance(data, EmailMessage):
+            if rcpt_to is None:
+                rcpt_to = [address for _, address in getaddresses(
+                    data.get_all('To', []) + data.get_all('Cc', []) + data.get_all('Bcc', [])
+                )]
+            mail_from = mail_from or data['From']
+            if 'Bcc' in data:
+                data = copy.copy(data)
+                del data['Bcc']
+            data = data.as_bytes(policy=data.policy.clone(linesep='\r\n'))
+        rcpt_to = [parseaddr(address)[1] or address for address in rcpt_to or ()]
+        if not mail_from or not rcpt_to:
+            raise ValueError('A raw message needs mail_from and rcpt_to')
+        shared = {'mail_from': parseaddr(mail_from)[1] or mail_from, 'data': base64.b64encode(data).decode()}
+        if bounce is not None:
+            shared['bounce'] = bounce
+        shared = SharedMessageBody(shared=jsonlib.dumps(shared, separators=(',', ':')).encode())
+        meta = {'mail_from': mail_from}
+        requests = []
+        for index in range(0, len(rcpt_to), chunk_size):
+            recipients = {'rcpt_to': rcpt_to[index:index + chunk_size]}
+            requests.append(({**recipients, **meta}, shared.with_fields(fields=recipients)))
+        return requests
+
+    @staticmethod
+    def _merge_chunk_results(requests: list[tuple[dict[str, Any], bytes]],
+                             results: list[ResponseSchema | PostalPyAPIError]) -> ResponseChunkedMessagesSchema:
+        merged = ResponseChunkedMessagesSchema(message_ids=[], messages={}, failed_recipients={})
+        for (json, _), result in zip(requests, results):
+            if isinstance(result, PostalPyAPIError):
+                error = f'{type(result).__name__}: {result}'
+                merged.failed_recipients.update(
+                    (address, error) for name in (*RECIPIENT_FIELDS, 'rcpt_to') for address in json.get(name, ())
+                )
+                continue
+            merged.message_ids.append(result.data.message_id)
+            merged.messages.update(result.data.messages)
+        return merged
+
+    @staticmethod
+    def _get_message_details_json(data: RequestMessageDetailsSchema) -> dict[str, Any]:
+        expansions = [e for e in data.expansions or ()]
+        if MessageExpansion.all in expansions:
+            expansions = True
+        return {
+            'id': data.id,
+            '_expansions': expansions
+        }
+
+    def _get_read_plan(self, url: str) -> tuple[str, float | None, float]:
+        """
+        The endpoint a hedged read is tracked under, after how many seconds it is hedged, None if it is not,
+        and its read timeout.
+        """
+        endpoint = f'{self._base_url}{url}'
+        return (endpoint, self._hedging.get_delay(endpoint=endpoint),
+                self._hedging.get_timeout(endpoint=endpoint, timeout=self._timeout))
+
+    def _record_read(self, endpoint: str | None, started: float):
+        """
+        Records a read attempt of a hedged `endpoint`, if any. Reads that timed out or lost to their hedge
+        are recorded too, as they were at least this slow and leaving them out would hide the slow reads.
+        """
+        if endpoint is not None:
+            self._hedging.record(endpoint=endpoint, duration=time.perf_counter() - started)
+
+    @staticmethod
+    def _get_retry_after(response: Response) -> float | None:
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _check_circuit(self):
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.check()
+
+    def _record_outcome(self, error: PostalPyAPIError | None = None):
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.record(error=error)
+
+    def _get_retry_delay(self, error: PostalPyAPIError, attempt: int) -> float | None:
+        if self._retry_policy is None:
+            return None
+        delay = self._retry_policy.get_delay(error=error, attempt=attempt)
+        if delay is not None:
+            self._logger.warning('Retry attempt=%s delay=%.2f error=%s', attempt + 1, delay, type(error).__name__)
+        return delay
+
+    @staticmethod
+    def _parse_response(content: bytes, url: str) -> ResponseSchema:
+        """
+        Validates the response bytes directly, without building an intermediate dict.
+        """
+        schema = RESPONSE_SCHEMAS.get(url, ResponseSchema)
+        try:
+            return schema.model_validate_json(content)
+        except ValidationError:
+            if schema is ResponseSchema:
+                raise
+        # Error responses carry a `code` and `message` instead of the endpoint's data
+        return ResponseSchema.model_validate_json(content)
+
+    def _observe(self, url: str, started: float, attempt: int, response: Response | None = None,
+                 error: BaseException | None = None, parse_time: float | None = None):
+        duration = time.perf_counter() - started
+        event = RequestEvent(client='api', operation=url, started_at=time.time() - duration, duration=duration,
+                             error=error, attempt=attempt)
+        if response is not None:
+            event.status_code = response.status_code
+            body = response.request.body
+            event.request_bytes = len(body) if isinstance(body, (bytes, str)) else getattr(body, 'len', None)
+            event.response_bytes = len(response.content or b'')
+            if (info := response.conn_info) is not None:
+                for phase, latency in (('resolve', info.resolution_latency), ('connect', info.established_latency),
+                                       ('tls', info.tls_handshake_latency), ('send', info.request_sent_latency)):
+                    if latency is not None:
+                        event.timings[phase] = latency.total_seconds()
+            if response.elapsed is not None:
+                event.timings['wait'] = response.elapsed.total_seconds()
+        if parse_time is not None:
+            event.timings['parse'] = parse_time
+        self._observer.on_event(event)
+
+    def _handle_response(self, response: Response, request_id: str, url: str, started: float | None = None,
+                         attempt: int = 0) -> ResponseSchema:
+        if self._observer is None:
+            return self._check_response(response=response, request_id=request_id, url=url)
+        # Resolves a lazy response first, so waiting for it does not count as parsing
+        response.status_code
+        parse_started = time.perf_counter()
+        try:
+            result = self._check_response(response=response, request_id=request_id, url=url)
+        except PostalPyAPIError as e:
+            self._observe(url=url, started=started or parse_started, attempt=attempt, response=response, error=e,
+                          parse_time=time.perf_counter() - parse_started)
+            raise
+        self._observe(url=url, started=started or parse_started, attempt=attempt, response=response,
+                      parse_time=time.perf_counter() - parse_started)
+        return result
+
+    def _check_response(self, response: Response, request_id: str, url: str) -> ResponseSchema:
         if response.status_code != 200:
             exception = {
                 301: PostalPyMovedPermanentlyError,
                 308: PostalPyPermanentRedirectError,
                 500: PostalPyInternalServerError,
-                503: PostalPyServiceUnavailableError
+                502: PostalPyBadGatewayError,
+                503: PostalPyServiceUnavailableError,
+                504: PostalPyGatewayTimeoutError
             }.get(response.status_code, PostalPyUnknownError)
             self._logger.error('Response=%s status_code=%s reason=%s: %s', request_id, response.status_code,
                                response.reason or 'No reason', exception.__doc__)
-            raise exception(exception.__doc__)
-        json_response = response.json()
-        result = ResponseSchema(**json_response)
+            error = exception(exception.__doc__)
+            error.retry_after = self._get_retry_after(response=response)
+            raise error
+        result = self._parse_response(content=response.content, url=url)
         if result.status in (ResponseStatus.error, ResponseStatus.parameter_error):
             exception = {
                 ResponseCode.ACCESS_DENIED: PostalPyAccessDeniedError,
@@ -75,8 +374,10 @@ class PostalPyAPIBase:
                 ResponseCode.ATTACHMENT_MISSING_DATA: PostalPyAttachmentMissingDataError
             }[result.data.code]
             self._logger.error('Response=%s status_code=%s json_response=%s',
-                               request_id, response.status_code, json_response)
-            raise exception(json_response)
-        self._logger.info('Response=%s status_code=%s json_response=%s',
-                          request_id, response.status_code, json_response)
+                               request_id, response.status_code, self._get_log_content(content=response.content))
+            # The validated response is reused, the body is not parsed again
+            raise exception(result.model_dump(mode='json', exclude_none=True))
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info('Response=%s status_code=%s json_response=%s',
+                              request_id, response.status_code, self._get_log_content(content=response.content))
         return result
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from .schemas import (MessageExpansion,
+                      RequestMessageDetailsSchema,
+                      ResponseSchema)
+
+# Parts of a message that never change once it exists can be kept for long, status and activity cannot
+DEFAULT_EXPANSION_TTLS = {
+    MessageExpansion.details: 86400,
+    MessageExpansion.inspection: 86400,
+    MessageExpansion.plain_body: 86400,
+    MessageExpansion.html_body: 86400,
+    MessageExpansion.attachments: 86400,
+    MessageExpansion.headers: 86400,
+    MessageExpansion.raw_message: 86400,
+    MessageExpansion.status: 10,
+    MessageExpansion.activity_entries: 30
+}
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int | None = None,
+                 ttls: dict[MessageExpansion, float] | None = None, default_ttl: float = 86400,
+                 deliveries_ttl: float = 10):
+        """
+        LRU cache for `get_message_details` and `get_message_deliveries` responses.
+        A details response lives for the shortest TTL among its expansions, `default_ttl` when none were asked.
+        `max_bytes` bounds the total size of the cached responses serialized as JSON.
+        Cached responses are shared between callers and must not be mutated.
+        Message ids belong to one mail server, so keys include the `server` of the client, and one cache can be
+        shared by clients of several servers.
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttls = {**DEFAULT_EXPANSION_TTLS, **(ttls or {})}
+        self._default_ttl = default_ttl
+        self._deliveries_ttl = deliveries_ttl
+        self._entries: OrderedDict[Hashable, tuple[ResponseSchema, float, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize_expansions(data: RequestMessageDetailsSchema) -> frozenset[MessageExpansion]:
+        expansions = frozenset(data.expansions or ())
+        if MessageExpansion.all in expansions:
+            return frozenset(MessageExpansion) - {MessageExpansion.all}
+        return expansions
+
+    def get_details_key(self, data: RequestMessageDetailsSchema,
+                        server: Hashable) -> tuple[str, Hashable, int, frozenset[MessageExpansion]]:
+        return 'details', server, data.id, self._normalize_expansions(data=data)
+
+    def get_details_ttl(self, data: RequestMessageDetailsSchema) -> float:
+        expansions = self._normalize_expansions(data=data)
+        return min((self._ttls.get(e, self._default_ttl) for e in expansions), default=self._default_ttl)
+
+    @staticmethod
+    def get_deliveries_key(id: int, server: Hashable) -> tuple[str, Hashable, int]:
+        return 'deliveries', server, id
+
+    def get_deliveries_ttl(self) -> float:
+        return self._deliveries_ttl
+
+    def get(self, key: Hashable) -> ResponseSchema | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            result, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._size -= size
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def set(self, key: Hashable, result: ResponseSchema, ttl: float):
+        if ttl <= 0:
+            return
+        size = len(result.model_dump_json()) if self._max_bytes is not None else 0
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        with self._lock:
+            if (entry := self._entries.pop(key, None)) is not None:
+                self._size -= entry[2]
+            self._entries[key] = (result, time.monotonic() + ttl, size)
+            self._size += size
+            while len(self._entries) > self._max_entries or (
+                    self._max_bytes is not None and self._size > self._max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+from collections.abc import (AsyncIterable,
+                             AsyncIterator,
+                             Awaitable,
+                             Callable,
+                             Iterable)
+from typing import TypeVar
+
+from .exceptions import PostalPyAPIError
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+async def _iterate(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _call(func: Callable[[T], Awaitable[R]], item: T) -> R | PostalPyAPIError:
+    try:
+        return await func(item)
+    except PostalPyAPIError as e:
+        return e
+
+
+async def bounded_map(func: Callable[[T], Awaitable[R]], items: Iterable[T] | AsyncIterable[T], concurrency: int,
+                      ordered: bool = True) -> AsyncIterator[tuple[int, R | PostalPyAPIError]]:
+    """
+    Runs `func` over `items` with at most `concurrency` calls in flight and yields `(index, result)` pairs,
+    in input order or as they complete. Items are pulled lazily, a `PostalPyAPIError` becomes the result
+    of its item instead of aborting the others.
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    iterator = _iterate(items)
+    pending: deque[tuple[int, asyncio.Task]] = deque()
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await anext(iterator)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.append((index, asyncio.ensure_future(_call(func, item))))
+                index += 1
+            if not pending:
+                return
+            if ordered:
+                task_index, task = pending.popleft()
+                yield task_index, await task
+                continue
+            done, _ = await asyncio.wait([task for _, task in pending], return_when=asyncio.FIRST_COMPLETED)
+            for entry in [entry for entry in pending if entry[1] in done]:
+                pending.remove(entry)
+                yield entry[0], entry[1].result()
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await iterator.aclose()
@@ -1,6 +1,8 @@
 class PostalPyAPIError(Exception):
     """Base exception class for all PostalPy API-related errors."""
 
+    retry_after: float | None = None
+
 
 class PostalPyInvalidServerAPIKeyError(PostalPyAPIError):
     """The API token provided in X-Server-API-Key was not valid."""
@@ -58,6 +60,14 @@ class PostalPyConnectTimeoutError(PostalPyAPIError):
     """The request to the Postal API timed out while attempting to connect."""
 
 
+class PostalPyReadTimeoutError(PostalPyAPIError):
+    """The request to the Postal API timed out while waiting for the response."""
+
+
+class PostalPyCircuitOpenError(PostalPyAPIError):
+    """The Postal API is failing, requests are rejected until the circuit breaker recovers."""
+
+
 class PostalPyMovedPermanentlyError(PostalPyAPIError):
     """The resource has been permanently moved (HTTP 301). Try using HTTPS instead of HTTP."""
 
@@ -70,9 +80,17 @@ class PostalPyInternalServerError(PostalPyAPIError):
     """The Postal server encountered an internal error (HTTP 500)."""
 
 
+class PostalPyBadGatewayError(PostalPyAPIError):
+    """A proxy in front of the Postal server received an invalid response from it (HTTP 502)."""
+
+
 class PostalPyServiceUnavailableError(PostalPyAPIError):
     """The Postal service is temporarily unavailable (HTTP 503)."""
 
 
+class PostalPyGatewayTimeoutError(PostalPyAPIError):
+    """A proxy in front of the Postal server timed out waiting for it (HTTP 504)."""
+
+
 class PostalPyUnknownError(PostalPyAPIError):
     """An unknown error occurred while communicating with the Postal API."""
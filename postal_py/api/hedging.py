@@ -0,0 +1,118 @@
+import math
+import threading
+from collections import deque
+from typing import Any
+
+# Hedges an endpoint can save up while reads are fast, and spend at once when they slow down
+HEDGE_BURST = 10
+
+
+class HedgingPolicy:
+    def __init__(self, delay_percentile: float = 95, min_delay: float = 0.01, max_delay: float | None = None,
+                 max_hedge_ratio: float = 0.1, timeout_percentile: float = 99, timeout_multiplier: float = 3,
+                 min_timeout: float = 1, window: int = 1000, min_samples: int = 20, max_workers: int = 16):
+        """
+        Hedging for the idempotent `get_message_details` and `get_message_deliveries` calls: when a read
+        has not completed after the `delay_percentile` latency of its endpoint, a duplicate is sent and
+        the first response wins. Sends are never hedged. At most about `max_hedge_ratio` of the reads are hedged,
+        so a slow endpoint is not sent twice the load.
+        The same latencies, of the last `window` reads per endpoint, set a read timeout of
+        `timeout_multiplier` times the `timeout_percentile` latency, at least `min_timeout` and at most
+        the client's `timeout`. Until an endpoint has `min_samples` reads it is not hedged, and until it has
+        enough reads to tell its `timeout_percentile` from its slowest read, 100 for p99, its timeout is kept.
+        Synchronous clients run hedged reads on up to `max_workers` threads; while all of them are taken,
+        losing reads still finishing included, further reads are sent unhedged on the calling thread.
+        One policy can be shared by several clients, as endpoints are told apart by their full URL.
+        """
+        self._delay_percentile = delay_percentile
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._max_hedge_ratio = max_hedge_ratio
+        self._timeout_percentile = timeout_percentile
+        self._timeout_multiplier = timeout_multiplier
+        self._min_timeout = min_timeout
+        self._window = window
+        self._min_samples = min_samples
+        self.max_workers = max_workers
+        self._latencies: dict[str, deque[float]] = {}
+        self._sorted: dict[str, list[float]] = {}
+        self._hedges: dict[str, int] = {}
+        self._tokens: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, duration: float):
+        """
+        Records a read. A read that timed out is recorded with the time it took to time out, so that timeouts
+        which are too short raise the percentiles they are derived from.
+        """
+        with self._lock:
+            if (latencies := self._latencies.get(endpoint)) is None:
+                latencies = self._latencies[endpoint] = deque(maxlen=self._window)
+            latencies.append(duration)
+            self._sorted.pop(endpoint, None)
+            # Rounded, as ten reads at a ratio of 0.1 would otherwise add up to just below a whole hedge
+            tokens = round(self._tokens.get(endpoint, 0.0) + self._max_hedge_ratio, 9)
+            self._tokens[endpoint] = min(HEDGE_BURST, tokens)
+
+    def acquire_hedge(self, endpoint: str) -> bool:
+        """
+        Whether a slow read of `endpoint` may be hedged now, counting the hedge if so.
+        """
+        with self._lock:
+            if (tokens := self._tokens.get(endpoint, 0.0)) < 1:
+                return False
+            self._tokens[endpoint] = tokens - 1
+            self._hedges[endpoint] = self._hedges.get(endpoint, 0) + 1
+            return True
+
+    def get_percentile(self, q: float, endpoint: str, min_samples: int | None = None) -> float | None:
+        """
+        The `q` (0-100) percentile of the recent latencies of `endpoint`, None until it has `min_samples`,
+        by default those of the policy.
+        """
+        min_samples = self._min_samples if min_samples is None else min_samples
+        with self._lock:
+            if len(latencies := self._latencies.get(endpoint, ())) < min_samples:
+                return None
+            if (ordered := self._sorted.get(endpoint)) is None:
+                # Sorted once per new sample at most, however many reads ask in between
+                ordered = self._sorted[endpoint] = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def get_delay(self, endpoint: str) -> float | None:
+        """
+        Seconds after which a read of `endpoint` is hedged, None if it should not be.
+        """
+        if (delay := self.get_percentile(q=self._delay_percentile, endpoint=endpoint)) is None:
+            return None
+        delay = max(self._min_delay, delay)
+        return delay if self._max_delay is None else min(self._max_delay, delay)
+
+    def get_timeout(self, endpoint: str, timeout: float) -> float:
+        min_samples = max(self._min_samples, math.ceil(100 / (100 - self._timeout_percentile)))
+        if (latency := self.get_percentile(q=self._timeout_percentile, endpoint=endpoint,
+                                           min_samples=min_samples)) is None:
+            return timeout
+        return min(timeout, max(self._min_timeout, latency * self._timeout_multiplier))
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            counts = {endpoint: len(latencies) for endpoint, latencies in self._latencies.items()}
+            hedges = dict(self._hedges)
+        return {
+            endpoint: {
+                'count': count,
+                'hedges': hedges.get(endpoint, 0),
+                'delay': self.get_delay(endpoint=endpoint),
+                'p50': self.get_percentile(q=50, endpoint=endpoint),
+                'p99': self.get_percentile(q=99, endpoint=endpoint)
+            }
+            for endpoint, count in counts.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._sorted.clear()
+            self._hedges.clear()
+            self._tokens.clear()
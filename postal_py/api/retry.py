@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+from .exceptions import (PostalPyAPIError,
+                         PostalPyBadGatewayError,
+                         PostalPyCircuitOpenError,
+                         PostalPyConnectTimeoutError,
+                         PostalPyGatewayTimeoutError,
+                         PostalPyInternalServerError,
+                         PostalPyReadTimeoutError,
+                         PostalPyServiceUnavailableError)
+
+
+class RetryPolicy:
+    def __init__(self, retries: dict[type[PostalPyAPIError], int] | None = None, backoff: float = 0.5,
+                 max_backoff: float = 30, jitter: bool = True):
+        """
+        Exponential backoff with full jitter. `retries` maps an error class to its number of retries,
+        by default 503 and connect timeouts are retried 3 times. Read timeouts are not retried unless
+        configured, because the request may already have been processed.
+        A Retry-After header raises the delay, but a longer one than `max_backoff` is not waited for.
+        """
+        self._retries = retries if retries is not None else {
+            PostalPyServiceUnavailableError: 3,
+            PostalPyConnectTimeoutError: 3
+        }
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._jitter = jitter
+
+    def get_delay(self, error: PostalPyAPIError, attempt: int) -> float | None:
+        """
+        Seconds to wait before retrying after `attempt` retries, None if the error should be raised.
+        """
+        retries = next((count for cls, count in self._retries.items() if isinstance(error, cls)), 0)
+        if attempt >= retries:
+            return None
+        delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+        if self._jitter:
+            delay = random.uniform(0, delay)
+        if error.retry_after is not None:
+            if error.retry_after > self._max_backoff:
+                return None
+            delay = max(delay, error.retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30,
+                 failure_errors: tuple[type[PostalPyAPIError], ...] = (PostalPyConnectTimeoutError,
+                                                                       PostalPyReadTimeoutError,
+                                                                       PostalPyInternalServerError,
+                                                                       PostalPyBadGatewayError,
+                                                                       PostalPyServiceUnavailableError,
+                                                                       PostalPyGatewayTimeoutError)):
+        """
+        Opens after `failure_threshold` consecutive `failure_errors` and rejects requests for `recovery_timeout`
+        seconds, then lets a single probe request through to decide whether to close again.
+        Thread-safe, so one breaker can be shared by several clients.
+        """
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._failure_errors = failure_errors
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_started_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            # A probe that never reported back does not keep the circuit blocked forever
+            started_at = self._probe_started_at if self._probe_started_at is not None else self._opened_at
+            if now - started_at < self._recovery_timeout:
+                raise PostalPyCircuitOpenError(PostalPyCircuitOpenError.__doc__)
+            self._probe_started_at = now
+
+    def record(self, error: PostalPyAPIError | None = None):
+        with self._lock:
+            self._probe_started_at = None
+            if not isinstance(error, self._failure_errors):
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
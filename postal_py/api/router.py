@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import (AsyncIterable,
+                             AsyncIterator,
+                             Awaitable,
+                             Callable,
+                             Iterable)
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+from typing import (Any,
+                    TypeVar)
+
+from .async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from .concurrency import bounded_map
+from .exceptions import (PostalPyAPIError,
+                         PostalPyBadGatewayError,
+                         PostalPyCircuitOpenError,
+                         PostalPyConnectTimeoutError,
+                         PostalPyGatewayTimeoutError,
+                         PostalPyInternalServerError,
+                         PostalPyReadTimeoutError,
+                         PostalPyServiceUnavailableError)
+from .schemas import (RequestMessageDetailsSchema,
+                      RequestMessageSchema,
+                      RequestRawMessageSchema,
+                      ResponseSchema)
+from .streaming import PreparedMessage
+from .wrapper import PostalPyAPI
+
+T = TypeVar('T')
+
+# Errors of an endpoint that is down or unreachable, after which another endpoint is tried. A 500 is left out,
+# as Postal may have queued the message before failing, and a send to another endpoint could deliver it twice
+FAILOVER_ERRORS = (PostalPyConnectTimeoutError, PostalPyBadGatewayError, PostalPyServiceUnavailableError,
+                   PostalPyGatewayTimeoutError, PostalPyCircuitOpenError)
+# Reads are idempotent, so they also move on after a 500 or a read timeout
+READ_FAILOVER_ERRORS = FAILOVER_ERRORS + (PostalPyInternalServerError, PostalPyReadTimeoutError)
+POLICIES = ('round_robin', 'least_inflight', 'domain')
+
+
+class Endpoint:
+    __slots__ = ('name', 'base_url', 'api_key', 'weight', 'domains', 'in_flight', 'latency', 'error_rate',
+                 'failures', 'down_until', 'current_weight')
+
+    def __init__(self, base_url: str, api_key: str, weight: int = 1, domains: Iterable[str] = (),
+                 name: str | None = None):
+        """
+        A Postal node and the API key of one of its mail servers. `domains` are the sender domains
+        the `domain` policy sends through this endpoint. `name` defaults to `base_url`.
+        """
+        self.name = name or base_url
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight
+        self.domains = frozenset(domain.lower() for domain in domains)
+        self.in_flight = 0
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.down_until = 0.0
+        self.current_weight = 0
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(name={self.name!r}, weight={self.weight}, in_flight={self.in_flight})'
+
+
+class EndpointPool:
+    def __init__(self, endpoints: Iterable[Endpoint], policy: str = 'round_robin', alpha: float = 0.2,
+                 cooldown: float = 5, max_cooldown: float = 300, slow_factor: float = 3,
+                 max_error_rate: float = 0.5):
+        """
+        Picks endpoints by `policy` and tracks their health. Latency and error rate are moving averages
+        weighted by `alpha`. An endpoint that fails over is left out for `cooldown` seconds, doubled with each
+        consecutive failure up to `max_cooldown`. An endpoint `slow_factor` times slower than the fastest
+        sits out a cooldown as well. While others are healthy, endpoints whose error rate exceeds `max_error_rate`
+        are left out too.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}')
+        self.endpoints = list(endpoints)
+        if not self.endpoints:
+            raise ValueError('At least one endpoint is required')
+        if len({endpoint.name for endpoint in self.endpoints}) != len(self.endpoints):
+            raise ValueError('Endpoint names must be unique')
+        self._policy = policy
+        self._alpha = alpha
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._slow_factor = slow_factor
+        self._max_error_rate = max_error_rate
+        self._by_name = {endpoint.name: endpoint for endpoint in self.endpoints}
+        self._lock = threading.Lock()
+
+    def _get_candidates(self, domain: str | None, exclude: set[str]) -> list[Endpoint]:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.name not in exclude]
+        if self._policy == 'domain' and domain is not None:
+            candidates = [endpoint for endpoint in candidates if domain in endpoint.domains] or candidates
+        now = time.monotonic()
+        if not (healthy := [endpoint for endpoint in candidates if endpoint.down_until <= now]):
+            # Every endpoint is cooling down, the one that comes back first is the best guess
+            return [min(candidates, key=lambda endpoint: endpoint.down_until)] if candidates else []
+        if len(healthy) > 1:
+            latencies = [endpoint.latency for endpoint in healthy if endpoint.latency is not None]
+            fastest = min(latencies) if latencies else None
+            kept = []
+            for endpoint in healthy:
+                if fastest is not None and endpoint.latency is not None and \
+                        endpoint.latency > fastest * self._slow_factor:
+                    # Sits out a cooldown, then gets a fresh latency average, so it is measured again
+                    endpoint.latency = None
+                    endpoint.down_until = now + self._cooldown
+                elif endpoint.error_rate <= self._max_error_rate:
+                    kept.append(endpoint)
+            healthy = kept or healthy
+        return healthy
+
+    def get(self, name: str) -> Endpoint:
+        if (endpoint := self._by_name.get(name)) is None:
+            raise ValueError(f'Unknown endpoint {name!r}')
+        return endpoint
+
+    def acquire(self, domain: str | None = None, exclude: set[str] | None = None,
+                name: str | None = None) -> Endpoint | None:
+        """
+        Picks an endpoint, or the one called `name`, and counts the request as in flight on it.
+        None when every endpoint is excluded.
+        """
+        with self._lock:
+            if name is not None:
+                endpoint = self.get(name=name)
+            elif not (candidates := self._get_candidates(domain=domain, exclude=exclude or set())):
+                return None
+            elif self._policy == 'least_inflight':
+                endpoint = min(candidates, key=lambda e: ((e.in_flight + 1) / e.weight, e.latency or 0.0))
+            else:
+                # Smooth weighted round-robin, which interleaves endpoints instead of sending runs to each
+                total = 0
+                for candidate in candidates:
+                    candidate.current_weight += candidate.weight
+                    total += candidate.weight
+                endpoint = max(candidates, key=lambda e: e.current_weight)
+                endpoint.current_weight -= total
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: float | None, error: PostalPyAPIError | None = None,
+                failover: bool = False):
+        """
+        Records the outcome of a request. `failover` marks errors that put the endpoint in question,
+        a `latency` of None a request that ended without an outcome.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.error_rate += self._alpha * (failover - endpoint.error_rate)
+            if failover:
+                endpoint.failures += 1
+                endpoint.down_until = time.monotonic() + min(self._max_cooldown,
+                                                             self._cooldown * 2 ** (endpoint.failures - 1))
+                return
+            endpoint.failures = 0
+            if error is None and latency is not None:
+                endpoint.latency = latency if endpoint.latency is None else \
+                    endpoint.latency + self._alpha * (latency - endpoint.latency)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                endpoint.name: {
+                    'in_flight': endpoint.in_flight,
+                    'latency': endpoint.latency,
+                    'error_rate': endpoint.error_rate,
+                    'down_for': max(0.0, endpoint.down_until - now)
+                }
+                for endpoint in self.endpoints
+            }
+
+
+class PostalPyAPIRouterBase:
+    def __init__(self, endpoints: Iterable[Endpoint], policy: str, max_attempts: int | None, cooldown: float,
+                 slow_factor: float, level: logging):
+        self._pool = EndpointPool(endpoints=endpoints, policy=policy, cooldown=cooldown, slow_factor=slow_factor)
+        self._max_attempts = max_attempts or len(self._pool.endpoints)
+        self._logger = logging.getLogger('PostalPyAPIRouter')
+        self._logger.setLevel(level)
+
+    @property
+    def endpoints(self) -> list[Endpoint]:
+        return self._pool.endpoints
+
+    def get_health(self) -> dict[str, dict[str, Any]]:
+        return self._pool.snapshot()
+
+    @staticmethod
+    def _get_domain(address: str | None) -> str | None:
+        if not address:
+            return None
+        return parseaddr(address)[1].rpartition('@')[2].lower() or None
+
+    def _get_message_domain(self, data: RequestMessageSchema | PreparedMessage) -> str | None:
+        if isinstance(data, PreparedMessage):
+            return self._get_domain(address=data.json.get('sender') or data.json.get('from'))
+        return self._get_domain(address=data.sender or data.from_)
+
+    def _get_read_exclude(self, endpoint: str | None) -> set[str]:
+        """
+        Endpoints a read must not be sent to. Message ids belong to one mail server, so reads are routed
+        only among the endpoints sharing the API key of `endpoint`, which is required with several mail servers.
+        """
+        if endpoint is None:
+            if len({item.api_key for item in self.endpoints}) > 1:
+                raise ValueError('Endpoints belong to several mail servers, reads need the endpoint to ask')
+            return set()
+        api_key = self._pool.get(name=endpoint).api_key
+        return {item.name for item in self.endpoints if item.api_key != api_key}
+
+    def _acquire(self, domain: str | None, tried: set[str], exclude: set[str], endpoint: str | None,
+                 error: PostalPyAPIError | None) -> Endpoint:
+        if len(tried) >= self._max_attempts or \
+                (selected := self._pool.acquire(domain=domain, exclude=tried | exclude, name=endpoint)) is None:
+            raise error
+        return selected
+
+    def _release(self, endpoint: Endpoint, started: float, error: PostalPyAPIError | None,
+                 failover_errors: tuple[type[PostalPyAPIError], ...]) -> bool:
+        failover = isinstance(error, failover_errors)
+        self._pool.release(endpoint=endpoint, latency=time.perf_counter() - started, error=error, failover=failover)
+        if failover:
+            self._logger.warning('Endpoint=%s failed over: %s', endpoint.name, type(error).__name__)
+        return failover
+
+
+class PostalPyAPIRouter(PostalPyAPIRouterBase):
+    def __init__(self, endpoints: Iterable[Endpoint], policy: str = 'round_robin', max_attempts: int | None = None,
+                 cooldown: float = 5, slow_factor: float = 3, level: logging = logging.INFO, **kwargs: Any):
+        """
+        `PostalPyAPI` over several endpoints, picking one per request by `policy`: `round_robin` (weighted),
+        `least_inflight` or `domain` (the sender's domain, round-robin among matching endpoints).
+        A request that fails with a connect timeout, HTTP 502, 503 or 504 or an open circuit moves on to
+        another endpoint, up to `max_attempts` endpoints, all by default. Reads also move on after HTTP 500
+        or a read timeout, a send is not repeated elsewhere once Postal may have queued it. `kwargs` configure the client of every endpoint.
+        Message ids belong to the mail server that sent the message, so reads go to, and fail over among,
+        the endpoints sharing the API key of `endpoint`, which reads require with several mail servers.
+        """
+        super().__init__(endpoints=endpoints, policy=policy, max_attempts=max_attempts, cooldown=cooldown,
+                         slow_factor=slow_factor, level=level)
+        self._clients = {endpoint.name: PostalPyAPI(base_url=endpoint.base_url, api_key=endpoint.api_key,
+                                                    level=level, **kwargs)
+                         for endpoint in self.endpoints}
+        self._executor = ThreadPoolExecutor(max_workers=len(self._clients), thread_name_prefix='PostalPyAPIRouter')
+
+    def _call(self, method: str, data: Any, domain: str | None = None, endpoint: str | None = None,
+              exclude: set[str] = frozenset(),
+              failover_errors: tuple[type[PostalPyAPIError], ...] = FAILOVER_ERRORS) -> ResponseSchema:
+        tried = set()
+        error = None
+        while True:
+            selected = self._acquire(domain=domain, tried=tried, exclude=exclude, endpoint=endpoint, error=error)
+            tried.add(selected.name)
+            started = time.perf_counter()
+            try:
+                result = getattr(self._clients[selected.name], method)(data)
+            except PostalPyAPIError as e:
+                if not self._release(endpoint=selected, started=started, error=e,
+                                     failover_errors=failover_errors) or endpoint is not None:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                self._pool.release(endpoint=selected, latency=None)
+                raise
+            self._release(endpoint=selected, started=started, error=None, failover_errors=failover_errors)
+            return result
+
+    def _call_batch(self, method: str, data: list[Any], batch_size: int, domains: list[str | None],
+                    endpoint: str | None = None, exclude: set[str] = frozenset(),
+                    failover_errors: tuple[type[PostalPyAPIError], ...] = FAILOVER_ERRORS
+                    ) -> list[ResponseSchema | PostalPyAPIError]:
+        results: list[Any] = [None] * len(data)
+        tried: list[set[str]] = [set() for _ in data]
+        pending = list(range(len(data)))
+        while pending:
+            groups: dict[str, tuple[Endpoint, list[int]]] = {}
+            for index in pending:
+                if len(tried[index]) >= self._max_attempts or (selected := self._pool.acquire(
+                        domain=domains[index], exclude=tried[index] | exclude, name=endpoint)) is None:
+                    continue
+                tried[index].add(selected.name)
+                groups.setdefault(selected.name, (selected, []))[1].append(index)
+
+            def run(selected: Endpoint, indexes: list[int]) -> tuple[Endpoint, list[int], list[Any], float]:
+                started = time.perf_counter()
+                try:
+                    batch = getattr(self._clients[selected.name], method)([data[i] for i in indexes],
+                                                                          batch_size=batch_size)
+                except BaseException:
+                    for _ in indexes:
+                        self._pool.release(endpoint=selected, latency=None)
+                    raise
+                return selected, indexes, batch, started
+
+            # Endpoints are called in parallel, so a slow one delays only its own share of the batch
+            futures = [self._executor.submit(run, selected, indexes) for selected, indexes in groups.values()]
+            pending = []
+            failure = None
+            for future in futures:
+                try:
+                    selected, indexes, batch, started = future.result()
+                except BaseException as e:
+                    # The other shares are still settled, so no request is left counted as in flight
+                    failure = failure or e
+                    continue
+                for index, result in zip(indexes, batch):
+                    error = result if isinstance(result, PostalPyAPIError) else None
+                    results[index] = result
+                    if self._release(endpoint=selected, started=started, error=error,
+                                     failover_errors=failover_errors) and endpoint is None:
+                        pending.append(index)
+            if failure is not None:
+                raise failure
+        return results
+
+    def get_message_details(self, data: RequestMessageDetailsSchema, endpoint: str | None = None) -> ResponseSchema:
+        return self._call('get_message_details', data, exclude=self._get_read_exclude(endpoint=endpoint),
+                          failover_errors=READ_FAILOVER_ERRORS)
+
+    def get_message_details_batch(self, data: Iterable[RequestMessageDetailsSchema], batch_size: int = 100,
+                                  endpoint: str | None = None) -> list[ResponseSchema | PostalPyAPIError]:
+        data = list(data)
+        return self._call_batch('get_message_details_batch', data, batch_size=batch_size,
+                                domains=[None] * len(data), exclude=self._get_read_exclude(endpoint=endpoint),
+                                failover_errors=READ_FAILOVER_ERRORS)
+
+    def get_message_deliveries(self, id: int, endpoint: str | None = None) -> ResponseSchema:
+        return self._call('get_message_deliveries', id, exclude=self._get_read_exclude(endpoint=endpoint),
+                          failover_errors=READ_FAILOVER_ERRORS)
+
+    def get_deliveries_batch(self, ids: Iterable[int], batch_size: int = 100,
+                             endpoint: str | None = None) -> list[ResponseSchema | PostalPyAPIError]:
+        ids = list(ids)
+        return self._call_batch('get_deliveries_batch', ids, batch_size=batch_size, domains=[None] * len(ids),
+                                exclude=self._get_read_exclude(endpoint=endpoint),
+                                failover_errors=READ_FAILOVER_ERRORS)
+
+    def send_message(self, data: RequestMessageSchema | PreparedMessage, endpoint: str | None = None) -> ResponseSchema:
+        return self._call('send_message', data, domain=self._get_message_domain(data=data), endpoint=endpoint)
+
+    def send_messages_batch(self, data: Iterable[RequestMessageSchema | PreparedMessage], batch_size: int = 100,
+                            endpoint: str | None = None) -> list[ResponseSchema | PostalPyAPIError]:
+        data = list(data)
+        return self._call_batch('send_messages_batch', data, batch_size=batch_size,
+                                domains=[self._get_message_domain(data=item) for item in data], endpoint=endpoint)
+
+    def send_raw_message(self, data: RequestRawMessageSchema, endpoint: str | None = None) -> ResponseSchema:
+        return self._call('send_raw_message', data, domain=self._get_domain(address=data.mail_from),
+                          endpoint=endpoint)
+
+    def send_raw_messages_batch(self, data: Iterable[RequestRawMessageSchema], batch_size: int = 100,
+                                endpoint: str | None = None) -> list[ResponseSchema | PostalPyAPIError]:
+        data = list(data)
+        return self._call_batch('send_raw_messages_batch', data, batch_size=batch_size,
+                                domains=[self._get_domain(address=item.mail_from) for item in data],
+                                endpoint=endpoint)
+
+    def close(self):
+        self._executor.shutdown()
+        for client in self._clients.values():
+            client.close()
+
+
+class AsyncPostalPyAPIRouter(PostalPyAPIRouterBase):
+    def __init__(self, endpoints: Iterable[Endpoint], policy: str = 'round_robin', max_attempts: int | None = None,
+                 cooldown: float = 5, slow_factor: float = 3, level: logging = logging.INFO, **kwargs: Any):
+        """
+        Asynchronous counterpart of `PostalPyAPIRouter`.
+        """
+        super().__init__(endpoints=endpoints, policy=policy, max_attempts=max_attempts, cooldown=cooldown,
+                         slow_factor=slow_factor, level=level)
+        self._clients = {endpoint.name: AsyncPostalPyAPI(base_url=endpoint.base_url, api_key=endpoint.api_key,
+                                                         level=level, **kwargs)
+                         for endpoint in self.endpoints}
+
+    async def _call(self, call: Callable[[AsyncPostalPyAPI], Awaitable[T]], domain: str | None = None,
+                    endpoint: str | None = None, exclude: set[str] = frozenset(),
+                    failover_errors: tuple[type[PostalPyAPIError], ...] = FAILOVER_ERRORS) -> T:
+        tried = set()
+        error = None
+        while True:
+            selected = self._acquire(domain=domain, tried=tried, exclude=exclude, endpoint=endpoint, error=error)
+            tried.add(selected.name)
+            started = time.perf_counter()
+            try:
+                result = await call(self._clients[selected.name])
+            except PostalPyAPIError as e:
+                if not self._release(endpoint=selected, started=started, error=e,
+                                     failover_errors=failover_errors) or endpoint is not None:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                self._pool.release(endpoint=selected, latency=None)
+                raise
+            self._release(endpoint=selected, started=started, error=None, failover_errors=failover_errors)
+            return result
+
+    async def get_message_details(self, data: RequestMessageDetailsSchema,
+                                  endpoint: str | None = None) -> ResponseSchema:
+        return await self._call(lambda client: client.get_message_details(data),
+                                exclude=self._get_read_exclude(endpoint=endpoint), failover_errors=READ_FAILOVER_ERRORS)
+
+    async def get_message_deliveries(self, id: int, endpoint: str | None = None) -> ResponseSchema:
+        return await self._call(lambda client: client.get_message_deliveries(id),
+                                exclude=self._get_read_exclude(endpoint=endpoint), failover_errors=READ_FAILOVER_ERRORS)
+
+    async def send_message(self, data: RequestMessageSchema | PreparedMessage,
+                           endpoint: str | None = None) -> ResponseSchema:
+        return await self._call(lambda client: client.send_message(data),
+                                domain=self._get_message_domain(data=data), endpoint=endpoint)
+
+    async def send_messages(self, data: Iterable[RequestMessageSchema | PreparedMessage] |
+                            AsyncIterable[RequestMessageSchema | PreparedMessage], concurrency: int = 10,
+                            ordered: bool = True) -> AsyncIterator[tuple[int, ResponseSchema | PostalPyAPIError]]:
+        """
+        Like `AsyncPostalPyAPI.send_messages`, with each message routed on its own.
+        """
+        async for result in bounded_map(self.send_message, data, concurrency=concurrency, ordered=ordered):
+            yield result
+
+    async def send_raw_message(self, data: RequestRawMessageSchema, endpoint: str | None = None) -> ResponseSchema:
+        return await self._call(lambda client: client.send_raw_message(data),
+                                domain=self._get_domain(address=data.mail_from), endpoint=endpoint)
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self._clients.values()))
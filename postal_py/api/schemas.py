@@ -8,10 +8,15 @@ from pydantic import (BaseModel as PydanticBaseModel,
                       field_validator,
                       conlist)
 
+from ..attachments import (AttachmentSource,
+                           encode_base64)
+
 
 class BaseModel(PydanticBaseModel):
     model_config = {
-        'populate_by_name': True
+        'populate_by_name': True,
+        # Validators are built on first use instead of at import, so unused schemas cost nothing
+        'defer_build': True
     }
 
 
@@ -53,14 +58,15 @@ class MessageExpansion(str, Enum):
 class RequestAttachmentSchema(BaseModel):
     name: str
     content_type: str | None = None
-    data: str | bytes
+    data: str | bytes | AttachmentSource
 
     @field_validator('data', mode='before')
     @classmethod
-    def to_base64(cls, value: str | bytes) -> str:
+    def to_base64(cls, value: Any) -> str | AttachmentSource:
         if isinstance(value, bytes):
-            value = base64.b64encode(value).decode()
-        return value
+            value = encode_base64(value)
+        # Paths, file-like objects and buffers are base64-encoded lazily while the request is sent
+        return AttachmentSource.from_value(value)
 
 
 class ResponseAttachmentSchema(BaseModel):
@@ -70,6 +76,9 @@ class ResponseAttachmentSchema(BaseModel):
     size: int
     hash: str
 
+    def decode_data(self) -> bytes:
+        return base64.b64decode(self.data)
+
 
 class ResponseStatusSchema(BaseModel):
     status: str
@@ -144,6 +153,9 @@ class ResponseMessageDataSchema(BaseModel):
     message: str | None = None
     code: str | None = None
 
+    def decode_raw_message(self) -> bytes | None:
+        return None if self.raw_message is None else base64.b64decode(self.raw_message)
+
 
 class ResponseMessageEntrySchema(BaseModel):
     id: int
@@ -155,6 +167,12 @@ class ResponseMessagesDataSchema(BaseModel):
     messages: dict[str, ResponseMessageEntrySchema]
 
 
+class ResponseChunkedMessagesSchema(BaseModel):
+    message_ids: list[str]
+    messages: dict[str, ResponseMessageEntrySchema]
+    failed_recipients: dict[str, str]
+
+
 class ResponseStructureDataSchema(BaseModel):
     id: int
     status: str
@@ -173,6 +191,20 @@ class ResponseSchema(BaseModel):
     data: ResponseMessageDataSchema | list[ResponseStructureDataSchema] | ResponseMessagesDataSchema
 
 
+# Validating JSON against a union of models costs about twice as much as against the one model an endpoint returns,
+# so successful responses are validated with these and only unexpected ones fall back to `ResponseSchema`
+class ResponseMessageDetailsSchema(ResponseSchema):
+    data: ResponseMessageDataSchema
+
+
+class ResponseDeliveriesSchema(ResponseSchema):
+    data: list[ResponseStructureDataSchema]
+
+
+class ResponseMessagesSchema(ResponseSchema):
+    data: ResponseMessagesDataSchema
+
+
 class RequestMessageDetailsSchema(BaseModel):
     id: int
     expansions: set[MessageExpansion] | None = None
@@ -194,6 +226,13 @@ class RequestMessageSchema(BaseModel):
     bounce: bool | None = None
 
 
+class RequestBulkMessageSchema(RequestMessageSchema):
+    # Any number of recipients, sent in requests of at most 50 per field by `send_message_chunked`
+    to: list[str] | None = None
+    cc: list[str] | None = None
+    bcc: list[str] | None = None
+
+
 class RequestRawMessageSchema(BaseModel):
     mail_from: str
     rcpt_to: list[str]
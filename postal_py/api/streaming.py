@@ -0,0 +1,136 @@
+import json as jsonlib
+from collections.abc import (Iterable,
+                             Iterator)
+from typing import Any
+
+from pydantic_core import to_json
+
+from ..attachments import (AttachmentSource,
+                           encode_base64)
+from .schemas import (RequestAttachmentSchema,
+                      RequestMessageSchema)
+
+RECIPIENT_FIELDS = ('to', 'cc', 'bcc')
+
+
+class MessageBodyStream:
+    def __init__(self, json: dict[str, Any], attachments: list[RequestAttachmentSchema]):
+        """
+        Re-iterable JSON request body for `/api/v1/send/message`.
+        Attachment sources are base64-encoded chunk by chunk while the body is sent,
+        so memory per send does not grow with the attachment size.
+        """
+        head = jsonlib.dumps(json, separators=(',', ':'))[:-1]
+        self._head = f'{head}{"," if json else ""}"attachments":['.encode()
+        self._attachments = attachments
+        self._prefixes = []
+        for index, attachment in enumerate(attachments):
+            meta = jsonlib.dumps(attachment.model_dump(exclude_none=True, exclude={'data'}), separators=(',', ':'))
+            self._prefixes.append(f'{"," if index else ""}{meta[:-1]},"data":"'.encode())
+        # niquests sends Content-Length when the body has a `len`, and chunked encoding when it is None
+        self.len = self._get_length()
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(attachments={[attachment.name for attachment in self._attachments]})'
+
+    @staticmethod
+    def _encode(data: str) -> bytes:
+        return jsonlib.dumps(data)[1:-1].encode()
+
+    def _get_length(self) -> int | None:
+        length = len(self._head) + sum(len(prefix) + 2 for prefix in self._prefixes) + 2
+        for attachment in self._attachments:
+            if isinstance(attachment.data, AttachmentSource):
+                if (size := attachment.data.base64_size) is None:
+                    return None
+                length += size
+            else:
+                length += len(self._encode(attachment.data))
+        return length
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        for prefix, attachment in zip(self._prefixes, self._attachments):
+            yield prefix
+            if isinstance(attachment.data, AttachmentSource):
+                yield from attachment.data.iter_base64()
+            else:
+                yield self._encode(attachment.data)
+            yield b'"}'
+        yield b']}'
+
+
+class SharedMessageBody:
+    def __init__(self, shared: bytes):
+        """
+        Request JSON for any number of requests that differ in a few fields, such as recipient chunks,
+        spliced from `shared`, the JSON object of every other field, serialized once. Large payloads,
+        such as attachments or a raw message, are therefore encoded once for all requests.
+        """
+        self._tail = shared[1:] if shared == b'{}' else b',' + shared[1:]
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(<{len(self._tail)} bytes>)'
+
+    def __len__(self) -> int:
+        return len(self._tail)
+
+    @classmethod
+    def from_message(cls, data: RequestMessageSchema,
+                     exclude: Iterable[str] = RECIPIENT_FIELDS) -> 'SharedMessageBody':
+        """
+        The fields of `data` but the `exclude`d ones, by field name, which each request supplies itself.
+        """
+        shared = data.model_dump_json(exclude_none=True, by_alias=True, exclude=set(exclude))
+        return cls(shared=shared.encode())
+
+    def with_fields(self, fields: dict[str, Any]) -> bytes:
+        if not fields:
+            # Nothing goes in front of the shared fields, which then need no separating comma
+            return b'{' + self._tail.removeprefix(b',')
+        return jsonlib.dumps(fields, separators=(',', ':')).encode()[:-1] + self._tail
+
+
+class PreparedMessage:
+    __slots__ = ('json', 'body')
+
+    def __init__(self, json: dict[str, Any], body: bytes):
+        """
+        A `/api/v1/send/message` request serialized ahead of time. `send_message` and `send_messages_batch` send
+        `body` as is, without validating or serializing the message again; `json` only holds the recipients,
+        sender and other short fields, for logging, rate limiting and routing.
+        """
+        self.json = json
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(json={self.json}, body=<{len(self.body)} bytes>)'
+
+    @classmethod
+    def build(cls, to: list[str] | None = None, cc: list[str] | None = None, bcc: list[str] | None = None,
+              from_: str | None = None, sender: str | None = None, subject: str | None = None,
+              tag: str | None = None, reply_to: str | None = None, plain_body: str | None = None,
+              html_body: str | None = None, attachments: Iterable[tuple[str, str | None, bytes]] | None = None,
+              headers: dict[str, Any] | None = None, bounce: bool | None = None) -> 'PreparedMessage':
+        """
+        Serializes a message from values the caller has validated already, without building a schema,
+        so nothing checks addresses or the 50 recipients per field limit. `attachments` are
+        `(name, content_type, data)` tuples with raw bytes, base64-encoded here.
+        """
+        json = {key: value for key, value in (('to', to), ('cc', cc), ('bcc', bcc), ('from', from_),
+                                               ('sender', sender), ('subject', subject), ('tag', tag),
+                                               ('reply_to', reply_to), ('bounce', bounce)) if value is not None}
+        message = json.copy()
+        for key, value in (('plain_body', plain_body), ('html_body', html_body), ('headers', headers)):
+            if value is not None:
+                message[key] = value
+        body = to_json(message)
+        if attachments is not None:
+            parts = [body[:-1], b',"attachments":[' if message else b'"attachments":[']
+            for index, (name, content_type, data) in enumerate(attachments):
+                meta = {'name': name} if content_type is None else {'name': name, 'content_type': content_type}
+                # Base64 needs no JSON escaping, so the encoded data is spliced in instead of serialized again
+                parts += (b',' if index else b'', to_json(meta)[:-1], b',"data":"', encode_base64(data).encode(), b'"}')
+            parts.append(b']}')
+            body = b''.join(parts)
+        return cls(json=json, body=body)
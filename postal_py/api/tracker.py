@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import logging
+import random
+import sqlite3
+import time
+from collections.abc import (AsyncIterator,
+                             Iterable)
+
+from .async_wrapper import PostalPyAPI
+from .exceptions import (PostalPyAPIError,
+                         PostalPyMessageNotFoundError)
+from .schemas import (MessageExpansion,
+                      RequestMessageDetailsSchema,
+                      ResponseMessagesDataSchema)
+
+TERMINAL_STATUSES = frozenset({'Sent', 'HardFail', 'Bounced'})
+NOT_FOUND = 'NotFound'
+
+
+class DeliveryStatusChange:
+    __slots__ = ('id', 'recipient', 'status', 'previous_status', 'last_delivery_attempt', 'held', 'final')
+
+    def __init__(self, id: int, recipient: str | None, status: str, previous_status: str | None,
+                 last_delivery_attempt: float | None = None, held: bool = False, final: bool = False):
+        """
+        A message seen in a new status. `final` is set when the status is one the tracker stops polling at:
+        Sent, HardFail, Bounced, or NotFound for a message Postal does not know.
+        """
+        self.id = id
+        self.recipient = recipient
+        self.status = status
+        self.previous_status = previous_status
+        self.last_delivery_attempt = last_delivery_attempt
+        self.held = held
+        self.final = final
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}(id={self.id}, recipient={self.recipient!r}, '
+                f'status={self.status!r}, previous_status={self.previous_status!r})')
+
+
+class DeliveryTracker:
+    def __init__(self, client: PostalPyAPI, path: str, concurrency: int = 10,
+                 initial_interval: float = 5, max_interval: float = 900, multiplier: float = 2,
+                 max_polls: int | None = None, level: logging = logging.INFO):
+        """
+        Polls the status of many sent messages through an asynchronous `PostalPyAPI`,
+        asking for the `status` expansion only and keeping at most `concurrency` requests in flight.
+        Each message is polled `initial_interval` seconds after it is added, then `multiplier` times less often
+        up to once per `max_interval`, until it reaches a final status or was polled `max_polls` times.
+        Tracked messages and their progress are kept in the SQLite file at `path`, so a restarted tracker
+        resumes where the previous one stopped and does not poll finished messages again;
+        `':memory:'` keeps them for the life of this tracker only.
+        """
+        self._client = client
+        self._concurrency = concurrency
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._multiplier = multiplier
+        self._max_polls = max_polls
+        self._logger = logging.getLogger('PostalPyTracker')
+        self._logger.setLevel(level)
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, recipient TEXT, '
+                                 'status TEXT, polls INTEGER NOT NULL DEFAULT 0, next_poll_at REAL NOT NULL, '
+                                 'final INTEGER NOT NULL DEFAULT 0)')
+        self._schedule: list[tuple[float, int]] = []
+        self._messages: dict[int, tuple[str | None, str | None, int]] = {}
+        for id, recipient, status, polls, next_poll_at in self._connection.execute(
+                'SELECT id, recipient, status, polls, next_poll_at FROM messages WHERE final = 0'):
+            self._messages[id] = (recipient, status, polls)
+            self._schedule.append((next_poll_at, id))
+        heapq.heapify(self._schedule)
+        self._updates: list[tuple[str | None, int, float, int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, messages: ResponseMessagesDataSchema | Iterable[int]) -> int:
+        """
+        Starts tracking the messages of a send response, or message ids. Messages that are, or were, tracked
+        already are skipped. Returns how many were added.
+        """
+        if isinstance(messages, ResponseMessagesDataSchema):
+            entries = [(entry.id, recipient) for recipient, entry in messages.messages.items()]
+        else:
+            entries = [(id, None) for id in messages]
+        next_poll_at = time.time() + self._initial_interval
+        added = 0
+        self._connection.execute('BEGIN')
+        for id, recipient in entries:
+            if self._connection.execute('INSERT OR IGNORE INTO messages (id, recipient, next_poll_at) '
+                                        'VALUES (?, ?, ?)', (id, recipient, next_poll_at)).rowcount:
+                self._messages[id] = (recipient, None, 0)
+                heapq.heappush(self._schedule, (next_poll_at, id))
+                added += 1
+        self._connection.execute('COMMIT')
+        return added
+
+    def _get_interval(self, polls: int) -> float:
+        interval = min(self._max_interval, self._initial_interval * self._multiplier ** polls)
+        # Jitter keeps messages added together from being polled together forever
+        return interval * random.uniform(0.9, 1.1)
+
+    async def _poll(self, id: int) -> tuple[int, DeliveryStatusChange | None]:
+        recipient, previous_status, polls = self._messages[id]
+        try:
+            response = await self._client.get_message_details(
+                RequestMessageDetailsSchema(id=id, expansions={MessageExpansion.status})
+            )
+        except PostalPyMessageNotFoundError:
+            return id, DeliveryStatusChange(id=id, recipient=recipient, status=NOT_FOUND,
+                                            previous_status=previous_status, final=True)
+        except PostalPyAPIError as e:
+            self._logger.warning('Message=%s status poll failed: %s', id, e)
+            return id, None
+        except Exception:
+            # Any other failure, such as a malformed response, is retried at the next poll as well
+            self._logger.exception('Message=%s status poll failed', id)
+            return id, None
+        status = response.data.status
+        return id, DeliveryStatusChange(id=id, recipient=recipient, status=status.status,
+                                        previous_status=previous_status,
+                                        last_delivery_attempt=status.last_delivery_attempt, held=status.held,
+                                        final=status.status in TERMINAL_STATUSES)
+
+    def _record(self, id: int, change: DeliveryStatusChange | None) -> DeliveryStatusChange | None:
+        """
+        Reschedules or retires a polled message, returning the change when its status is new.
+        """
+        recipient, status, polls = self._messages[id]
+        polls += 1
+        final = change is not None and change.final
+        if not final and self._max_polls is not None and polls >= self._max_polls:
+            final = True
+            self._logger.warning('Message=%s still %s after %s polls, no longer tracked', id, status, polls)
+        if change is not None:
+            status = change.status
+        next_poll_at = time.time() + self._get_interval(polls=polls)
+        if final:
+            del self._messages[id]
+        else:
+            self._messages[id] = (recipient, status, polls)
+            heapq.heappush(self._schedule, (next_poll_at, id))
+        self._updates.append((status, polls, next_poll_at, int(final), id))
+        if change is not None and change.status != change.previous_status:
+            return change
+        return None
+
+    def flush(self):
+        """
+        Writes the progress made since the last flush. `track` flushes at least once per second and when it stops.
+        """
+        if self._updates:
+            self._connection.executemany('UPDATE messages SET status = ?, polls = ?, next_poll_at = ?, final = ? '
+                                         'WHERE id = ?', self._updates)
+            self._updates.clear()
+
+    async def track(self) -> AsyncIterator[DeliveryStatusChange]:
+        """
+        Polls tracked messages as they fall due and yields every status change, until no message is left.
+        Messages added while tracking are picked up.
+        """
+        inflight: dict[asyncio.Task, int] = {}
+        flushed = time.monotonic()
+        try:
+            while self._schedule or inflight:
+                now = time.time()
+                while self._schedule and len(inflight) < self._concurrency and self._schedule[0][0] <= now:
+                    _, id = heapq.heappop(self._schedule)
+                    inflight[asyncio.ensure_future(self._poll(id=id))] = id
+                if not self._schedule or len(inflight) >= self._concurrency:
+                    wait = None
+                else:
+                    wait = max(0.0, self._schedule[0][0] - now)
+                if not inflight:
+                    await asyncio.sleep(wait)
+                    continue
+                done, _ = await asyncio.wait(inflight, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del inflight[task]
+                    if (change := self._record(*task.result())) is not None:
+                        yield change
+                if len(self._updates) >= 1000 or time.monotonic() - flushed >= 1:
+                    self.flush()
+                    flushed = time.monotonic()
+        finally:
+            # Interrupted polls are due again right away
+            for task, id in inflight.items():
+                task.cancel()
+                heapq.heappush(self._schedule, (time.time(), id))
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
@@ -1,49 +1,297 @@
 import logging
+import threading
+import time
+from collections.abc import (Hashable,
+                             Iterable,
+                             Iterator)
+from concurrent.futures import (FIRST_COMPLETED,
+                                Future,
+                                ThreadPoolExecutor,
+                                as_completed,
+                                wait)
+from email.message import EmailMessage
+from itertools import islice
 from typing import Any
-from uuid import uuid4
 
 from niquests import Session
-from niquests.exceptions import ConnectTimeout
+from niquests.exceptions import (ConnectTimeout,
+                                 ReadTimeout)
+from niquests.models import Response
 
+from ..instrumentation import Observer
+from ..smtp.schemas import SMTPMessageSchema
+from ..ratelimit import RateLimiter
 from .base import PostalPyAPIBase
-from .exceptions import PostalPyConnectTimeoutError
-from .schemas import (MessageExpansion,
-                      RequestMessageDetailsSchema,
+from .cache import ResponseCache
+from .exceptions import (PostalPyAPIError,
+                         PostalPyConnectTimeoutError,
+                         PostalPyReadTimeoutError,
+                         PostalPyUnknownError)
+from .hedging import HedgingPolicy
+from .retry import (CircuitBreaker,
+                    RetryPolicy)
+from .schemas import (RequestMessageDetailsSchema,
                       RequestMessageSchema,
                       RequestRawMessageSchema,
+                      ResponseChunkedMessagesSchema,
                       ResponseSchema)
+from .streaming import (MessageBodyStream,
+                        PreparedMessage)
 
 
 class PostalPyAPI(PostalPyAPIBase):
-    def __init__(self, base_url: str, api_key: str, timeout: int = 5, level: logging = logging.INFO):
-        super().__init__(base_url=base_url, api_key=api_key, timeout=timeout, level=level)
+    def __init__(self, base_url: str, api_key: str, timeout: int = 5, level: logging = logging.INFO,
+                 retry_policy: RetryPolicy | None = None, circuit_breaker: CircuitBreaker | None = None,
+                 rate_limiter: RateLimiter | None = None, cache: ResponseCache | None = None,
+                 observer: Observer | None = None, hedging: HedgingPolicy | None = None):
+        super().__init__(base_url=base_url, api_key=api_key, timeout=timeout, level=level,
+                         retry_policy=retry_policy, circuit_breaker=circuit_breaker, rate_limiter=rate_limiter,
+                         cache=cache, observer=observer, hedging=hedging)
         self._session = Session(base_url=self._base_url, timeout=self._timeout)
         self._session.headers = self._headers
+        self._batch_session: Session | None = None
+        self._inflight: dict[Hashable, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._hedge_executor: ThreadPoolExecutor | None = None
+        self._hedge_slots: threading.BoundedSemaphore | None = None
+        self._read_session: Session | None = None
 
-    def _send_request(self, url: str, json: dict[str, Any]) -> ResponseSchema:
-        log_json = self._get_log_json(json=json)
-        request_id = uuid4().hex
-        self._logger.info('Request=%s url=%s json=%s', request_id, url, log_json)
+    def _post(self, url: str, json: dict[str, Any], body: MessageBodyStream | bytes | None = None,
+              attempt: int = 0, timeout: float | None = None,
+              session: Session | None = None) -> tuple[str, Response, float]:
+        request_id = self._log_request(url=url, json=json, body=body)
+        started = time.perf_counter()
         try:
-            response = self._session.post(url=url, json=json)
+            response = (session or self._session).post(url=url, json=json if body is None else None, data=body,
+                                                       timeout=timeout)
         except ConnectTimeout as e:
             self._logger.exception('Response=%s: %s', request_id, PostalPyConnectTimeoutError.__doc__)
-            raise PostalPyConnectTimeoutError(e)
-        return self._handle_response(response=response, request_id=request_id)
+            error = PostalPyConnectTimeoutError(e)
+            if self._observer is not None:
+                self._observe(url=url, started=started, attempt=attempt, error=error)
+            raise error
+        except ReadTimeout as e:
+            self._logger.exception('Response=%s: %s', request_id, PostalPyReadTimeoutError.__doc__)
+            error = PostalPyReadTimeoutError(e)
+            if self._observer is not None:
+                self._observe(url=url, started=started, attempt=attempt, error=error)
+            raise error
+        return request_id, response, started
+
+    def _resolve(self, response: Response, request_id: str, url: str, started: float,
+                 attempt: int = 0) -> ResponseSchema:
+        try:
+            # A lazy response is fetched here, so the read timeout may surface only now
+            return self._handle_response(response=response, request_id=request_id, url=url, started=started,
+                                         attempt=attempt)
+        except ReadTimeout as e:
+            self._logger.exception('Response=%s: %s', request_id, PostalPyReadTimeoutError.__doc__)
+            error = PostalPyReadTimeoutError(e)
+            if self._observer is not None:
+                self._observe(url=url, started=started, attempt=attempt, error=error)
+            raise error
+
+    def _send_request(self, url: str, json: dict[str, Any], rate_limited: bool = False,
+                      body: MessageBodyStream | bytes | None = None, timeout: float | None = None,
+                      session: Session | None = None, endpoint: str | None = None) -> ResponseSchema:
+        """
+        `endpoint` records the latency of each attempt of a read with the hedging policy, without retry delays.
+        """
+        if rate_limited and self._rate_limiter is not None:
+            self._rate_limiter.acquire(recipients=self._count_recipients(json=json))
+        attempt = 0
+        while True:
+            self._check_circuit()
+            attempt_started = time.perf_counter()
+            try:
+                request_id, response, started = self._post(url=url, json=json, body=body, attempt=attempt,
+                                                           timeout=timeout, session=session)
+                result = self._resolve(response=response, request_id=request_id, url=url, started=started,
+                                       attempt=attempt)
+            except PostalPyAPIError as e:
+                if isinstance(e, PostalPyReadTimeoutError):
+                    self._record_read(endpoint=endpoint, started=attempt_started)
+                self._record_outcome(error=e)
+                if (delay := self._get_retry_delay(error=e, attempt=attempt)) is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._record_read(endpoint=endpoint, started=attempt_started)
+            self._record_outcome()
+            return result
+
+    def _send_pooled_read(self, url: str, json: dict[str, Any], endpoint: str, timeout: float) -> ResponseSchema:
+        try:
+            return self._send_request(url=url, json=json, timeout=timeout, session=self._read_session,
+                                      endpoint=endpoint)
+        finally:
+            self._hedge_slots.release()
+
+    def _send_hedged_request(self, url: str, json: dict[str, Any], endpoint: str, delay: float | None,
+                             timeout: float) -> ResponseSchema:
+        if delay is None:
+            return self._send_request(url=url, json=json, timeout=timeout, endpoint=endpoint)
+        if self._hedge_executor is None:
+            with self._inflight_lock:
+                if self._hedge_executor is None:
+                    self._read_session = Session(base_url=self._base_url, timeout=self._timeout)
+                    self._read_session.headers = self._headers
+                    self._hedge_slots = threading.BoundedSemaphore(self._hedging.max_workers)
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self._hedging.max_workers,
+                                                              thread_name_prefix='PostalPyHedge')
+        if not self._hedge_slots.acquire(blocking=False):
+            # Every hedging thread is taken, losers still finishing included, so the read is sent unhedged
+            # on the calling thread rather than queued behind them
+            return self._send_request(url=url, json=json, timeout=timeout, endpoint=endpoint)
+        futures = [self._hedge_executor.submit(self._send_pooled_read, url, json, endpoint, timeout)]
+        if not wait(futures, timeout=delay, return_when=FIRST_COMPLETED).done and \
+                self._hedge_slots.acquire(blocking=False):
+            if self._hedging.acquire_hedge(endpoint=endpoint):
+                self._logger.info('Hedging url=%s after %.3fs', url, delay)
+                futures.append(self._hedge_executor.submit(self._send_pooled_read, url, json, endpoint, timeout))
+            else:
+                self._hedge_slots.release()
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except PostalPyAPIError as e:
+                error = e
+        raise error
+
+    def _send_read_request(self, url: str, json: dict[str, Any]) -> ResponseSchema:
+        """
+        Sends an idempotent read, hedged with a duplicate request when it is slower than usual.
+        Both requests run on the hedging threads through a separate, pooled session, so that neither they nor
+        later reads wait for a connection held by a slow request. The losing request is not cancelled,
+        its response is discarded; while losers hold every hedging thread, reads are sent unhedged.
+        A read cut short by an adaptive timeout is sent once more with the client's `timeout`.
+        """
+        if self._hedging is None:
+            return self._send_request(url=url, json=json)
+        endpoint, delay, timeout = self._get_read_plan(url=url)
+        try:
+            return self._send_hedged_request(url=url, json=json, endpoint=endpoint, delay=delay, timeout=timeout)
+        except PostalPyReadTimeoutError:
+            if timeout >= self._timeout:
+                raise
+        self._logger.warning('Retry url=%s after the adaptive timeout of %.3fs', url, timeout)
+        return self._send_request(url=url, json=json, timeout=self._timeout, endpoint=endpoint)
+
+    def _send_cached_request(self, url: str, json: dict[str, Any], key: Hashable, ttl: float) -> ResponseSchema:
+        if (result := self._cache.get(key=key)) is not None:
+            return result
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if owner := future is None:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = self._send_read_request(url=url, json=json)
+            self._cache.set(key=key, result=result, ttl=ttl)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _get_batch_session(self) -> Session:
+        """
+        Session of the *_batch methods. Its responses are lazy and resolved on first access, which multiplexes
+        many requests over one HTTP/2 or HTTP/3 connection, so it is kept apart from the session of single calls.
+        """
+        if self._batch_session is None:
+            with self._inflight_lock:
+                if self._batch_session is None:
+                    session = Session(base_url=self._base_url, timeout=self._timeout, multiplexed=True)
+                    session.headers = self._headers
+                    self._batch_session = session
+        return self._batch_session
+
+    def _get_item_error(self, error: Exception, url: str) -> PostalPyUnknownError:
+        """
+        A transport error of one request of a batch, such as a dropped connection, as the result of that request,
+        so the results of the others are kept.
+        """
+        self._logger.error('Request to url=%s failed: %s', url, PostalPyUnknownError.__doc__, exc_info=error)
+        item_error = PostalPyUnknownError(error)
+        self._record_outcome(error=item_error)
+        return item_error
+
+    def _send_requests(self, url: str, requests: Iterable[tuple[dict[str, Any], MessageBodyStream | bytes | None]],
+                       batch_size: int, rate_limited: bool = False) -> list[ResponseSchema | PostalPyAPIError]:
+        session = self._get_batch_session()
+        results = []
+        for batch in self._batched(requests, batch_size=batch_size):
+            pending = []
+            for json, body in batch:
+                try:
+                    self._check_circuit()
+                except PostalPyAPIError as e:
+                    pending.append(e)
+                    continue
+                if rate_limited and self._rate_limiter is not None:
+                    self._rate_limiter.acquire(recipients=self._count_recipients(json=json))
+                try:
+                    pending.append(self._post(url=url, json=json, body=body, session=session))
+                except PostalPyAPIError as e:
+                    self._record_outcome(error=e)
+                    pending.append(e)
+                except Exception as e:
+                    pending.append(self._get_item_error(error=e, url=url))
+            try:
+                session.gather()
+            except Exception:
+                # Each response that did not arrive fails on its own below
+                self._logger.exception('Gathering responses of url=%s failed', url)
+            for item in pending:
+                if isinstance(item, PostalPyAPIError):
+                    results.append(item)
+                    continue
+                request_id, response, started = item
+                try:
+                    results.append(self._resolve(response=response, request_id=request_id, url=url, started=started))
+                except PostalPyAPIError as e:
+                    self._record_outcome(error=e)
+                    results.append(e)
+                except Exception as e:
+                    results.append(self._get_item_error(error=e, url=url))
+                else:
+                    self._record_outcome()
+        return results
+
+    @staticmethod
+    def _batched(items: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        iterator = iter(items)
+        while batch := list(islice(iterator, batch_size)):
+            yield batch
 
     def get_message_details(self, data: RequestMessageDetailsSchema) -> ResponseSchema:
         """
         https://apiv1.postalserver.io/controllers/messages/message.html
         """
         url = '/api/v1/messages/message'
-        expansions = [e for e in data.expansions or ()]
-        if MessageExpansion.all in data.expansions:
-            expansions = True
-        json = {
-            'id': data.id,
-            '_expansions': expansions
-        }
-        return self._send_request(url=url, json=json)
+        json = self._get_message_details_json(data=data)
+        if self._cache is None:
+            return self._send_read_request(url=url, json=json)
+        key = self._cache.get_details_key(data=data, server=self._server)
+        return self._send_cached_request(url=url, json=json, key=key, ttl=self._cache.get_details_ttl(data=data))
+
+    def get_message_details_batch(self, data: Iterable[RequestMessageDetailsSchema],
+                                  batch_size: int = 100) -> list[ResponseSchema | PostalPyAPIError]:
+        """
+        Multiplexed `get_message_details`, results are in input order with errors in place of failed items.
+        """
+        url = '/api/v1/messages/message'
+        requests = ((self._get_message_details_json(data=item), None) for item in data)
+        return self._send_requests(url=url, requests=requests, batch_size=batch_size)
 
     def get_message_deliveries(self, id: int) -> ResponseSchema:
         """
@@ -51,15 +299,49 @@ class PostalPyAPI(PostalPyAPIBase):
         """
         url = '/api/v1/messages/deliveries'
         json = {'id': id}
-        return self._send_request(url=url, json=json)
+        if self._cache is None:
+            return self._send_read_request(url=url, json=json)
+        key = self._cache.get_deliveries_key(id=id, server=self._server)
+        return self._send_cached_request(url=url, json=json, key=key, ttl=self._cache.get_deliveries_ttl())
+
+    def get_deliveries_batch(self, ids: Iterable[int],
+                             batch_size: int = 100) -> list[ResponseSchema | PostalPyAPIError]:
+        """
+        Multiplexed `get_message_deliveries`, results are in input order with errors in place of failed items.
+        """
+        url = '/api/v1/messages/deliveries'
+        requests = (({'id': id}, None) for id in ids)
+        return self._send_requests(url=url, requests=requests, batch_size=batch_size)
 
-    def send_message(self, data: RequestMessageSchema) -> ResponseSchema:
+    def send_message(self, data: RequestMessageSchema | PreparedMessage) -> ResponseSchema:
         """
         https://apiv1.postalserver.io/controllers/send/message.html
         """
         url = '/api/v1/send/message'
-        json = data.model_dump(exclude_none=True, by_alias=True)
-        return self._send_request(url=url, json=json)
+        json, body = self._get_message_json(data=data)
+        return self._send_request(url=url, json=json, rate_limited=True, body=body)
+
+    def send_messages_batch(self, data: Iterable[RequestMessageSchema | PreparedMessage],
+                            batch_size: int = 100) -> list[ResponseSchema | PostalPyAPIError]:
+        """
+        Multiplexed `send_message`, results are in input order with errors in place of failed items.
+        """
+        url = '/api/v1/send/message'
+        requests = (self._get_message_json(data=item) for item in data)
+        return self._send_requests(url=url, requests=requests, batch_size=batch_size, rate_limited=True)
+
+    def send_message_chunked(self, data: RequestMessageSchema, chunk_size: int = 50,
+                             concurrency: int = 10) -> ResponseChunkedMessagesSchema:
+        """
+        Sends a message to more recipients than Postal takes per request, such as a `RequestBulkMessageSchema`,
+        as requests with at most `chunk_size` addresses in each of `to`, `cc` and `bcc`, multiplexed
+        `concurrency` at a time. Each request only shows its own chunk of recipients in the headers.
+        Recipients of failed requests are mapped to their error in `failed_recipients`.
+        """
+        url = '/api/v1/send/message'
+        requests = self._get_chunked_message_requests(data=data, chunk_size=chunk_size)
+        results = self._send_requests(url=url, requests=requests, batch_size=concurrency, rate_limited=True)
+        return self._merge_chunk_results(requests=requests, results=results)
 
     def send_raw_message(self, data: RequestRawMessageSchema) -> ResponseSchema:
         """
@@ -67,7 +349,36 @@ class PostalPyAPI(PostalPyAPIBase):
         """
         url = '/api/v1/send/raw'
         json = data.model_dump(exclude_none=True)
-        return self._send_request(url=url, json=json)
+        return self._send_request(url=url, json=json, rate_limited=True)
+
+    def send_raw_messages_batch(self, data: Iterable[RequestRawMessageSchema],
+                                batch_size: int = 100) -> list[ResponseSchema | PostalPyAPIError]:
+        """
+        Multiplexed `send_raw_message`, results are in input order with errors in place of failed items.
+        """
+        url = '/api/v1/send/raw'
+        requests = ((item.model_dump(exclude_none=True), None) for item in data)
+        return self._send_requests(url=url, requests=requests, batch_size=batch_size, rate_limited=True)
+
+    def send_raw_message_fanout(self, data: SMTPMessageSchema | EmailMessage | bytes,
+                                rcpt_to: Iterable[str] | None = None, mail_from: str | None = None,
+                                bounce: bool | None = None, chunk_size: int = 50,
+                                concurrency: int = 10) -> ResponseChunkedMessagesSchema:
+        """
+        Sends one message to many recipients through `/api/v1/send/raw`, as requests with at most `chunk_size`
+        envelope recipients, multiplexed `concurrency` at a time. The message is built and base64-encoded once
+        for all requests. Recipients of failed requests are mapped to their error in `failed_recipients`.
+        """
+        url = '/api/v1/send/raw'
+        requests = self._get_raw_fanout_requests(data=data, rcpt_to=rcpt_to, mail_from=mail_from, bounce=bounce,
+                                                 chunk_size=chunk_size)
+        results = self._send_requests(url=url, requests=requests, batch_size=concurrency, rate_limited=True)
+        return self._merge_chunk_results(requests=requests, results=results)
 
     def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+            self._read_session.close()
+        if self._batch_session is not None:
+            self._batch_session.close()
         self._session.close()
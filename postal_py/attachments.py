@@ -0,0 +1,277 @@
+import base64
+import binascii
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import (Callable,
+                             Iterator)
+from email.message import MIMEPart
+from typing import (Any,
+                    BinaryIO)
+
+from pydantic_core import core_schema
+
+# A multiple of 3 bytes, so chunks encode to base64 without padding in the middle of the stream
+CHUNK_SIZE = 3 * 64 * 1024
+# Bytes encoded per 76-character base64 line of a MIME body (RFC 2045)
+MIME_LINE_SIZE = 57
+
+
+class AttachmentSource:
+    def __init__(self, source: str | os.PathLike | BinaryIO | memoryview | bytes):
+        """
+        Attachment content that is read lazily from a path, a binary file-like object or a buffer
+        (memoryview, mmap) instead of being held in memory as bytes or base64.
+        A file-like object is read from its current position, and rewound there for every read.
+        """
+        self._path = None
+        self._file = None
+        self._buffer = None
+        self._start = 0
+        self._consumed = False
+        if isinstance(source, (str, os.PathLike)):
+            self._path = os.fspath(source)
+        elif hasattr(source, 'read') and not isinstance(source, mmap.mmap):
+            self._file = source
+            self._start = source.tell() if getattr(source, 'seekable', lambda: False)() else None
+        else:
+            self._buffer = memoryview(source).cast('B')
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type: Any, handler: Any) -> core_schema.CoreSchema:
+        return core_schema.is_instance_schema(cls, serialization=core_schema.plain_serializer_function_ser_schema(
+            lambda value: value.read_base64()
+        ))
+
+    def __repr__(self) -> str:
+        source = self._path or self._file or f'<{len(self._buffer)} bytes>'
+        return f'{type(self).__name__}({source!r})'
+
+    @property
+    def size(self) -> int | None:
+        if self._buffer is not None:
+            return len(self._buffer)
+        if self._path is not None:
+            return os.path.getsize(self._path)
+        try:
+            return os.fstat(self._file.fileno()).st_size - self._start
+        except (AttributeError, OSError, TypeError, ValueError):
+            return None
+
+    @property
+    def base64_size(self) -> int | None:
+        return None if (size := self.size) is None else (size + 2) // 3 * 4
+
+    def iter_bytes(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes | memoryview]:
+        if self._buffer is not None:
+            for offset in range(0, len(self._buffer), chunk_size):
+                yield self._buffer[offset:offset + chunk_size]
+            return
+        if self._path is not None:
+            with open(self._path, 'rb') as file:
+                yield from iter(lambda: file.read(chunk_size), b'')
+            return
+        if self._start is not None:
+            self._file.seek(self._start)
+        elif self._consumed:
+            raise ValueError('A non-seekable attachment source can only be read once')
+        self._consumed = True
+        yield from iter(lambda: self._file.read(chunk_size), b'')
+
+    def iter_base64(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        remainder = b''
+        for chunk in self.iter_bytes(chunk_size=chunk_size):
+            if remainder:
+                chunk = remainder + chunk
+            # Short reads are carried over, so only whole 3-byte groups are encoded
+            cut = len(chunk) - len(chunk) % 3
+            remainder = bytes(chunk[cut:])
+            if cut:
+                yield base64.b64encode(chunk[:cut])
+        if remainder:
+            yield base64.b64encode(remainder)
+
+    def iter_mime_base64(self, lines_per_chunk: int = 4096) -> Iterator[bytes]:
+        """
+        Base64 split into CRLF-separated 76-character lines for a MIME body, without a trailing line break.
+        """
+        line_size = 4 * MIME_LINE_SIZE // 3
+        separator = b''
+        for chunk in self.iter_base64(chunk_size=MIME_LINE_SIZE * lines_per_chunk):
+            # Full chunks encode to whole lines, a short read only ends up as a shorter line
+            yield separator + b'\r\n'.join(chunk[offset:offset + line_size]
+                                            for offset in range(0, len(chunk), line_size))
+            separator = b'\r\n'
+
+    def read(self) -> bytes:
+        return b''.join(self.iter_bytes())
+
+    def read_base64(self) -> str:
+        return b''.join(self.iter_base64()).decode()
+
+    @classmethod
+    def from_value(cls, value: Any) -> Any:
+        """
+        Wraps paths, file-like objects and buffers, leaves `str` and `bytes` as they are.
+        """
+        if isinstance(value, (str, bytes, cls)):
+            return value
+        if isinstance(value, os.PathLike) or hasattr(value, 'read'):
+            return cls(value)
+        try:
+            memoryview(value)
+        except TypeError:
+            return value
+        return cls(value)
+
+
+class _CacheEntry:
+    __slots__ = ('data', 'encoded', 'parts', 'size')
+
+    def __init__(self, data: bytes, encoded: str):
+        self.data = data
+        self.encoded = encoded
+        self.parts: dict[tuple[str, str], MIMEPart] = {}
+        self.size = len(data) + len(encoded)
+
+
+class AttachmentCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, min_size: int = 1024):
+        """
+        LRU cache of the base64 and MIME forms of attachment content, bounded by `max_bytes` of cached data.
+        Entries are keyed by the content itself, so an attachment seen again costs a hash lookup and, for
+        a new object with the same content, a comparison instead of encoding it again. Once installed with
+        `set_attachment_cache`, it is used by the API and SMTP schemas and the SMTP MIME builder.
+        Content shorter than `min_size` is encoded directly. Cached MIME parts are shared between messages
+        and must not be mutated.
+        """
+        self._max_bytes = max_bytes
+        self._min_size = min_size
+        # Raw bytes and their base64 string both point to the entry, a bytes key never equals a str key
+        self._entries: OrderedDict[bytes | str, _CacheEntry] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key: bytes | str) -> _CacheEntry | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def _add(self, entry: _CacheEntry):
+        if entry.size > self._max_bytes:
+            return
+        with self._lock:
+            if entry.data in self._entries:
+                return
+            self._entries[entry.data] = self._entries[entry.encoded] = entry
+            self._size += entry.size
+            self._evict()
+
+    def _evict(self):
+        while self._size > self._max_bytes:
+            # Either key of the entry may be the oldest, as lookups only refresh the key they use
+            _, entry = self._entries.popitem(last=False)
+            self._entries.pop(entry.data, None)
+            self._entries.pop(entry.encoded, None)
+            self._size -= entry.size
+
+    def encode(self, data: bytes) -> str:
+        if len(data) < self._min_size:
+            return base64.b64encode(data).decode()
+        if (entry := self._get(key=data)) is not None:
+            return entry.encoded
+        encoded = base64.b64encode(data).decode()
+        self._add(entry=_CacheEntry(data=data, encoded=encoded))
+        return encoded
+
+    def decode(self, data: str) -> bytes:
+        if len(data) < self._min_size:
+            return base64.b64decode(data)
+        if (entry := self._get(key=data)) is not None:
+            return entry.data
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except binascii.Error:
+            # Line breaks or other characters base64 ignores, the string is not what `encode` would return
+            return base64.b64decode(data)
+        self._add(entry=_CacheEntry(data=decoded, encoded=data))
+        return decoded
+
+    def get_mime_part(self, data: bytes, content_type: str, name: str, build: Callable[[], MIMEPart]) -> MIMEPart:
+        """
+        The MIME part of an attachment, made by `build` the first time its content, type and name are seen.
+        """
+        if len(data) < self._min_size:
+            return build()
+        key = content_type, name
+        with self._lock:
+            if (entry := self._entries.get(data)) is not None:
+                self._entries.move_to_end(data)
+                if (part := entry.parts.get(key)) is not None:
+                    self._hits += 1
+                    return part
+            self._misses += 1
+        part = build()
+        if entry is None:
+            self._add(entry=_CacheEntry(data=data, encoded=base64.b64encode(data).decode()))
+        with self._lock:
+            if (entry := self._entries.get(data)) is not None and key not in entry.parts:
+                # Roughly the size of its base64 body, line breaks included
+                size = len(entry.encoded) * 78 // 76
+                entry.parts[key] = part
+                entry.size += size
+                self._size += size
+                self._evict()
+        return part
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else None,
+                'entries': len(self._entries) // 2,
+                'bytes': self._size
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._hits = 0
+            self._misses = 0
+
+
+_attachment_cache: AttachmentCache | None = None
+
+
+def set_attachment_cache(cache: AttachmentCache | None):
+    """
+    Installs the process-wide attachment cache, or removes it with None. There is none by default.
+    """
+    global _attachment_cache
+    _attachment_cache = cache
+
+
+def get_attachment_cache() -> AttachmentCache | None:
+    return _attachment_cache
+
+
+def encode_base64(data: bytes) -> str:
+    if _attachment_cache is None:
+        return base64.b64encode(data).decode()
+    return _attachment_cache.encode(data=data)
+
+
+def decode_base64(data: str) -> bytes:
+    if _attachment_cache is None:
+        return base64.b64decode(data)
+    return _attachment_cache.decode(data=data)
@@ -0,0 +1,183 @@
+import bisect
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+# Upper bounds in seconds, the default explicit bucket boundaries of OpenTelemetry duration histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 7.5, 10)
+
+
+class RequestEvent:
+    __slots__ = ('client', 'operation', 'started_at', 'duration', 'status_code', 'error', 'attempt',
+                 'request_bytes', 'response_bytes', 'timings')
+
+    def __init__(self, client: str, operation: str, started_at: float, duration: float,
+                 status_code: int | None = None, error: BaseException | None = None, attempt: int = 0,
+                 request_bytes: int | None = None, response_bytes: int | None = None,
+                 timings: dict[str, float] | None = None):
+        """
+        One API request attempt, SMTP connection or SMTP message transaction.
+        `operation` is the API path, `connect` or `send_message`. `started_at` is a Unix timestamp,
+        `duration` and the phase `timings` (resolve, connect, tls, auth, send, wait, parse) are in seconds.
+        `attempt` counts the retries made before this request.
+        """
+        self.client = client
+        self.operation = operation
+        self.started_at = started_at
+        self.duration = duration
+        self.status_code = status_code
+        self.error = error
+        self.attempt = attempt
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.timings = timings or {}
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}(client={self.client!r}, operation={self.operation!r}, '
+                f'duration={self.duration:.6f}, status_code={self.status_code}, '
+                f'error={type(self.error).__name__ if self.error else None}, attempt={self.attempt})')
+
+    @property
+    def error_type(self) -> str | None:
+        return None if self.error is None else type(self.error).__name__
+
+
+class Observer:
+    def on_event(self, event: RequestEvent):
+        """
+        Receives an event for every request the API and SMTP clients make.
+        Events are only built when an observer is attached, and this runs on the calling thread or event loop,
+        so it should return quickly.
+        """
+
+
+class MultiObserver(Observer):
+    def __init__(self, *observers: Observer):
+        self._observers = observers
+
+    def on_event(self, event: RequestEvent):
+        for observer in self._observers:
+            observer.on_event(event)
+
+
+class LatencyHistogram(Observer):
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        """
+        In-process latency histograms per client and operation, with approximate percentiles.
+        """
+        self._buckets = sorted(buckets)
+        self._series: dict[tuple[str, str], list[int]] = {}
+        self._sums: dict[tuple[str, str], float] = {}
+        self._errors: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def on_event(self, event: RequestEvent):
+        key = event.client, event.operation
+        index = bisect.bisect_left(self._buckets, event.duration)
+        with self._lock:
+            if (counts := self._series.get(key)) is None:
+                counts = self._series[key] = [0] * (len(self._buckets) + 1)
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + event.duration
+            if event.error is not None:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def _get_counts(self, client: str | None, operation: str | None) -> list[int]:
+        counts = [0] * (len(self._buckets) + 1)
+        for (series_client, series_operation), series in self._series.items():
+            if client in (None, series_client) and operation in (None, series_operation):
+                counts = [a + b for a, b in zip(counts, series)]
+        return counts
+
+    def get_percentile(self, q: float, client: str | None = None, operation: str | None = None) -> float | None:
+        """
+        The `q` (0-100) percentile, linearly interpolated within its bucket.
+        Durations past the last bucket are reported as its upper bound.
+        """
+        with self._lock:
+            counts = self._get_counts(client=client, operation=operation)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q / 100 * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self._buckets):
+                    return self._buckets[-1]
+                lower = self._buckets[index - 1] if index else 0.0
+                return lower + (self._buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self._buckets[-1]
+
+    def snapshot(self) -> dict[tuple[str, str], dict[str, Any]]:
+        with self._lock:
+            keys = list(self._series)
+            sums = dict(self._sums)
+            errors = dict(self._errors)
+            counts = {key: sum(series) for key, series in self._series.items()}
+        return {
+            key: {
+                'count': counts[key],
+                'errors': errors.get(key, 0),
+                'mean': sums[key] / counts[key],
+                'p50': self.get_percentile(50, *key),
+                'p99': self.get_percentile(99, *key)
+            }
+            for key in keys
+        }
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._sums.clear()
+            self._errors.clear()
+
+
+class OpenTelemetryObserver(Observer):
+    def __init__(self, meter: Any = None, tracer: Any = None):
+        """
+        Records events with an OpenTelemetry `Meter` and/or `Tracer`, such as
+        `opentelemetry.metrics.get_meter('postal_py')` and `opentelemetry.trace.get_tracer('postal_py')`.
+        The objects are used through the OpenTelemetry API only, so `opentelemetry` is not a dependency.
+        """
+        self._tracer = tracer
+        self._duration = self._request_size = self._response_size = None
+        if meter is not None:
+            self._duration = meter.create_histogram(
+                'postal_py.client.duration', unit='s', description='Duration of Postal API and SMTP requests'
+            )
+            self._request_size = meter.create_counter(
+                'postal_py.client.request.size', unit='By', description='Bytes sent to Postal'
+            )
+            self._response_size = meter.create_counter(
+                'postal_py.client.response.size', unit='By', description='Bytes received from Postal'
+            )
+
+    @staticmethod
+    def _get_attributes(event: RequestEvent) -> dict[str, Any]:
+        attributes = {'postal_py.client': event.client, 'postal_py.operation': event.operation}
+        if event.status_code is not None:
+            attributes['postal_py.status_code'] = event.status_code
+        if event.error is not None:
+            attributes['error.type'] = event.error_type
+        return attributes
+
+    def on_event(self, event: RequestEvent):
+        attributes = self._get_attributes(event=event)
+        if self._duration is not None:
+            self._duration.record(event.duration, attributes=attributes)
+            if event.request_bytes:
+                self._request_size.add(event.request_bytes, attributes=attributes)
+            if event.response_bytes:
+                self._response_size.add(event.response_bytes, attributes=attributes)
+        if self._tracer is not None:
+            start_time = int(event.started_at * 1e9)
+            span = self._tracer.start_span(f'{event.client} {event.operation}', start_time=start_time,
+                                           attributes=attributes)
+            span.set_attribute('postal_py.attempt', event.attempt)
+            for phase, seconds in event.timings.items():
+                span.set_attribute(f'postal_py.timing.{phase}', seconds)
+            if event.error is not None:
+                span.record_exception(event.error)
+            span.end(end_time=start_time + int(event.duration * 1e9))
@@ -0,0 +1,159 @@
+from collections.abc import (Iterable,
+                             Iterator,
+                             Mapping)
+from email.message import (EmailMessage,
+                           MIMEPart)
+from string import Template
+from typing import Any
+
+from .api.schemas import RequestMessageSchema
+from .api.streaming import (PreparedMessage,
+                            SharedMessageBody)
+from .attachments import AttachmentSource
+from .smtp.base import PostalPySMTPBase
+from .smtp.schemas import SMTPMessageSchema
+
+# JSON keys of the short fields a prepared message keeps next to its body, as `PreparedMessage.build` does
+PREPARED_JSON_KEYS = frozenset(('to', 'cc', 'bcc', 'from', 'sender', 'subject', 'tag', 'reply_to', 'bounce'))
+
+
+class MergeTemplate:
+    def __init__(self, template: str):
+        """
+        A `string.Template` string (`$name`, `${name}`, `$$`) split once into literal text and variable names.
+        A `$` that starts no placeholder, such as in a price, is kept as is, like `Template.safe_substitute` does.
+        """
+        self.template = template
+        self._segments: list[tuple[str, str | None]] = []
+        literal = []
+        position = 0
+        for match in Template.pattern.finditer(template):
+            literal.append(template[position:match.start()])
+            position = match.end()
+            if (name := match['named'] or match['braced']) is not None:
+                self._segments.append((''.join(literal), name))
+                literal = []
+            else:
+                # Escaped `$$`, or a `$` followed by no identifier
+                literal.append(Template.delimiter)
+        literal.append(template[position:])
+        self._segments.append((''.join(literal), None))
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.template!r})'
+
+    @property
+    def identifiers(self) -> list[str]:
+        return [name for _, name in self._segments if name is not None]
+
+    def render(self, variables: Mapping[str, Any]) -> str:
+        parts = []
+        for literal, name in self._segments:
+            parts.append(literal)
+            if name is not None:
+                parts.append(str(variables[name]))
+        return ''.join(parts)
+
+
+class MailMerge:
+    def __init__(self, template: SMTPMessageSchema | RequestMessageSchema):
+        """
+        Personalizes a template message with per-recipient variables.
+        Templated text fields, recipients and header values are compiled once, everything else,
+        attachments included, is validated once with the template and shared by every rendered message.
+        """
+        self._template = template
+        self._fields: dict[str, MergeTemplate | list[MergeTemplate] | dict[str, MergeTemplate]] = {}
+        for name, value in template:
+            if isinstance(value, str):
+                compiled = MergeTemplate(value)
+            elif isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+                compiled = [MergeTemplate(item) for item in value]
+            elif isinstance(value, dict):
+                compiled = {k: MergeTemplate(v) for k, v in value.items() if isinstance(v, str)}
+            else:
+                continue
+            if any(t.identifiers for t in self._iter_templates(compiled=compiled)):
+                self._fields[name] = compiled
+        self._attachment_parts: list[MIMEPart] | None = None
+        self._shared_body: SharedMessageBody | None = None
+        self._prepared_json: dict[str, Any] | None = None
+
+    @staticmethod
+    def _iter_templates(compiled: MergeTemplate | list[MergeTemplate] | dict[str, MergeTemplate]
+                        ) -> Iterator[MergeTemplate]:
+        if isinstance(compiled, dict):
+            yield from compiled.values()
+        elif isinstance(compiled, list):
+            yield from compiled
+        else:
+            yield compiled
+
+    @property
+    def identifiers(self) -> set[str]:
+        return {name for compiled in self._fields.values() for t in self._iter_templates(compiled=compiled)
+                for name in t.identifiers}
+
+    def _render_fields(self, variables: Mapping[str, Any]) -> dict[str, Any]:
+        rendered = {}
+        for name, compiled in self._fields.items():
+            if isinstance(compiled, dict):
+                rendered[name] = {**getattr(self._template, name),
+                                  **{k: t.render(variables) for k, t in compiled.items()}}
+            elif isinstance(compiled, list):
+                rendered[name] = [t.render(variables) for t in compiled]
+            else:
+                rendered[name] = compiled.render(variables)
+        return rendered
+
+    def render(self, variables: Mapping[str, Any]) -> SMTPMessageSchema | RequestMessageSchema:
+        """
+        A copy of the template with templated fields rendered, sharing all other values without revalidation.
+        """
+        return self._template.model_copy(update=self._render_fields(variables=variables))
+
+    def render_prepared(self, variables: Mapping[str, Any]) -> PreparedMessage:
+        """
+        A rendered API message, serialized for the API clients' `send_message` or `send_messages_batch`.
+        The fields without placeholders, attachments included, are serialized once with the template,
+        only the rendered fields are serialized for each message.
+        """
+        if not isinstance(self._template, RequestMessageSchema):
+            raise TypeError('Prepared messages can only be rendered from a RequestMessageSchema template')
+        if self._shared_body is None:
+            if any(isinstance(attachment.data, AttachmentSource) for attachment in self._template.attachments or ()):
+                raise ValueError('Attachments read from a source are streamed and cannot be prepared')
+            self._shared_body = SharedMessageBody.from_message(data=self._template, exclude=self._fields)
+            self._prepared_json = {key: value for key, value in self._template.model_dump(
+                exclude_none=True, by_alias=True, exclude={'attachments', 'plain_body', 'html_body', 'headers'}
+            ).items() if key in PREPARED_JSON_KEYS}
+        fields = {type(self._template).model_fields[name].alias or name: value
+                  for name, value in self._render_fields(variables=variables).items()}
+        json = {**self._prepared_json, **{key: value for key, value in fields.items() if key in PREPARED_JSON_KEYS}}
+        return PreparedMessage(json=json, body=self._shared_body.with_fields(fields=fields))
+
+    def render_mime(self, variables: Mapping[str, Any]) -> tuple[SMTPMessageSchema, EmailMessage]:
+        """
+        A rendered SMTP message and its MIME message, built around attachment parts that are encoded once.
+        The pair can be passed to the SMTP clients' `send_message(data, message)` or `send_messages`.
+        """
+        if not isinstance(self._template, SMTPMessageSchema):
+            raise TypeError('MIME messages can only be rendered from an SMTPMessageSchema template')
+        if self._attachment_parts is None:
+            self._attachment_parts = [PostalPySMTPBase._attachment_part(attachment=attachment)
+                                      for attachment in self._template.attachments or ()]
+        data = self.render(variables=variables)
+        return data, PostalPySMTPBase._prepare_message(data=data, attachment_parts=self._attachment_parts)
+
+    def iter_messages(self, variables: Iterable[Mapping[str, Any]]
+                      ) -> Iterator[SMTPMessageSchema | RequestMessageSchema]:
+        for item in variables:
+            yield self.render(variables=item)
+
+    def iter_mime(self, variables: Iterable[Mapping[str, Any]]) -> Iterator[tuple[SMTPMessageSchema, EmailMessage]]:
+        for item in variables:
+            yield self.render_mime(variables=item)
+
+    def iter_prepared(self, variables: Iterable[Mapping[str, Any]]) -> Iterator[PreparedMessage]:
+        for item in variables:
+            yield self.render_prepared(variables=item)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from concurrent.futures import (Executor,
+                                ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from enum import Enum
+from functools import partial
+from typing import (Any,
+                    TypeVar)
+
+from .attachments import AttachmentSource
+
+T = TypeVar('T')
+
+
+class OffloadMode(str, Enum):
+    thread = 'thread'
+    process = 'process'
+
+
+class MessageOffload:
+    def __init__(self, mode: OffloadMode | str = OffloadMode.thread, min_size: int = 256 * 1024,
+                 max_workers: int | None = None, executor: Executor | None = None):
+        """
+        Prepares large messages for the asynchronous API and SMTP clients off the event loop: JSON serialization
+        for the API, MIME building and encoding for SMTP. Messages whose bodies and in-memory attachments
+        add up to less than `min_size` characters and bytes are prepared inline, as handing them over costs more
+        than preparing them.
+        In `thread` mode the loop still shares the GIL with the preparing thread, but gets it back every
+        switch interval (5 ms by default) instead of waiting for the whole message. In `process` mode messages
+        are prepared in up to `max_workers` processes, at the cost of pickling them both ways; messages with
+        attachments read from an `AttachmentSource` are prepared in the loop's default thread pool instead,
+        and worker processes do not see the attachment cache of this one.
+        `executor` replaces the pool `mode` would create, and is not shut down by `shutdown`.
+        One offload can be shared by several clients.
+        """
+        self._mode = OffloadMode(mode)
+        self._min_size = min_size
+        self._max_workers = max_workers
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._offloaded = 0
+        self._inline = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self._mode is OffloadMode.process:
+                        self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                            thread_name_prefix='PostalPyOffload')
+        return self._executor
+
+    @staticmethod
+    def get_message_size(data: Any) -> int:
+        """
+        Characters of the bodies plus the size of the in-memory attachments of an API or SMTP message.
+        Attachments read from an `AttachmentSource` are streamed while sending, not while preparing, and do not count.
+        """
+        size = len(data.plain_body or '') + len(data.html_body or '')
+        for attachment in data.attachments or ():
+            if not isinstance(attachment.data, AttachmentSource):
+                size += len(attachment.data)
+        return size
+
+    async def run(self, func: Callable[..., T], size: int, local: bool = False,
+                  inline: Callable[..., T] | None = None, **kwargs: Any) -> T:
+        """
+        `func(**kwargs)`, in the pool when `size` reaches `min_size`. A `local` call has arguments that cannot be
+        sent to another process, and in `process` mode runs in the loop's default thread pool.
+        `inline(**kwargs)`, when given, replaces `func` below `min_size`, for work that is only worth doing
+        in order to hand the message over.
+        """
+        if size < self._min_size:
+            with self._lock:
+                self._inline += 1
+            return (func if inline is None else inline)(**kwargs)
+        with self._lock:
+            self._offloaded += 1
+        executor = None if local and self._mode is OffloadMode.process else self._get_executor()
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(func, **kwargs))
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'mode': self._mode.value,
+                'offloaded': self._offloaded,
+                'inline': self._inline
+            }
+
+    def shutdown(self, wait: bool = True):
+        if not self._owns_executor:
+            return
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
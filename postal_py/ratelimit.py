@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+import time
+
+
+class MemoryRateLimitBackend:
+    def __init__(self):
+        """
+        In-process token buckets, shared by every client that uses the same limiter.
+        """
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def reserve(self, limits: list[tuple[str, float, float, float]]) -> float:
+        """
+        Takes `cost` tokens from every `(key, rate, capacity, cost)` bucket, letting them go negative,
+        and returns how many seconds the caller has to wait until its reservation is covered.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for key, rate, capacity, cost in limits:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate) - cost
+                self._buckets[key] = (tokens, now)
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+            return wait
+
+
+class SQLiteRateLimitBackend:
+    def __init__(self, path: str):
+        """
+        Token buckets stored in a SQLite file, so several worker processes on one host share one budget.
+        """
+        self._path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, 'connection', None)) is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def reserve(self, limits: list[tuple[str, float, float, float]]) -> float:
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            wait = 0.0
+            for key, rate, capacity, cost in limits:
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row or (capacity, now)
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate) - cost
+                connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                   (key, tokens, now))
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, messages_per_second: float | None = None, messages_per_minute: float | None = None,
+                 recipients_per_second: float | None = None, recipients_per_minute: float | None = None,
+                 backend: MemoryRateLimitBackend | SQLiteRateLimitBackend | None = None, name: str = 'postal_py'):
+        """
+        Client-side token-bucket limiter for the API and SMTP clients.
+        Each limit is a bucket that holds a full period of tokens, so bursts up to the limit pass at once.
+        Limiters with the same `name` on a shared backend share their budget.
+        """
+        self._backend = backend or MemoryRateLimitBackend()
+        self._limits = [
+            (f'{name}:{unit}:{period}', limit / period, float(limit), unit)
+            for unit, period, limit in (('messages', 1, messages_per_second),
+                                        ('messages', 60, messages_per_minute),
+                                        ('recipients', 1, recipients_per_second),
+                                        ('recipients', 60, recipients_per_minute))
+            if limit is not None
+        ]
+
+    def _reserve(self, messages: int, recipients: int) -> float:
+        costs = {'messages': messages, 'recipients': recipients}
+        limits = [(key, rate, capacity, costs[unit]) for key, rate, capacity, unit in self._limits if costs[unit]]
+        return self._backend.reserve(limits) if limits else 0.0
+
+    def acquire(self, messages: int = 1, recipients: int = 0):
+        if (wait := self._reserve(messages=messages, recipients=recipients)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, messages: int = 1, recipients: int = 0):
+        # Imported here, so that synchronous clients do not load asyncio
+        import asyncio
+        if isinstance(self._backend, MemoryRateLimitBackend):
+            wait = self._reserve(messages=messages, recipients=recipients)
+        else:
+            # A shared backend can wait for a lock held by another process, which must not block the event loop
+            wait = await asyncio.to_thread(self._reserve, messages=messages, recipients=recipients)
+        if wait > 0:
+            await asyncio.sleep(wait)
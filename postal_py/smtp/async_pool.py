@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import (AsyncIterator,
+                             Awaitable,
+                             Callable)
+from contextlib import (asynccontextmanager,
+                        suppress)
+
+try:
+    from aiosmtplib import (SMTP,
+                            SMTPDataError,
+                            SMTPException,
+                            SMTPNotSupported,
+                            SMTPRecipientsRefused,
+                            SMTPSenderRefused)
+except ImportError:
+    SMTP = None
+    SMTPDataError = SMTPException = SMTPNotSupported = SMTPRecipientsRefused = SMTPSenderRefused = None
+
+
+class AsyncPooledConnection:
+    __slots__ = ('smtp', 'created_at', 'last_used_at', 'messages_sent')
+
+    def __init__(self, smtp: SMTP):
+        self.smtp = smtp
+        self.created_at = self.last_used_at = time.monotonic()
+        self.messages_sent = 0
+
+
+class AsyncSMTPConnectionPool:
+    def __init__(self, connect: Callable[[], Awaitable[SMTP]], max_size: int = 1, max_messages: int | None = None,
+                 idle_timeout: float = 60, check_after: float = 5):
+        """
+        Pool of authenticated `aiosmtplib.SMTP` sessions.
+        The semaphore lets at most `max_size` coroutines hold a session, the rest wait for a free one.
+        A session idle for more than `check_after` seconds is checked with an RSET before it is reused;
+        if the server closed a more recently used one, the caller replaces it with `reconnect`.
+        """
+        self._connect = connect
+        self._max_messages = max_messages
+        self._idle_timeout = idle_timeout
+        self._check_after = check_after
+        self._idle: deque[AsyncPooledConnection] = deque()
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._closed = False
+        # aiosmtplib resets the envelope itself before raising these, so the session stays usable,
+        # and SMTPNotSupported is raised before a transaction is started
+        self._recoverable_errors = (SMTPDataError, SMTPNotSupported, SMTPRecipientsRefused, SMTPSenderRefused)
+
+    @staticmethod
+    async def _disconnect(connection: AsyncPooledConnection):
+        with suppress(SMTPException, OSError):
+            await connection.smtp.quit()
+        connection.smtp.close()
+
+    async def _evict_idle(self):
+        deadline = time.monotonic() - self._idle_timeout
+        while self._idle and self._idle[0].last_used_at < deadline:
+            await self._disconnect(self._idle.popleft())
+
+    async def _is_alive(self, connection: AsyncPooledConnection) -> bool:
+        if not connection.smtp.is_connected:
+            return False
+        if time.monotonic() - connection.last_used_at <= self._check_after:
+            return True
+        try:
+            response = await connection.smtp.rset()
+        except (SMTPException, OSError):
+            return False
+        return response.code == 250
+
+    async def _acquire(self) -> AsyncPooledConnection:
+        await self._evict_idle()
+        while self._idle:
+            connection = self._idle.pop()
+            if await self._is_alive(connection):
+                return connection
+            await self._disconnect(connection)
+        return AsyncPooledConnection(smtp=await self._connect())
+
+    async def _release(self, connection: AsyncPooledConnection):
+        connection.last_used_at = time.monotonic()
+        if self._closed or (self._max_messages is not None and connection.messages_sent >= self._max_messages):
+            await self._disconnect(connection)
+            return
+        self._idle.append(connection)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncPooledConnection]:
+        """
+        A pooled session along with its age and use, released when the block ends and counted as one message.
+        """
+        if self._closed:
+            raise RuntimeError('SMTP connection pool is closed')
+        async with self._semaphore:
+            connection = await self._acquire()
+            try:
+                yield connection
+            except self._recoverable_errors:
+                connection.messages_sent += 1
+                await self._release(connection)
+                raise
+            except BaseException:
+                # The session may be mid-transaction, drop it without a QUIT
+                connection.smtp.close()
+                raise
+            connection.messages_sent += 1
+            await self._release(connection)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[SMTP]:
+        async with self.session() as connection:
+            yield connection.smtp
+
+    async def reconnect(self, connection: AsyncPooledConnection):
+        """
+        Replaces the session of `connection`, taken from `session`, with a new one, such as after the server
+        closed it while it was idle.
+        """
+        connection.smtp.close()
+        connection.smtp = await self._connect()
+        connection.created_at = connection.last_used_at = time.monotonic()
+        connection.messages_sent = 0
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, deque()
+        for connection in idle:
+            await self._disconnect(connection)
@@ -1,22 +1,62 @@
+import asyncio
 import logging
-from uuid import uuid4
+import time
+from collections.abc import (Awaitable,
+                             Callable,
+                             Iterable,
+                             Iterator)
+from contextlib import contextmanager
+from email.message import EmailMessage
 
 try:
     from aiosmtplib import (SMTP,
-                            SMTPResponse)
+                            SMTPDataError,
+                            SMTPException,
+                            SMTPNotSupported,
+                            SMTPRecipientRefused,
+                            SMTPReadTimeoutError,
+                            SMTPRecipientsRefused,
+                            SMTPResponse,
+                            SMTPResponseException,
+                            SMTPSenderRefused,
+                            SMTPServerDisconnected,
+                            SMTPTimeoutError)
+    from aiosmtplib import __version__ as aiosmtplib_version
 except ImportError:
-    SMTP = None
-    SMTPResponse = None
+    SMTP = aiosmtplib_version = None
+    SMTPDataError = SMTPException = SMTPNotSupported = SMTPReadTimeoutError = SMTPRecipientRefused = None
+    SMTPRecipientsRefused = SMTPResponse = SMTPResponseException = SMTPSenderRefused = SMTPServerDisconnected = None
+    SMTPTimeoutError = None
 
-from .base import PostalPySMTPBase
+from ..attachments import AttachmentSource
+from ..instrumentation import Observer
+from ..offload import MessageOffload
+from ..ratelimit import RateLimiter
+from .async_pool import AsyncSMTPConnectionPool
+from .base import (SMTPUTF8_REQUIRED,
+                   PostalPySMTPBase)
 from .schemas import SMTPMessageSchema
 
+# Pipelining and flow control take over callbacks of aiosmtplib's protocol, relying on how aiosmtplib 4 handles them
+# (pyproject.toml pins it below 5). With another major version commands are sent one at a time, and message data
+# is written without waiting for the transport
+PROTOCOL_HOOKS_SUPPORTED = aiosmtplib_version is not None and aiosmtplib_version.split('.')[0] == '4'
+
+
+class _SessionClosedError(SMTPServerDisconnected or Exception):
+    """The connection was lost before the first reply of a transaction, so the server accepted none of it."""
+
 
 class PostalPySMTP(PostalPySMTPBase):
     def __init__(self, hostname: str, username: str, password: str, port: int = 25, use_tls: bool = True,
-                 timeout: int = 5, level: logging = logging.INFO):
+                 timeout: int = 5, level: logging = logging.INFO, pool_size: int = 1,
+                 max_messages_per_connection: int | None = None, idle_timeout: float = 60,
+                 rate_limiter: RateLimiter | None = None, observer: Observer | None = None,
+                 offload: MessageOffload | None = None):
         """
         Asynchronous SMTP client for sending messages via a configured SMTP relay.
+        Concurrent `send_message` calls share up to `pool_size` authenticated sessions.
+        With `offload`, large messages are built and encoded off the event loop.
         Requires `aiosmtplib`. Install with `pip install postal_py[smtp]`.
         """
         if SMTP is None:
@@ -25,18 +65,285 @@ class PostalPySMTP(PostalPySMTPBase):
                 '    pip install postal_py[smtp]'
             )
         super().__init__(hostname=hostname, port=port, username=username, password=password, use_tls=use_tls,
-                         timeout=timeout, level=level)
-
-    async def send_message(self, data: SMTPMessageSchema) -> tuple[dict[str, SMTPResponse], str]:
-        request_id = uuid4().hex
-        self._logger.info('Request=%s data=%s', request_id, data.model_dump(
-            exclude_none=True, exclude={'plain_body', 'html_body', 'attachments'}
-        ))
-        message = self._prepare_message(data=data)
-        smtp = SMTP(hostname=self._hostname, port=self._port, timeout=self._timeout, start_tls=self._use_tls)
-        await smtp.connect()
-        await smtp.login(self._username, self._password)
-        result = await smtp.sendmail(data.from_, data.to + data.cc + data.bcc, message.as_string())
-        await smtp.quit()
+                         timeout=timeout, level=level, pool_size=pool_size,
+                         max_messages_per_connection=max_messages_per_connection, idle_timeout=idle_timeout,
+                         rate_limiter=rate_limiter, observer=observer)
+        self._pool = AsyncSMTPConnectionPool(connect=self._connect, max_size=self._pool_size,
+                                             max_messages=self._max_messages_per_connection,
+                                             idle_timeout=self._idle_timeout)
+        self._offload = offload
+
+    async def _connect(self) -> SMTP:
+        # STARTTLS is issued separately from connect() so that its time can be reported on its own
+        smtp = SMTP(hostname=self._hostname, port=self._port, timeout=self._timeout, start_tls=False)
+        started = phase_started = time.perf_counter()
+        timings = {}
+        try:
+            await smtp.connect()
+            timings['connect'], phase_started = time.perf_counter() - phase_started, time.perf_counter()
+            if self._use_tls:
+                await smtp.starttls(tls_context=self._ssl_context)
+                timings['tls'], phase_started = time.perf_counter() - phase_started, time.perf_counter()
+            await smtp.login(self._username, self._password)
+            timings['auth'] = time.perf_counter() - phase_started
+        except BaseException as e:
+            smtp.close()
+            if self._observer is not None:
+                self._observe(operation='connect', started=started, error=e, timings=timings)
+            raise
+        if self._observer is not None:
+            self._observe(operation='connect', started=started, timings=timings)
+        return smtp
+
+    async def send_message(self, data: SMTPMessageSchema,
+                           message: EmailMessage | None = None) -> tuple[dict[str, SMTPResponse], str]:
+        request_id = self._log_request(data=data)
+        await self._acquire_rate_limit(data=data)
+        results, data_reply = await self._send_pooled(data=data, message=message)
+        refused = {recipient: reply for recipient, reply in results.items() if reply.code not in (250, 251)}
+        result = refused, data_reply.message
         self._logger.info('Response=%s result=%s', request_id, result)
         return result
+
+    async def _execute_pipelined(self, smtp: SMTP, commands: list[bytes]) -> list[SMTPResponse]:
+        # aiosmtplib parses one reply per data_received call and drops data that arrives while a reply is
+        # waiting to be read, so replies to the pipelined group are collected by temporarily taking over
+        # the protocol callbacks. The end of the connection is signalled here, as aiosmtplib would only
+        # signal it to the reader of its own reply. Only used with `PROTOCOL_HOOKS_SUPPORTED`
+        protocol = smtp.protocol
+        buffer = bytearray()
+        replies = []
+        received = asyncio.get_running_loop().create_future()
+
+        def fail(error: Exception):
+            if not received.done():
+                received.set_exception(error)
+
+        def data_received(data: bytes):
+            buffer.extend(data)
+            try:
+                while (reply := self._parse_reply(buffer=buffer)) is not None:
+                    code, message = reply
+                    replies.append(SMTPResponse(code, message.decode('utf-8', 'surrogateescape')))
+            except ValueError:
+                fail(SMTPResponseException(-1, f'Malformed SMTP response: {bytes(buffer[:100])!r}'))
+                return
+            if len(replies) >= len(commands) and not received.done():
+                received.set_result(None)
+
+        def lose(message: str):
+            # With no reply yet, the server accepted nothing of the transaction
+            fail((SMTPServerDisconnected if replies else _SessionClosedError)(message))
+
+        def eof_received() -> bool:
+            lose('Unexpected EOF received')
+            # Closes the transport, which then reports the lost connection to aiosmtplib
+            return False
+
+        def connection_lost(error: Exception | None):
+            lose('Connection lost')
+            original_connection_lost(error)
+
+        original_connection_lost = protocol.connection_lost
+        protocol.data_received = data_received
+        protocol.eof_received = eof_received
+        protocol.connection_lost = connection_lost
+        try:
+            try:
+                protocol.write(b''.join(command + b'\r\n' for command in commands))
+            except SMTPServerDisconnected as e:
+                raise _SessionClosedError(*e.args) from e
+            await asyncio.wait_for(received, timeout=self._timeout)
+        except asyncio.TimeoutError as e:
+            raise SMTPReadTimeoutError('Timed out waiting for pipelined server responses') from e
+        finally:
+            del protocol.data_received, protocol.eof_received, protocol.connection_lost
+        return replies
+
+    @contextmanager
+    def _flow_control(self, smtp: SMTP) -> Iterator[Callable[[], Awaitable[None]]]:
+        """
+        A drain for message data written to `smtp`, which waits while the transport has paused writing,
+        so a streamed attachment is not buffered whole. aiosmtplib keeps its flow control private, so the
+        transport's `pause_writing` and `resume_writing` calls are observed by wrapping the protocol's while
+        the data is written. Without `PROTOCOL_HOOKS_SUPPORTED` the drain does not wait.
+        """
+        protocol = smtp.protocol
+        writable = asyncio.Event()
+
+        async def drain():
+            if not writable.is_set():
+                try:
+                    await asyncio.wait_for(writable.wait(), timeout=self._timeout)
+                except asyncio.TimeoutError as e:
+                    raise SMTPTimeoutError('Timed out writing message data') from e
+
+        if not PROTOCOL_HOOKS_SUPPORTED:
+            writable.set()
+            yield drain
+            return
+
+        def pause_writing():
+            writable.clear()
+            original_pause_writing()
+
+        def resume_writing():
+            writable.set()
+            original_resume_writing()
+
+        def connection_lost(error: Exception | None):
+            # The next write then raises, as the transport is gone
+            writable.set()
+            original_connection_lost(error)
+
+        transport = protocol.transport
+        if transport is None or transport.get_write_buffer_size() <= transport.get_write_buffer_limits()[1]:
+            writable.set()
+        original_pause_writing, original_resume_writing = protocol.pause_writing, protocol.resume_writing
+        original_connection_lost = protocol.connection_lost
+        protocol.pause_writing = pause_writing
+        protocol.resume_writing = resume_writing
+        protocol.connection_lost = connection_lost
+        try:
+            yield drain
+        finally:
+            del protocol.pause_writing, protocol.resume_writing, protocol.connection_lost
+
+    async def _send_pooled(self, data: SMTPMessageSchema, message: EmailMessage | None
+                           ) -> tuple[dict[str, SMTPResponse], SMTPResponse]:
+        # Built before a pooled session is taken, so other messages can use it meanwhile. A session is taken
+        # per transaction, so the pool counts each one against `max_messages_per_connection`.
+        # A reused session may have been closed by the server while it was idle, which is only noticed
+        # by its first command; the transaction is then sent once more on a new session
+        rendered = await self._render(data=data, message=message)
+
+        async def send(smtp: SMTP) -> tuple[dict[str, SMTPResponse], SMTPResponse]:
+            if smtp.last_ehlo_response is None:
+                await smtp.ehlo()
+            pipelining = PROTOCOL_HOOKS_SUPPORTED and smtp.supports_extension('pipelining')
+            return await self._send_transaction(smtp=smtp, data=data, message=message, pipelining=pipelining,
+                                                rendered=rendered)
+
+        async with self._pool.session() as connection:
+            try:
+                return await send(smtp=connection.smtp)
+            except _SessionClosedError as e:
+                if connection.messages_sent == 0:
+                    raise
+                self._logger.warning('Pooled SMTP session was closed by the server, reconnecting: %s', e)
+            await self._pool.reconnect(connection)
+            return await send(smtp=connection.smtp)
+
+    async def _acquire_rate_limit(self, data: SMTPMessageSchema):
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire_async(recipients=len(self._get_recipients(data=data)))
+
+    async def _render(self, data: SMTPMessageSchema,
+                      message: EmailMessage | None) -> tuple[list[bytes], dict[bytes, AttachmentSource]] | None:
+        """
+        The message rendered by the offload, None without one, in which case it is rendered while it is sent.
+        """
+        if self._offload is None:
+            return None
+        local = any(isinstance(attachment.data, AttachmentSource) for attachment in data.attachments or ())
+        return await self._offload.run(self._render_data, size=self._offload.get_message_size(data=data), local=local,
+                                       data=data, message=message)
+
+    async def _open_transaction(self, smtp: SMTP, head: bytes) -> SMTPResponse:
+        """
+        Sends the first command and returns its reply.
+        """
+        try:
+            smtp.protocol.write(head)
+            return await smtp.protocol.read_response(timeout=self._timeout)
+        except SMTPServerDisconnected as e:
+            raise _SessionClosedError(*e.args) from e
+
+    async def _send_transaction(self, smtp: SMTP, data: SMTPMessageSchema, message: EmailMessage | None,
+                                pipelining: bool,
+                                rendered: tuple[list[bytes], dict[bytes, AttachmentSource]] | None = None
+                                ) -> tuple[dict[str, SMTPResponse], SMTPResponse]:
+        started = time.perf_counter()
+        sent = 0
+        data_reply = error = None
+        try:
+            recipients = self._get_recipients(data=data)
+            if (utf8 := self._is_international(data=data)) and not smtp.supports_extension('smtputf8'):
+                raise SMTPNotSupported(SMTPUTF8_REQUIRED)
+            commands = self._get_envelope_commands(sender=data.from_, recipients=recipients, utf8=utf8)
+            if pipelining:
+                replies = await self._execute_pipelined(smtp=smtp, commands=commands)
+            else:
+                # The envelope stops at a refused MAIL FROM; DATA, the last command, is sent after the RCPT TOs
+                replies = [await self._open_transaction(smtp=smtp, head=commands[0] + b'\r\n')]
+                for command in commands[1:] if replies[0].code == 250 else ():
+                    smtp.protocol.write(command + b'\r\n')
+                    replies.append(await smtp.protocol.read_response(timeout=self._timeout))
+            mail_reply, *rcpt_replies = replies
+            results = dict(zip(recipients, rcpt_replies))
+            refused = {recipient: reply for recipient, reply in results.items() if reply.code not in (250, 251)}
+            data_reply = replies[-1] if len(replies) == len(commands) else SMTPResponse(-1, '')
+            if data_reply.code == 354:
+                # The server may accept DATA even if every RCPT was refused, an empty message closes it
+                if len(refused) < len(recipients):
+                    chunks = self._iter_data(data=data, message=message, rendered=rendered)
+                else:
+                    chunks = (b'.\r\n',)
+                with self._flow_control(smtp=smtp) as drain:
+                    for chunk in chunks:
+                        smtp.protocol.write(chunk)
+                        sent += len(chunk)
+                        await drain()
+                data_reply = await smtp.protocol.read_response(timeout=self._timeout)
+                if data_reply.code == 250 and len(refused) < len(recipients):
+                    return results, data_reply
+            await smtp.rset()
+            if mail_reply.code != 250:
+                raise SMTPSenderRefused(mail_reply.code, mail_reply.message, data.from_)
+            if len(refused) == len(recipients):
+                raise SMTPRecipientsRefused([SMTPRecipientRefused(reply.code, reply.message, recipient)
+                                             for recipient, reply in refused.items()])
+            raise SMTPDataError(data_reply.code, data_reply.message)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self._observer is not None:
+                status_code = getattr(error, 'code', data_reply.code if data_reply is not None else None)
+                self._observe(operation='send_message', started=started, error=error, status_code=status_code,
+                              request_bytes=sent)
+
+    async def send_messages(self, data: Iterable[SMTPMessageSchema | tuple[SMTPMessageSchema, EmailMessage]]
+                            ) -> list[dict[str, SMTPResponse] | SMTPException]:
+        """
+        Sends messages one after another, each on a pooled session, pipelining MAIL FROM, RCPT TO and DATA
+        when the server advertises PIPELINING. A session is taken per message once it is rendered and
+        the rate limiter let it through, so it is not held meanwhile, and is replaced after
+        `max_messages_per_connection` messages. Returns the RCPT reply of every recipient for each message,
+        or the refusal error of messages that were not accepted, `SMTPNotSupported` for messages with
+        non-ASCII addresses when the server does not support SMTPUTF8.
+        When the session fails, such as on a lost connection, the error is returned for the message in progress
+        and every message after it, as none of them were delivered, or raised if no message was done yet.
+        An item can be a `(data, message)` pair to send a pre-built MIME message, as `MailMerge.render_mime` returns.
+        """
+        request_id = self._new_request_id()
+        items = list(data)
+        results = []
+        self._logger.info('Request=%s messages=%s', request_id, len(items))
+        try:
+            for item in items:
+                item, message = item if isinstance(item, tuple) else (item, None)
+                await self._acquire_rate_limit(data=item)
+                try:
+                    results.append((await self._send_pooled(data=item, message=message))[0])
+                except (SMTPResponseException, SMTPRecipientsRefused, SMTPNotSupported) as e:
+                    results.append(e)
+        except (SMTPException, OSError) as e:
+            if not results:
+                raise
+            results.extend([e] * (len(items) - len(results)))
+        self._logger.info('Response=%s results=%s', request_id, results)
+        return results
+
+    async def close(self):
+        await self._pool.close()
@@ -1,23 +1,108 @@
 import logging
-from email.message import EmailMessage
+import re
+import ssl
+import time
+from collections.abc import Iterator
+from email.message import (EmailMessage,
+                           MIMEPart)
+from email.utils import parseaddr
+from functools import partial
+from uuid import uuid4
 
-from .schemas import SMTPMessageSchema
+from ..attachments import (AttachmentSource,
+                           get_attachment_cache)
+from ..instrumentation import (Observer,
+                               RequestEvent)
+from ..ratelimit import RateLimiter
+from .schemas import (SMTPAttachmentSchema,
+                      SMTPMessageSchema)
+
+# As smtplib words it, so both clients fail the same way
+SMTPUTF8_REQUIRED = ('One or more source or delivery addresses require internationalized email support, '
+                     'but the server does not advertise the required SMTPUTF8 capability')
 
 
 class PostalPySMTPBase:
     def __init__(self, hostname: str, port: int, username: str, password: str, use_tls: bool, timeout: int,
-                 level: logging):
+                 level: logging, pool_size: int = 1, max_messages_per_connection: int | None = None,
+                 idle_timeout: float = 60, rate_limiter: RateLimiter | None = None,
+                 observer: Observer | None = None):
         self._hostname = hostname
         self._port = port
         self._username = username
         self._password = password
         self._use_tls = use_tls
         self._timeout = timeout
+        self._pool_size = pool_size
+        self._max_messages_per_connection = max_messages_per_connection
+        self._idle_timeout = idle_timeout
+        self._rate_limiter = rate_limiter
+        self._observer = observer
+        self._ssl_context = ssl.create_default_context() if use_tls else None
         self._logger = logging.getLogger('PostalPySMTP')
         self._logger.setLevel(level)
 
+    def _new_request_id(self) -> str:
+        # Request ids only tie log records together, so none is generated when INFO records are not emitted
+        return uuid4().hex if self._logger.isEnabledFor(logging.INFO) else '-'
+
+    def _log_request(self, data: SMTPMessageSchema) -> str:
+        request_id = self._new_request_id()
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info('Request=%s data=%s', request_id, data.model_dump(
+                exclude_none=True, exclude={'plain_body', 'html_body', 'attachments'}
+            ))
+        return request_id
+
+    def _observe(self, operation: str, started: float, error: BaseException | None = None,
+                 status_code: int | None = None, request_bytes: int | None = None,
+                 timings: dict[str, float] | None = None):
+        duration = time.perf_counter() - started
+        self._observer.on_event(RequestEvent(
+            client='smtp', operation=operation, started_at=time.time() - duration, duration=duration,
+            status_code=status_code, error=error, request_bytes=request_bytes, timings=timings
+        ))
+
+    @staticmethod
+    def _get_bytes_part(data: bytes, content_type: str, name: str) -> MIMEPart:
+        part = MIMEPart()
+        maintype, subtype = content_type.split('/')
+        part.set_content(data, maintype=maintype, subtype=subtype, filename=name)
+        return part
+
     @staticmethod
-    def _prepare_message(data: SMTPMessageSchema) -> EmailMessage:
+    def _attachment_part(attachment: SMTPAttachmentSchema,
+                         sources: dict[bytes, AttachmentSource] | None = None) -> MIMEPart:
+        """
+        With `sources`, an attachment read from an `AttachmentSource` gets a placeholder payload instead of its content,
+        and the placeholder is collected into `sources` for `_iter_data` to stream in its place.
+        Parts of attachments held as bytes are taken from the attachment cache when one is installed.
+        """
+        if not isinstance(attachment.data, AttachmentSource):
+            build = partial(PostalPySMTPBase._get_bytes_part, data=attachment.data,
+                            content_type=attachment.content_type, name=attachment.name)
+            if (cache := get_attachment_cache()) is None:
+                return build()
+            return cache.get_mime_part(data=attachment.data, content_type=attachment.content_type,
+                                       name=attachment.name, build=build)
+        part = MIMEPart()
+        maintype, subtype = attachment.content_type.split('/')
+        if sources is None:
+            part.set_content(attachment.data.read(), maintype=maintype, subtype=subtype, filename=attachment.name)
+        else:
+            placeholder = f'postal-py-attachment-{uuid4().hex}'
+            part.set_content(b'', maintype=maintype, subtype=subtype, filename=attachment.name)
+            part.set_payload(placeholder)
+            sources[placeholder.encode()] = attachment.data
+        return part
+
+    @classmethod
+    def _prepare_message(cls, data: SMTPMessageSchema, sources: dict[bytes, AttachmentSource] | None = None,
+                         attachment_parts: list[MIMEPart] | None = None) -> EmailMessage:
+        """
+        `attachment_parts` are attached as they are instead of encoding `data.attachments`,
+        so parts shared by many messages are encoded once.
+        """
         message = EmailMessage()
         message['From'] = data.from_
         if data.to:
@@ -32,9 +117,109 @@ class PostalPySMTPBase:
             message.set_content(data.plain_body)
         if data.html_body is not None:
             message.add_alternative(data.html_body, subtype='html')
-        for attachment in data.attachments or ():
-            maintype, subtype = attachment.content_type.split('/')
-            message.add_attachment(attachment.data, maintype=maintype, subtype=subtype, filename=attachment.name)
+        if attachment_parts is None:
+            attachment_parts = [cls._attachment_part(attachment=attachment, sources=sources)
+                                for attachment in data.attachments or ()]
+        for part in attachment_parts:
+            if message.get_content_type() != 'multipart/mixed':
+                message.make_mixed()
+            message.attach(part)
         for k, v in (data.headers or {}).items():
             message[k] = v
         return message
+
+    @staticmethod
+    def _get_recipients(data: SMTPMessageSchema) -> list[str]:
+        return data.to + data.cc + data.bcc
+
+    @staticmethod
+    def _get_address(address: str) -> str:
+        _, email = parseaddr(address)
+        return email or address.strip()
+
+    @classmethod
+    def _is_international(cls, data: SMTPMessageSchema) -> bool:
+        """
+        Whether an envelope address is not ASCII, so that the message can only be sent with SMTPUTF8.
+        Display names do not count, the message headers encode them.
+        """
+        return not all(cls._get_address(address=address).isascii()
+                       for address in (data.from_, *cls._get_recipients(data=data)))
+
+    @classmethod
+    def _quote_address(cls, address: str, utf8: bool = False) -> bytes:
+        return f'<{cls._get_address(address=address)}>'.encode('utf-8' if utf8 else 'ascii')
+
+    @classmethod
+    def _get_envelope_commands(cls, sender: str, recipients: list[str], utf8: bool = False) -> list[bytes]:
+        """
+        With `utf8`, addresses are sent as UTF-8 and MAIL FROM asks for SMTPUTF8, as smtplib does.
+        """
+        options = b' SMTPUTF8 BODY=8BITMIME' if utf8 else b''
+        return [
+            b'MAIL FROM:' + cls._quote_address(address=sender, utf8=utf8) + options,
+            *(b'RCPT TO:' + cls._quote_address(address=recipient, utf8=utf8) for recipient in recipients),
+            b'DATA'
+        ]
+
+    @staticmethod
+    def _dot_stuff(data: bytes) -> bytes:
+        return re.sub(rb'(?m)^\.', b'..', data)
+
+    @classmethod
+    def _render_data(cls, data: SMTPMessageSchema,
+                     message: EmailMessage | None = None) -> tuple[list[bytes], dict[bytes, AttachmentSource]]:
+        """
+        The message as dot-stuffed segments with CRLF line endings, terminated for the DATA phase, and the sources
+        of attachments read from an `AttachmentSource`, keyed by the placeholder segments that stand for them.
+        """
+        sources = {}
+        if message is None:
+            message = cls._prepare_message(data=data, sources=sources)
+        policy = message.policy.clone(linesep='\r\n')
+        if cls._is_international(data=data):
+            # Non-ASCII addresses go into the headers as they are, which the server accepted with SMTPUTF8
+            policy = policy.clone(utf8=True)
+        raw = message.as_bytes(policy=policy)
+        segments = re.split(b'(' + b'|'.join(map(re.escape, sources)) + b')', raw) if sources else [raw]
+        del raw
+        for index, segment in enumerate(segments):
+            # Base64 lines never start with a dot, so placeholders need no stuffing
+            if segment not in sources:
+                segments[index] = cls._dot_stuff(segment)
+        # The split always ends with the text after the last placeholder, which the terminator goes out with:
+        # a separate small write would be held back by Nagle's algorithm until the server's delayed ACK
+        segments[-1] += b'.\r\n' if segments[-1].endswith(b'\r\n') else b'\r\n.\r\n'
+        return segments, sources
+
+    @classmethod
+    def _iter_data(cls, data: SMTPMessageSchema, message: EmailMessage | None = None,
+                   rendered: tuple[list[bytes], dict[bytes, AttachmentSource]] | None = None) -> Iterator[bytes]:
+        """
+        Message bytes with CRLF line endings, dot-stuffed and terminated for the DATA phase.
+        Attachments read from an `AttachmentSource` are base64-encoded chunk by chunk while they are sent,
+        the rest of the message is generated as bytes once, unless it was `rendered` ahead of time.
+        A pre-built `message` is sent as it is.
+        """
+        segments, sources = rendered or cls._render_data(data=data, message=message)
+        for segment in segments:
+            if segment in sources:
+                yield from sources[segment].iter_mime_base64()
+            else:
+                yield segment
+
+    @staticmethod
+    def _parse_reply(buffer: bytearray) -> tuple[int, bytes] | None:
+        """
+        Pops one complete, possibly multiline, reply from the start of `buffer`.
+        """
+        offset = 0
+        lines = []
+        while (end := buffer.find(b'\n', offset)) != -1:
+            line = bytes(buffer[offset:end + 1])
+            offset = end + 1
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                del buffer[:offset]
+                return int(line[:3]), b'\n'.join(lines)
+        return None
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+from collections.abc import (Callable,
+                             Iterator)
+from contextlib import (contextmanager,
+                        suppress)
+from smtplib import (SMTP,
+                     SMTPDataError,
+                     SMTPException,
+                     SMTPNotSupportedError,
+                     SMTPRecipientsRefused,
+                     SMTPSenderRefused)
+
+
+class PooledConnection:
+    __slots__ = ('smtp', 'created_at', 'last_used_at', 'messages_sent')
+
+    def __init__(self, smtp: SMTP):
+        self.smtp = smtp
+        self.created_at = self.last_used_at = time.monotonic()
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool:
+    # smtplib resets the envelope itself before raising these, so the session stays usable,
+    # and SMTPNotSupportedError is raised before a transaction is started
+    _recoverable_errors = (SMTPDataError, SMTPNotSupportedError, SMTPRecipientsRefused, SMTPSenderRefused)
+
+    def __init__(self, connect: Callable[[], SMTP], max_size: int = 1, max_messages: int | None = None,
+                 idle_timeout: float = 60, check_after: float = 5):
+        """
+        Thread-safe pool of authenticated `smtplib.SMTP` sessions.
+        At most `max_size` sessions exist at once, other callers wait for a free one.
+        A session idle for more than `check_after` seconds is checked with an RSET before it is reused,
+        one used more recently is reused as it is, saving a round trip per message; if the server closed it
+        meanwhile, the caller replaces it with `reconnect`.
+        """
+        self._connect = connect
+        self._max_messages = max_messages
+        self._idle_timeout = idle_timeout
+        self._check_after = check_after
+        self._idle: deque[PooledConnection] = deque()
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    @staticmethod
+    def _disconnect(connection: PooledConnection):
+        with suppress(SMTPException, OSError):
+            connection.smtp.quit()
+        connection.smtp.close()
+
+    def _evict_idle(self) -> list[PooledConnection]:
+        expired = []
+        deadline = time.monotonic() - self._idle_timeout
+        with self._lock:
+            while self._idle and self._idle[0].last_used_at < deadline:
+                expired.append(self._idle.popleft())
+        return expired
+
+    def _is_alive(self, connection: PooledConnection) -> bool:
+        if time.monotonic() - connection.last_used_at <= self._check_after:
+            return True
+        try:
+            code, _ = connection.smtp.rset()
+        except (SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _acquire(self) -> PooledConnection:
+        for connection in self._evict_idle():
+            self._disconnect(connection)
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                return PooledConnection(smtp=self._connect())
+            if self._is_alive(connection):
+                return connection
+            self._disconnect(connection)
+
+    def _release(self, connection: PooledConnection):
+        connection.last_used_at = time.monotonic()
+        if self._closed or (self._max_messages is not None and connection.messages_sent >= self._max_messages):
+            self._disconnect(connection)
+            return
+        with self._lock:
+            self._idle.append(connection)
+
+    @contextmanager
+    def session(self) -> Iterator[PooledConnection]:
+        """
+        A pooled session along with its age and use, released when the block ends and counted as one message.
+        """
+        if self._closed:
+            raise RuntimeError('SMTP connection pool is closed')
+        self._semaphore.acquire()
+        try:
+            connection = self._acquire()
+            try:
+                yield connection
+            except self._recoverable_errors:
+                connection.messages_sent += 1
+                self._release(connection)
+                raise
+            except BaseException:
+                # The session may be mid-transaction, drop it without a QUIT
+                connection.smtp.close()
+                raise
+            connection.messages_sent += 1
+            self._release(connection)
+        finally:
+            self._semaphore.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[SMTP]:
+        with self.session() as connection:
+            yield connection.smtp
+
+    def reconnect(self, connection: PooledConnection):
+        """
+        Replaces the session of `connection`, taken from `session`, with a new one, such as after the server
+        closed it while it was idle.
+        """
+        connection.smtp.close()
+        connection.smtp = self._connect()
+        connection.created_at = connection.last_used_at = time.monotonic()
+        connection.messages_sent = 0
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection in idle:
+            self._disconnect(connection)
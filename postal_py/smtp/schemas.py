@@ -1,27 +1,41 @@
-import base64
+from typing import Any
 
 from pydantic import (BaseModel as PydanticBaseModel,
                       Field,
+                      field_serializer,
                       field_validator)
 
+from ..attachments import (AttachmentSource,
+                           decode_base64,
+                           encode_base64)
+
 
 class BaseModel(PydanticBaseModel):
     model_config = {
-        'populate_by_name': True
+        'populate_by_name': True,
+        # Validators are built on first use instead of at import, so unused schemas cost nothing
+        'defer_build': True
     }
 
 
 class SMTPAttachmentSchema(BaseModel):
     name: str
     content_type: str = 'application/octet-stream'
-    data: str | bytes
+    data: str | bytes | AttachmentSource
 
     @field_validator('data', mode='before')
     @classmethod
-    def to_base64(cls, value: str | bytes) -> bytes:
+    def to_base64(cls, value: Any) -> bytes | AttachmentSource:
         if isinstance(value, str):
-            value = base64.b64decode(value)
-        return value
+            value = decode_base64(value)
+        return AttachmentSource.from_value(value)
+
+    @field_serializer('data', when_used='json')
+    def from_bytes(self, value: bytes | AttachmentSource) -> str:
+        # Base64, so that JSON dumps validate back into the same bytes
+        if isinstance(value, bytes):
+            return encode_base64(value)
+        return value.read_base64()
 
 
 class SMTPMessageSchema(BaseModel):
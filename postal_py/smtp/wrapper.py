@@ -1,30 +1,192 @@
 import logging
-import ssl
-from smtplib import SMTP
+import time
+from collections.abc import Iterable
+from email.message import EmailMessage
+from smtplib import (SMTP,
+                     SMTPDataError,
+                     SMTPException,
+                     SMTPNotSupportedError,
+                     SMTPRecipientsRefused,
+                     SMTPResponseException,
+                     SMTPSenderRefused,
+                     SMTPServerDisconnected)
 from typing import Any
-from uuid import uuid4
 
-from .base import PostalPySMTPBase
+from ..instrumentation import Observer
+from ..ratelimit import RateLimiter
+from .base import (SMTPUTF8_REQUIRED,
+                   PostalPySMTPBase)
+from .pool import SMTPConnectionPool
 from .schemas import SMTPMessageSchema
 
 
+class _SessionClosedError(SMTPServerDisconnected):
+    """The connection was lost before the first reply of a transaction, so the server accepted none of it."""
+
+
 class PostalPySMTP(PostalPySMTPBase):
     def __init__(self, hostname: str, username: str, password: str, port: int = 25, use_tls: bool = True,
-                 timeout: int = 5, level: logging = logging.INFO):
+                 timeout: int = 5, level: logging = logging.INFO, pool_size: int = 1,
+                 max_messages_per_connection: int | None = None, idle_timeout: float = 60,
+                 rate_limiter: RateLimiter | None = None, observer: Observer | None = None):
+        """
+        Synchronous SMTP client for sending messages via a configured SMTP relay.
+        Authenticated sessions are kept in a thread-safe pool of up to `pool_size` connections
+        and closed after `idle_timeout` seconds without use.
+        """
         super().__init__(hostname=hostname, port=port, username=username, password=password, use_tls=use_tls,
-                         timeout=timeout, level=level)
-
-    def send_message(self, data: SMTPMessageSchema) -> dict[str, Any]:
-        request_id = uuid4().hex
-        self._logger.info('Request=%s data=%s', request_id, data.model_dump(
-            exclude_none=True, exclude={'plain_body', 'html_body', 'attachments'}
-        ))
-        message = self._prepare_message(data=data)
-        with SMTP(host=self._hostname, port=self._port, timeout=self._timeout) as smtp:
+                         timeout=timeout, level=level, pool_size=pool_size,
+                         max_messages_per_connection=max_messages_per_connection, idle_timeout=idle_timeout,
+                         rate_limiter=rate_limiter, observer=observer)
+        self._pool = SMTPConnectionPool(connect=self._connect, max_size=self._pool_size,
+                                        max_messages=self._max_messages_per_connection,
+                                        idle_timeout=self._idle_timeout)
+
+    def _connect(self) -> SMTP:
+        started = phase_started = time.perf_counter()
+        timings = {}
+        smtp = None
+        try:
+            smtp = SMTP(host=self._hostname, port=self._port, timeout=self._timeout)
+            timings['connect'], phase_started = time.perf_counter() - phase_started, time.perf_counter()
             if self._use_tls:
-                context = ssl.create_default_context()
-                smtp.starttls(context=context)
+                smtp.starttls(context=self._ssl_context)
+                timings['tls'], phase_started = time.perf_counter() - phase_started, time.perf_counter()
             smtp.login(user=self._username, password=self._password)
-            result = smtp.send_message(msg=message, from_addr=data.from_, to_addrs=data.to + data.cc + data.bcc)
-            self._logger.info('Response=%s result=%s', request_id, result)
-            return result
+            timings['auth'] = time.perf_counter() - phase_started
+        except BaseException as e:
+            if smtp is not None:
+                smtp.close()
+            if self._observer is not None:
+                self._observe(operation='connect', started=started, error=e, timings=timings)
+            raise
+        if self._observer is not None:
+            self._observe(operation='connect', started=started, timings=timings)
+        return smtp
+
+    def send_message(self, data: SMTPMessageSchema, message: EmailMessage | None = None) -> dict[str, Any]:
+        request_id = self._log_request(data=data)
+        self._acquire_rate_limit(data=data)
+        results, _ = self._send_pooled(data=data, message=message)
+        result = {recipient: reply for recipient, reply in results.items() if reply[0] not in (250, 251)}
+        self._logger.info('Response=%s result=%s', request_id, result)
+        return result
+
+    def _send_pooled(self, data: SMTPMessageSchema, message: EmailMessage | None
+                     ) -> tuple[dict[str, tuple[int, bytes]], tuple[int, bytes]]:
+        # A session is taken per transaction, so the pool counts each one against `max_messages_per_connection`.
+        # A reused session may have been closed by the server while it was idle, which is only noticed
+        # by its first command; the transaction is then sent once more on a new session
+        def send(smtp: SMTP) -> tuple[dict[str, tuple[int, bytes]], tuple[int, bytes]]:
+            smtp.ehlo_or_helo_if_needed()
+            return self._send_transaction(smtp=smtp, data=data, message=message,
+                                          pipelining=smtp.has_extn('pipelining'))
+
+        with self._pool.session() as connection:
+            try:
+                return send(smtp=connection.smtp)
+            except _SessionClosedError as e:
+                if connection.messages_sent == 0:
+                    raise
+                self._logger.warning('Pooled SMTP session was closed by the server, reconnecting: %s', e)
+            self._pool.reconnect(connection)
+            return send(smtp=connection.smtp)
+
+    def _acquire_rate_limit(self, data: SMTPMessageSchema):
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(recipients=len(self._get_recipients(data=data)))
+
+    @staticmethod
+    def _open_transaction(smtp: SMTP, head: bytes) -> tuple[int, bytes]:
+        """
+        Sends the first command, or the pipelined envelope, and returns the first reply.
+        """
+        try:
+            smtp.send(head)
+            return smtp.getreply()
+        except SMTPServerDisconnected as e:
+            raise _SessionClosedError(*e.args) from e
+
+    def _send_transaction(self, smtp: SMTP, data: SMTPMessageSchema, message: EmailMessage | None,
+                          pipelining: bool) -> tuple[dict[str, tuple[int, bytes]], tuple[int, bytes]]:
+        started = time.perf_counter()
+        sent = 0
+        data_code = error = None
+        try:
+            recipients = self._get_recipients(data=data)
+            if (utf8 := self._is_international(data=data)) and not smtp.has_extn('smtputf8'):
+                raise SMTPNotSupportedError(SMTPUTF8_REQUIRED)
+            commands = self._get_envelope_commands(sender=data.from_, recipients=recipients, utf8=utf8)
+            if pipelining:
+                replies = [self._open_transaction(smtp=smtp, head=b''.join(command + b'\r\n' for command in commands))]
+                replies += [smtp.getreply() for _ in commands[1:]]
+            else:
+                # The envelope stops at a refused MAIL FROM; DATA, the last command, is sent after the RCPT TOs
+                replies = [self._open_transaction(smtp=smtp, head=commands[0] + b'\r\n')]
+                for command in commands[1:] if replies[0][0] == 250 else ():
+                    smtp.send(command + b'\r\n')
+                    replies.append(smtp.getreply())
+            (mail_code, mail_message), *rcpt_replies = replies
+            results = dict(zip(recipients, rcpt_replies))
+            refused = {recipient: reply for recipient, reply in results.items() if reply[0] not in (250, 251)}
+            data_code, data_message = replies[-1] if len(replies) == len(commands) else (None, b'')
+            if data_code == 354:
+                # The server may accept DATA even if every RCPT was refused, an empty message closes it
+                if len(refused) < len(recipients):
+                    chunks = self._iter_data(data=data, message=message)
+                else:
+                    chunks = (b'.\r\n',)
+                for chunk in chunks:
+                    smtp.send(chunk)
+                    sent += len(chunk)
+                data_code, data_message = smtp.getreply()
+                if data_code == 250 and len(refused) < len(recipients):
+                    return results, (data_code, data_message)
+            smtp.rset()
+            if mail_code != 250:
+                raise SMTPSenderRefused(mail_code, mail_message, data.from_)
+            if len(refused) == len(recipients):
+                raise SMTPRecipientsRefused(refused)
+            raise SMTPDataError(data_code, data_message)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self._observer is not None:
+                self._observe(operation='send_message', started=started, error=error,
+                              status_code=getattr(error, 'smtp_code', data_code), request_bytes=sent)
+
+    def send_messages(self, data: Iterable[SMTPMessageSchema | tuple[SMTPMessageSchema, EmailMessage]]
+                      ) -> list[dict[str, tuple[int, bytes]] | SMTPException]:
+        """
+        Sends messages one after another, each on a pooled session, pipelining MAIL FROM, RCPT TO and DATA
+        when the server advertises PIPELINING. A session is taken per message, so it is not held while
+        the rate limiter waits and is replaced after `max_messages_per_connection` messages.
+        Returns the RCPT reply of every recipient for each message, or the refusal error of messages
+        that were not accepted, `SMTPNotSupportedError` for messages with non-ASCII addresses when the server
+        does not support SMTPUTF8.
+        When the session fails, such as on a lost connection, the error is returned for the message in progress
+        and every message after it, as none of them were delivered, or raised if no message was done yet.
+        An item can be a `(data, message)` pair to send a pre-built MIME message, as `MailMerge.render_mime` returns.
+        """
+        request_id = self._new_request_id()
+        items = list(data)
+        results = []
+        self._logger.info('Request=%s messages=%s', request_id, len(items))
+        try:
+            for item in items:
+                item, message = item if isinstance(item, tuple) else (item, None)
+                self._acquire_rate_limit(data=item)
+                try:
+                    results.append(self._send_pooled(data=item, message=message)[0])
+                except (SMTPResponseException, SMTPRecipientsRefused, SMTPNotSupportedError) as e:
+                    results.append(e)
+        except (SMTPException, OSError) as e:
+            if not results:
+                raise
+            results.extend([e] * (len(items) - len(results)))
+        self._logger.info('Response=%s results=%s', request_id, results)
+        return results
+
+    def close(self):
+        self._pool.close()
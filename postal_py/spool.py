@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from smtplib import (SMTPNotSupportedError,
+                     SMTPRecipientsRefused,
+                     SMTPResponseException)
+from typing import Any
+
+try:
+    from aiosmtplib import SMTPNotSupported as AsyncSMTPNotSupported
+    from aiosmtplib import SMTPRecipientsRefused as AsyncSMTPRecipientsRefused
+    from aiosmtplib import SMTPResponseException as AsyncSMTPResponseException
+except ImportError:
+    # Nothing is an instance of an empty tuple of classes
+    AsyncSMTPNotSupported = AsyncSMTPRecipientsRefused = AsyncSMTPResponseException = ()
+
+from .api.exceptions import (PostalPyAPIError,
+                             PostalPyBadGatewayError,
+                             PostalPyCircuitOpenError,
+                             PostalPyConnectTimeoutError,
+                             PostalPyGatewayTimeoutError,
+                             PostalPyInternalServerError,
+                             PostalPyReadTimeoutError,
+                             PostalPyServiceUnavailableError,
+                             PostalPyUnknownError)
+from .api.schemas import RequestMessageSchema
+from .smtp.schemas import SMTPMessageSchema
+
+TRANSIENT_API_ERRORS = (PostalPyConnectTimeoutError, PostalPyReadTimeoutError, PostalPyCircuitOpenError,
+                        PostalPyInternalServerError, PostalPyBadGatewayError, PostalPyServiceUnavailableError,
+                        PostalPyGatewayTimeoutError, PostalPyUnknownError)
+SCHEMAS = {'api': RequestMessageSchema, 'smtp': SMTPMessageSchema}
+
+
+class SpoolItem:
+    __slots__ = ('id', 'kind', 'payload', 'attempts', 'last_error')
+
+    def __init__(self, id: int, kind: str, payload: str, attempts: int, last_error: str | None = None):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.last_error = last_error
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(id={self.id}, kind={self.kind!r}, attempts={self.attempts})'
+
+    def load(self) -> RequestMessageSchema | SMTPMessageSchema:
+        return SCHEMAS[self.kind].model_validate_json(self.payload)
+
+
+class Spool:
+    def __init__(self, path: str, max_attempts: int = 5, lease_timeout: float = 300, synchronous: str = 'NORMAL'):
+        """
+        Outbound message queue in a SQLite file, shared by every thread and process that opens it.
+        Leased messages that are neither acknowledged nor retried within `lease_timeout` seconds,
+        because their worker died, are delivered again. A message leased `max_attempts` times is dead-lettered.
+        With the default `synchronous='NORMAL'`, an enqueued message survives a crash of the process
+        but not of the operating system; `'FULL'` makes it survive both, at the cost of an fsync per commit.
+        """
+        self._path = path
+        self._max_attempts = max_attempts
+        self._lease_timeout = lease_timeout
+        self._synchronous = synchronous
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        connection = self._connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, '
+                           'payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, '
+                           'dead INTEGER NOT NULL DEFAULT 0, last_error TEXT)')
+        connection.execute('CREATE INDEX IF NOT EXISTS messages_available ON messages (dead, kind, available_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, 'connection', None)) is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self._synchronous}')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @staticmethod
+    def _get_kind(data: RequestMessageSchema | SMTPMessageSchema) -> str:
+        if isinstance(data, RequestMessageSchema):
+            return 'api'
+        if isinstance(data, SMTPMessageSchema):
+            return 'smtp'
+        raise TypeError(f'Cannot spool {type(data).__name__}, expected RequestMessageSchema or SMTPMessageSchema')
+
+    def enqueue(self, data: RequestMessageSchema | SMTPMessageSchema, delay: float = 0) -> int:
+        """
+        Stores the message for delivery and returns its id. Attachments read from files are stored by value.
+        """
+        cursor = self._connect().execute(
+            'INSERT INTO messages (kind, payload, available_at) VALUES (?, ?, ?)',
+            (self._get_kind(data=data), data.model_dump_json(by_alias=True, exclude_none=True), time.time() + delay)
+        )
+        return cursor.lastrowid
+
+    def enqueue_many(self, data: Iterable[RequestMessageSchema | SMTPMessageSchema]) -> int:
+        """
+        Stores the messages in one transaction and returns how many were stored.
+        """
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN')
+        try:
+            cursor = connection.executemany(
+                'INSERT INTO messages (kind, payload, available_at) VALUES (?, ?, ?)',
+                ((self._get_kind(data=item), item.model_dump_json(by_alias=True, exclude_none=True), now)
+                 for item in data)
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return cursor.rowcount
+
+    def lease(self, kind: str, limit: int) -> list[SpoolItem]:
+        """
+        Takes up to `limit` due messages of `kind` ('api' or 'smtp') for delivery, oldest first.
+        Messages stay in the spool, invisible to other workers, until they are acknowledged, retried
+        or their lease expires.
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT id, payload, attempts, last_error FROM messages '
+                'WHERE dead = 0 AND kind = ? AND available_at <= ? ORDER BY available_at, id LIMIT ?',
+                (kind, now, limit)
+            ).fetchall()
+            items, dead = [], []
+            for id, payload, attempts, last_error in rows:
+                if attempts >= self._max_attempts:
+                    # Leased as many times as allowed without an outcome, so its worker kept dying on it
+                    dead.append((last_error or 'Lease expired', id))
+                else:
+                    items.append(SpoolItem(id=id, kind=kind, payload=payload, attempts=attempts + 1,
+                                           last_error=last_error))
+            connection.executemany('UPDATE messages SET dead = 1, last_error = ? WHERE id = ?', dead)
+            connection.executemany('UPDATE messages SET attempts = attempts + 1, available_at = ? WHERE id = ?',
+                                   ((now + self._lease_timeout, item.id) for item in items))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return items
+
+    def ack(self, ids: Iterable[int]):
+        self._connect().executemany('DELETE FROM messages WHERE id = ?', ((id,) for id in ids))
+
+    def retry(self, item: SpoolItem, error: str, delay: float) -> bool:
+        """
+        Makes the message due again after `delay` seconds, or dead-letters it once it ran out of attempts.
+        Returns whether it will be retried.
+        """
+        dead = item.attempts >= self._max_attempts
+        self._connect().execute(
+            'UPDATE messages SET available_at = ?, dead = ?, last_error = ? WHERE id = ?',
+            (time.time() + delay, int(dead), error, item.id)
+        )
+        return not dead
+
+    def dead_letter(self, item: SpoolItem, error: str):
+        self._connect().execute('UPDATE messages SET dead = 1, last_error = ? WHERE id = ?', (error, item.id))
+
+    def get_dead_letters(self, limit: int = 100, after_id: int = 0) -> list[SpoolItem]:
+        rows = self._connect().execute(
+            'SELECT id, kind, payload, attempts, last_error FROM messages WHERE dead = 1 AND id > ? ORDER BY id LIMIT ?',
+            (after_id, limit)
+        ).fetchall()
+        return [SpoolItem(*row) for row in rows]
+
+    def requeue_dead_letters(self, ids: Iterable[int] | None = None) -> int:
+        """
+        Gives dead-lettered messages, all of them by default, a fresh set of attempts.
+        """
+        connection = self._connect()
+        if ids is None:
+            return connection.execute('UPDATE messages SET dead = 0, attempts = 0, available_at = ? WHERE dead = 1',
+                                      (time.time(),)).rowcount
+        return connection.executemany('UPDATE messages SET dead = 0, attempts = 0, available_at = ? WHERE id = ?',
+                                      ((time.time(), id) for id in ids)).rowcount
+
+    def delete(self, ids: Iterable[int]):
+        self.ack(ids=ids)
+
+    def count(self, dead: bool = False) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM messages WHERE dead = ?', (int(dead),)).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class SpoolWorkerBase:
+    def __init__(self, spool: Spool, kind: str, batch_size: int, poll_interval: float, backoff: float,
+                 max_backoff: float, level: logging):
+        self._spool = spool
+        self._kind = kind
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._logger = logging.getLogger('PostalPySpool')
+        self._logger.setLevel(level)
+
+    @staticmethod
+    def _is_transient(error: BaseException) -> bool:
+        if isinstance(error, PostalPyAPIError):
+            return isinstance(error, TRANSIENT_API_ERRORS)
+        if isinstance(error, (SMTPNotSupportedError, AsyncSMTPNotSupported)):
+            # Non-ASCII addresses and a server without SMTPUTF8, which retrying does not change
+            return False
+        if isinstance(error, SMTPResponseException):
+            return error.smtp_code < 500
+        if isinstance(error, SMTPRecipientsRefused):
+            return any(code < 500 for code, _ in error.recipients.values())
+        # aiosmtplib's refusals, SMTPSenderRefused, SMTPDataError and SMTPRecipientRefused included, carry `code`
+        if isinstance(error, AsyncSMTPResponseException):
+            return error.code < 500
+        if isinstance(error, AsyncSMTPRecipientsRefused):
+            # A list of SMTPRecipientRefused errors instead of smtplib's mapping
+            return any(recipient.code < 500 for recipient in error.recipients)
+        # Connection failures and other errors that are not a refusal of the message itself
+        return True
+
+    def _get_delay(self, item: SpoolItem, error: BaseException) -> float:
+        delay = min(self._max_backoff, self._backoff * 2 ** (item.attempts - 1))
+        return max(delay, getattr(error, 'retry_after', None) or 0)
+
+    def _settle(self, items: list[SpoolItem], results: list[Any]) -> int:
+        """
+        Acknowledges delivered messages, and retries or dead-letters failed ones. Returns how many were delivered.
+        """
+        delivered = []
+        for item, result in zip(items, results):
+            if not isinstance(result, BaseException):
+                delivered.append(item.id)
+                continue
+            error = f'{type(result).__name__}: {result}'
+            if self._is_transient(error=result):
+                delay = self._get_delay(item=item, error=result)
+                if self._spool.retry(item=item, error=error, delay=delay):
+                    self._logger.warning('Spool message=%s attempt=%s retry in %.1fs: %s', item.id, item.attempts,
+                                         delay, error)
+                else:
+                    self._logger.error('Spool message=%s dead-lettered after %s attempts: %s', item.id,
+                                       item.attempts, error)
+            else:
+                self._logger.error('Spool message=%s dead-lettered: %s', item.id, error)
+                self._spool.dead_letter(item=item, error=error)
+        self._spool.ack(ids=delivered)
+        return len(delivered)
+
+
+class SpoolWorker(SpoolWorkerBase):
+    def __init__(self, spool: Spool, client: Any, batch_size: int = 100, poll_interval: float = 1,
+                 backoff: float = 5, max_backoff: float = 600, level: logging = logging.INFO):
+        """
+        Background thread that delivers spooled messages through a synchronous `PostalPyAPI`
+        (as multiplexed batches) or `PostalPySMTP` (pipelined on one session), `batch_size` at a time.
+        Failures the server may recover from are retried with exponential backoff, refusals are dead-lettered.
+        Several workers, in one or many processes, can drain the same spool.
+        """
+        from .api.wrapper import PostalPyAPI
+        super().__init__(spool=spool, kind='api' if isinstance(client, PostalPyAPI) else 'smtp',
+                         batch_size=batch_size, poll_interval=poll_interval, backoff=backoff,
+                         max_backoff=max_backoff, level=level)
+        self._client = client
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _deliver(self, messages: list[RequestMessageSchema | SMTPMessageSchema]) -> list[Any]:
+        if self._kind == 'api':
+            return self._client.send_messages_batch(messages, batch_size=len(messages))
+        try:
+            # Messages done before a failure of the session keep their own result
+            return self._client.send_messages(messages)
+        except Exception as e:
+            # Raised before any message was done, so none of them was delivered
+            return [e] * len(messages)
+
+    def run_once(self) -> int:
+        """
+        Delivers one batch and returns how many messages were leased.
+        """
+        items = self._spool.lease(kind=self._kind, limit=self._batch_size)
+        if items:
+            self._settle(items=items, results=self._deliver(messages=[item.load() for item in items]))
+        return len(items)
+
+    def drain(self):
+        while self.run_once():
+            pass
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                leased = self.run_once()
+            except Exception:
+                self._logger.exception('Spool worker failed to deliver a batch')
+                leased = 0
+            if not leased:
+                self._stopping.wait(self._poll_interval)
+
+    def start(self) -> 'SpoolWorker':
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='PostalPySpoolWorker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None):
+        """
+        Stops after the batch in progress. Messages of an interrupted batch are delivered again once their lease expires.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class AsyncSpoolWorker(SpoolWorkerBase):
+    def __init__(self, spool: Spool, client: Any, batch_size: int = 100, concurrency: int = 10,
+                 poll_interval: float = 1, backoff: float = 5, max_backoff: float = 600,
+                 level: logging = logging.INFO):
+        """
+        Asyncio task that delivers spooled messages through an asynchronous `PostalPyAPI`
+        (up to `concurrency` requests at once) or `PostalPySMTP`. Spool access runs in the default executor.
+        """
+        from .api.async_wrapper import PostalPyAPI
+        super().__init__(spool=spool, kind='api' if isinstance(client, PostalPyAPI) else 'smtp',
+                         batch_size=batch_size, poll_interval=poll_interval, backoff=backoff,
+                         max_backoff=max_backoff, level=level)
+        self._client = client
+        self._concurrency = concurrency
+        self._task = None
+
+    async def _deliver(self, messages: list[RequestMessageSchema | SMTPMessageSchema]) -> list[Any]:
+        if self._kind == 'api':
+            results = [None] * len(messages)
+            async for index, result in self._client.send_messages(messages, concurrency=self._concurrency,
+                                                                  ordered=False):
+                results[index] = result
+            return results
+        try:
+            # Messages done before a failure of the session keep their own result
+            return await self._client.send_messages(messages)
+        except Exception as e:
+            # Raised before any message was done, so none of them was delivered
+            return [e] * len(messages)
+
+    async def run_once(self) -> int:
+        items = await asyncio.to_thread(self._spool.lease, kind=self._kind, limit=self._batch_size)
+        if items:
+            results = await self._deliver(messages=[item.load() for item in items])
+            await asyncio.to_thread(self._settle, items=items, results=results)
+        return len(items)
+
+    async def drain(self):
+        while await self.run_once():
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                leased = await self.run_once()
+            except Exception:
+                self._logger.exception('Spool worker failed to deliver a batch')
+                leased = 0
+            if not leased:
+                await asyncio.sleep(self._poll_interval)
+
+    def start(self) -> 'AsyncSpoolWorker':
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def stop(self):
+        """
+        Cancels the worker. Messages of an interrupted batch are delivered again once their lease expires.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,366 @@
+import asyncio
+import base64
+import inspect
+import logging
+import time
+from collections.abc import (Awaitable,
+                             Callable)
+from enum import Enum
+from functools import cache
+from typing import (Annotated,
+                    Any,
+                    Literal)
+
+from pydantic import (Field,
+                      TypeAdapter,
+                      ValidationError)
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.serialization import (load_der_public_key,
+                                                              load_pem_public_key)
+except ImportError:
+    InvalidSignature = hashes = padding = load_der_public_key = load_pem_public_key = None
+
+from .api.schemas import (BaseModel,
+                          ResponseClickSchema,
+                          ResponseLoadSchema,
+                          ResponseStructureDataSchema)
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+                411: 'Length Required', 413: 'Content Too Large', 500: 'Internal Server Error',
+                503: 'Service Unavailable'}
+
+
+class PostalPyWebhookError(Exception):
+    """Base exception class for webhook requests that cannot be accepted."""
+
+    status_code = 400
+
+
+class PostalPyWebhookSignatureError(PostalPyWebhookError):
+    """The webhook request is not signed with the Postal server's signing key."""
+
+    status_code = 401
+
+
+class PostalPyWebhookOverloadedError(PostalPyWebhookError):
+    """Too many webhook events are waiting to be handled."""
+
+    status_code = 503
+
+
+class WebhookEvent(str, Enum):
+    MESSAGE_SENT = 'MessageSent'
+    MESSAGE_DELAYED = 'MessageDelayed'
+    MESSAGE_DELIVERY_FAILED = 'MessageDeliveryFailed'
+    MESSAGE_HELD = 'MessageHeld'
+    MESSAGE_BOUNCED = 'MessageBounced'
+    MESSAGE_LINK_CLICKED = 'MessageLinkClicked'
+    MESSAGE_LOADED = 'MessageLoaded'
+
+
+class WebhookMessageSchema(BaseModel):
+    id: int
+    token: str
+    direction: str | None = None
+    message_id: str | None = None
+    to: str | None = None
+    from_: str | None = Field(None, alias='from')
+    subject: str | None = None
+    timestamp: float | None = None
+    spam_status: str | None = None
+    tag: str | None = None
+
+
+class WebhookDeliverySchema(ResponseStructureDataSchema):
+    # A delivery as returned by `get_message_deliveries`, without the ids Postal leaves out of webhooks
+    id: int | None = None
+    log_id: str | None = None
+    time: float | None = None
+    message: WebhookMessageSchema
+
+
+class WebhookBounceSchema(BaseModel):
+    original_message: WebhookMessageSchema
+    bounce: WebhookMessageSchema
+
+
+class WebhookLoadSchema(ResponseLoadSchema):
+    # The time of the load is the event's timestamp
+    timestamp: str | None = None
+    message: WebhookMessageSchema
+
+
+class WebhookClickSchema(ResponseClickSchema):
+    timestamp: str | None = None
+    token: str | None = None
+    message: WebhookMessageSchema
+
+
+class WebhookEventSchema(BaseModel):
+    event: str
+    timestamp: float
+    uuid: str | None = None
+    payload: dict[str, Any]
+
+
+class MessageDeliveryEventSchema(WebhookEventSchema):
+    event: Literal[WebhookEvent.MESSAGE_SENT, WebhookEvent.MESSAGE_DELAYED, WebhookEvent.MESSAGE_DELIVERY_FAILED,
+                   WebhookEvent.MESSAGE_HELD]
+    payload: WebhookDeliverySchema
+
+
+class MessageBouncedEventSchema(WebhookEventSchema):
+    event: Literal[WebhookEvent.MESSAGE_BOUNCED]
+    payload: WebhookBounceSchema
+
+
+class MessageLinkClickedEventSchema(WebhookEventSchema):
+    event: Literal[WebhookEvent.MESSAGE_LINK_CLICKED]
+    payload: WebhookClickSchema
+
+
+class MessageLoadedEventSchema(WebhookEventSchema):
+    event: Literal[WebhookEvent.MESSAGE_LOADED]
+    payload: WebhookLoadSchema
+
+
+@cache
+def get_event_adapter() -> TypeAdapter:
+    # Dispatches on `event` in one pass over the JSON, other events fall back to `WebhookEventSchema`.
+    # Built on first use, like the schemas themselves
+    return TypeAdapter(Annotated[
+        MessageDeliveryEventSchema | MessageBouncedEventSchema | MessageLinkClickedEventSchema |
+        MessageLoadedEventSchema,
+        Field(discriminator='event')
+    ])
+
+
+WebhookHandler = Callable[[list[WebhookEventSchema]], Awaitable[None] | None]
+
+
+class WebhookVerifier:
+    def __init__(self, public_key: str | bytes):
+        """
+        Verifies the RSA signatures Postal adds to webhook requests.
+        `public_key` is the server's signing key, as published in its DNS record (base64 DER) or PEM-encoded.
+        Requires `cryptography`. Install with `pip install postal_py[webhooks]`.
+        """
+        if load_der_public_key is None:
+            raise ImportError(
+                'Webhook signature verification is not available. To enable it, install extra dependencies with:\n'
+                '    pip install postal_py[webhooks]'
+            )
+        if isinstance(public_key, str):
+            public_key = public_key.encode()
+        public_key = public_key.strip()
+        if public_key.startswith(b'-----BEGIN'):
+            self._key = load_pem_public_key(public_key)
+        else:
+            self._key = load_der_public_key(base64.b64decode(public_key.removeprefix(b'p=')))
+
+    def verify(self, body: bytes, signature: str | None = None, signature_256: str | None = None):
+        """
+        Checks the `X-Postal-Signature-256` header, or `X-Postal-Signature` from Postal versions that only send that.
+        """
+        if signature_256:
+            signature, algorithm = signature_256, hashes.SHA256()
+        elif signature:
+            algorithm = hashes.SHA1()
+        else:
+            raise PostalPyWebhookSignatureError('The webhook request is not signed')
+        try:
+            self._key.verify(base64.b64decode(signature), body, padding.PKCS1v15(), algorithm)
+        except (InvalidSignature, ValueError) as e:
+            raise PostalPyWebhookSignatureError('The webhook signature is not valid') from e
+
+
+class WebhookReceiver:
+    def __init__(self, handler: WebhookHandler, public_key: str | bytes | None = None, path: str | None = None,
+                 batch_size: int = 500, max_delay: float = 0.05, max_pending: int = 10000,
+                 max_body_size: int = 1024 ** 2, level: logging = logging.INFO):
+        """
+        Asyncio HTTP endpoint for Postal webhooks.
+        Events are verified against `public_key` when given, parsed into typed schemas and passed to `handler`
+        in batches of up to `batch_size`, collected for at most `max_delay` seconds.
+        A request is answered once the batch holding its event is handled, so events the handler fails on
+        (HTTP 500), or that find `max_pending` events already waiting (HTTP 503), are sent again by Postal.
+        """
+        self._handler = handler
+        self._verifier = WebhookVerifier(public_key=public_key) if public_key is not None else None
+        self._path = path
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._max_pending = max_pending
+        self._max_body_size = max_body_size
+        self._pending: list[tuple[WebhookEventSchema, asyncio.Future]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._batcher: asyncio.Task | None = None
+        self._closing = False
+        self._server: asyncio.Server | None = None
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._logger = logging.getLogger('PostalPyWebhooks')
+        self._logger.setLevel(level)
+
+    def parse(self, body: bytes, signature: str | None = None, signature_256: str | None = None
+              ) -> WebhookEventSchema:
+        """
+        Verifies and parses one webhook request body, for receiving webhooks through another web framework.
+        """
+        if self._verifier is not None:
+            self._verifier.verify(body=body, signature=signature, signature_256=signature_256)
+        try:
+            return get_event_adapter().validate_json(body)
+        except ValidationError:
+            try:
+                return WebhookEventSchema.model_validate_json(body)
+            except ValidationError as e:
+                raise PostalPyWebhookError(f'The webhook payload is not valid: {e.error_count()} errors') from e
+
+    async def submit(self, event: WebhookEventSchema):
+        """
+        Queues the event for the next batch and waits until the handler has processed it.
+        """
+        if len(self._pending) >= self._max_pending:
+            raise PostalPyWebhookOverloadedError(f'{len(self._pending)} webhook events are waiting to be handled')
+        if self._batcher is None:
+            self._wakeup = asyncio.Event()
+            self._batcher = asyncio.ensure_future(self._run_batches())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((event, future))
+        if len(self._pending) == 1 or len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+        await future
+
+    async def _run_batches(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                if self._closing:
+                    return
+                continue
+            if len(self._pending) < self._batch_size and not self._closing:
+                # More events usually arrive while the first one waits, the wakeup cuts the wait short
+                # once a full batch is pending
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            batch, self._pending = self._pending[:self._batch_size], self._pending[self._batch_size:]
+            if self._pending or self._closing:
+                self._wakeup.set()
+            await self._handle_batch(batch=batch)
+
+    async def _handle_batch(self, batch: list[tuple[WebhookEventSchema, asyncio.Future]]):
+        started = time.perf_counter()
+        try:
+            result = self._handler([event for event, _ in batch])
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            self._logger.exception('Webhook handler failed on a batch of %s events', len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._logger.debug('Handled %s webhook events in %.3fs', len(batch), time.perf_counter() - started)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def _receive(self, method: str, path: str, headers: dict[str, str], body: bytes) -> int:
+        if self._path is not None and path.split('?', 1)[0] != self._path:
+            return 404
+        if method != 'POST':
+            return 405
+        try:
+            event = self.parse(body=body, signature=headers.get('x-postal-signature'),
+                               signature_256=headers.get('x-postal-signature-256'))
+            await self.submit(event=event)
+        except PostalPyWebhookError as e:
+            self._logger.warning('Webhook rejected: %s', e)
+            return e.status_code
+        except Exception:
+            return 500
+        return 200
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, path, version = (request_line.split(' ') + ['', ''])[:3]
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, _, value = line.partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                if 'content-length' not in headers:
+                    status_code, keep_alive = 411, False
+                elif (length := int(headers['content-length'])) > self._max_body_size:
+                    status_code, keep_alive = 413, False
+                else:
+                    try:
+                        body = await reader.readexactly(length)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        return
+                    status_code = await self._receive(method=method, path=path, headers=headers, body=body)
+                writer.write(f'HTTP/1.1 {status_code} {HTTP_REASONS[status_code]}\r\nContent-Length: 0\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode())
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ValueError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            await self._serve_connection(reader=reader, writer=writer)
+        finally:
+            self._connections.pop(writer, None)
+
+    async def start(self, host: str = '0.0.0.0', port: int = 8080) -> 'WebhookReceiver':
+        self._server = await asyncio.start_server(self._on_connection, host, port)
+        self._logger.info('Receiving Postal webhooks on %s:%s', host, self.port)
+        return self
+
+    @property
+    def port(self) -> int | None:
+        return self._server.sockets[0].getsockname()[1] if self._server else None
+
+    async def serve_forever(self, host: str = '0.0.0.0', port: int = 8080):
+        await self.start(host=host, port=port)
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """
+        Stops accepting connections, handles the events already received and closes open connections.
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._batcher is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._batcher
+            self._batcher = None
+            self._closing = False
+        connections = dict(self._connections)
+        for writer in connections:
+            writer.close()
+        await asyncio.gather(*connections.values(), return_exceptions=True)
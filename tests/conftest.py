@@ -0,0 +1,266 @@
+import asyncio
+import json
+import threading
+import time
+from collections.abc import Callable
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer)
+from typing import Any
+
+import pytest
+
+
+class _SMTPServerProtocol(asyncio.Protocol):
+    def __init__(self, server: 'SMTPServer'):
+        self._server = server
+        self._transport = None
+        self._buffer = bytearray()
+        self._transaction = None
+        self._in_data = False
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._server.connections += 1
+        transport.write(b'220 test.example ESMTP\r\n')
+
+    def data_received(self, data: bytes):
+        self._buffer.extend(data)
+        while self._transport is not None and not self._transport.is_closing():
+            if self._in_data:
+                # An empty message ends with the terminator right away, without the preceding line break
+                if self._buffer.startswith(b'.\r\n'):
+                    end, consumed = 0, 3
+                elif (end := self._buffer.find(b'\r\n.\r\n')) != -1:
+                    end, consumed = end + 2, end + 5
+                else:
+                    return
+                self._transaction['data'] = bytes(self._buffer[:end])
+                del self._buffer[:consumed]
+                self._in_data = False
+                self._server.messages.append(self._transaction)
+                self._reply(self._server.data_reply)
+                continue
+            if (end := self._buffer.find(b'\r\n')) == -1:
+                return
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end + 2]
+            self._handle(line=line)
+
+    def _reply(self, reply: bytes):
+        self._transport.write(reply)
+
+    def _handle(self, line: bytes):
+        verb, _, argument = line.partition(b' ')
+        verb = verb.upper()
+        self._server.commands.append(line)
+        if self._server.close_on is not None and self._server.close_on(line):
+            self._transport.close()
+            return
+        if verb in (b'EHLO', b'HELO'):
+            lines = [b'test.example', *self._server.extensions]
+            self._reply(b''.join(b'250-' + item + b'\r\n' for item in lines[:-1]) + b'250 ' + lines[-1] + b'\r\n')
+        elif verb == b'AUTH':
+            self._reply(b'235 Authenticated\r\n')
+        elif verb == b'MAIL':
+            reply = self._server.replies.get(verb, b'250 OK\r\n')
+            if reply.startswith(b'2'):
+                self._transaction = {'mail_from': argument[5:], 'rcpt_to': [], 'data': None}
+            self._reply(reply)
+        elif verb in (b'RCPT', b'DATA') and self._transaction is None:
+            self._reply(b'503 Bad sequence of commands\r\n')
+        elif verb == b'RCPT':
+            address = argument[3:].split(b' ')[0].strip(b'<>')
+            code = self._server.rcpt_codes.get(address.decode('utf-8'), 250)
+            if code == 250:
+                self._transaction['rcpt_to'].append(address)
+            self._reply(b'%d Recipient\r\n' % code)
+        elif verb in (b'RSET', b'NOOP'):
+            self._transaction = None
+            self._reply(b'250 OK\r\n')
+        elif verb == b'DATA' and verb in self._server.replies:
+            self._reply(self._server.replies[verb])
+        elif verb == b'DATA':
+            self._in_data = True
+            self._reply(b'354 Go ahead\r\n')
+            if self._server.pause_data is not None:
+                self._transport.pause_reading()
+                asyncio.get_running_loop().call_later(self._server.pause_data, self._resume_reading)
+        elif verb == b'QUIT':
+            self._reply(b'221 Bye\r\n')
+            self._transport.close()
+        else:
+            self._reply(b'502 Not implemented\r\n')
+
+    def _resume_reading(self):
+        if self._transport is not None:
+            self._transport.resume_reading()
+
+    def connection_lost(self, exc: Exception | None):
+        self._transport = None
+
+
+class SMTPServer:
+    def __init__(self):
+        """
+        SMTP server in a thread of the test process that keeps every accepted message.
+        `close_on`, a predicate on command lines, drops the connection instead of answering the matching command.
+        `pause_data` stops reading message data for that many seconds, so the client's buffers fill up.
+        `replies` replaces the reply to MAIL or DATA, a MAIL reply other than 2xx starts no transaction
+        and a DATA reply replaces 354; `data_reply` answers the message.
+        """
+        self.extensions = [b'PIPELINING', b'8BITMIME', b'AUTH PLAIN']
+        self.rcpt_codes: dict[str, int] = {}
+        self.data_reply = b'250 Queued\r\n'
+        self.replies: dict[bytes, bytes] = {}
+        self.close_on = None
+        self.pause_data: float | None = None
+        self.connections = 0
+        self.commands: list[bytes] = []
+        self.messages: list[dict] = []
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._thread = None
+
+    def start(self) -> 'SMTPServer':
+        started = threading.Event()
+
+        async def serve():
+            self._server = await asyncio.get_running_loop().create_server(
+                lambda: _SMTPServerProtocol(server=self), '127.0.0.1', 0
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop)
+        started.wait(5)
+        return self
+
+    def stop(self):
+        async def shutdown():
+            self._server.close()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+
+@pytest.fixture
+def smtp_server() -> SMTPServer:
+    server = SMTPServer().start()
+    yield server
+    server.stop()
+
+
+class _PostalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'PostalServer'
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def _read_body(self) -> bytes:
+        if (length := self.headers.get('Content-Length')) is not None:
+            return self.rfile.read(int(length))
+        chunks = []
+        while size := int(self.rfile.readline().strip(), 16):
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        self.rfile.readline()
+        return b''.join(chunks)
+
+    def _send(self, status_code: int, body: bytes, headers: dict[str, str] | None = None):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self._read_body()
+        with self.server.lock:
+            self.server.requests.append({'path': self.path, 'headers': dict(self.headers), 'body': body,
+                                         'json': json.loads(body)})
+            delay = self.server.delays.pop(0) if self.server.delays else 0
+            status_code = self.server.statuses.pop(0) if self.server.statuses else 200
+        time.sleep(delay)
+        if status_code != 200:
+            return self._send(status_code, b'', headers=self.server.error_headers)
+        if (handler := self.server.routes.get(self.path)) is None:
+            return self._send(404, b'')
+        status, data = handler(json.loads(body))
+        response = {'status': status, 'time': 0.01, 'flags': {}, 'data': data}
+        self._send(200, json.dumps(response).encode())
+
+
+class PostalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        """
+        Postal HTTP API in a thread of the test process that keeps every request.
+        The n-th request waits `delays[n]` seconds and is answered with HTTP `statuses[n]`, 0 and 200 once
+        the lists run out. Message ids sent to `missing` are answered with MessageNotFound.
+        """
+        super().__init__(('127.0.0.1', 0), _PostalHandler)
+        self.requests: list[dict[str, Any]] = []
+        self.delays: list[float] = []
+        self.statuses: list[int] = []
+        self.error_headers: dict[str, str] = {}
+        self.missing: set[int] = set()
+        self.lock = threading.Lock()
+        self.routes: dict[str, Callable[[dict[str, Any]], tuple[str, Any]]] = {
+            '/api/v1/send/message': self._send_message,
+            '/api/v1/send/raw': self._send_message,
+            '/api/v1/messages/message': self._get_message,
+            '/api/v1/messages/deliveries': self._get_deliveries
+        }
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _send_message(self, request: dict[str, Any]) -> tuple[str, Any]:
+        recipients = [recipient for key in ('to', 'cc', 'bcc', 'rcpt_to') for recipient in request.get(key, ())]
+        with self.lock:
+            first = len(self.requests) * 1000
+        return 'success', {
+            'message_id': f'{first}@postal.example',
+            'messages': {recipient: {'id': first + index, 'token': f'token{first + index}'}
+                         for index, recipient in enumerate(recipients)}
+        }
+
+    def _get_message(self, request: dict[str, Any]) -> tuple[str, Any]:
+        if request['id'] in self.missing:
+            return 'error', {'code': 'MessageNotFound', 'message': 'No message found matching provided ID'}
+        return 'success', {
+            'id': request['id'],
+            'token': 'token',
+            'status': {'status': 'Sent', 'last_delivery_attempt': 1.0, 'held': False, 'hold_expiry': None}
+        }
+
+    def _get_deliveries(self, request: dict[str, Any]) -> tuple[str, Any]:
+        return 'success', [{'id': 1, 'status': 'Sent', 'details': 'Message accepted', 'output': '250 OK',
+                            'sent_with_ssl': False, 'log_id': 'log', 'time': 0.1, 'timestamp': 1.0}]
+
+    def start(self) -> 'PostalServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@pytest.fixture
+def postal_server() -> PostalServer:
+    server = PostalServer().start()
+    yield server
+    server.stop()
@@ -0,0 +1,23 @@
+from postal_py.api.cache import ResponseCache
+from postal_py.api.schemas import (MessageExpansion,
+                                   RequestMessageDetailsSchema)
+from postal_py.api.wrapper import PostalPyAPI
+
+
+def test_clients_of_different_servers_do_not_share_entries():
+    cache = ResponseCache()
+    clients = [PostalPyAPI(base_url='https://a.example.com', api_key='key-a', cache=cache),
+               PostalPyAPI(base_url='https://b.example.com', api_key='key-a', cache=cache),
+               PostalPyAPI(base_url='https://a.example.com', api_key='key-b', cache=cache)]
+    data = RequestMessageDetailsSchema(id=123, expansions={MessageExpansion.status})
+    details_keys = {cache.get_details_key(data=data, server=client._server) for client in clients}
+    deliveries_keys = {cache.get_deliveries_key(id=123, server=client._server) for client in clients}
+    assert len(details_keys) == len(deliveries_keys) == 3
+    result = object()
+    cache.set(key=cache.get_details_key(data=data, server=clients[0]._server), result=result, ttl=60)
+    assert cache.get(key=cache.get_details_key(data=data, server=clients[0]._server)) is result
+    assert cache.get(key=cache.get_details_key(data=data, server=clients[1]._server)) is None
+    # The API key is not kept in the keys
+    assert all('key-a' not in repr(key) for key in details_keys)
+    for client in clients:
+        client.close()
@@ -0,0 +1,31 @@
+import logging
+
+import pytest
+
+from postal_py.api.exceptions import (PostalPyMessageNotFoundError,
+                                      PostalPyUnknownError)
+from postal_py.api.schemas import RequestMessageDetailsSchema
+from postal_py.api.wrapper import PostalPyAPI
+
+
+def test_batch_keeps_a_result_per_request_when_sending_fails():
+    # Nothing listens on port 1, so every request fails to connect
+    postal = PostalPyAPI(base_url='http://127.0.0.1:1', api_key='key', level=logging.CRITICAL)
+    results = postal.get_deliveries_batch([1, 2, 3], batch_size=2)
+    assert len(results) == 3
+    assert all(isinstance(result, PostalPyUnknownError) for result in results)
+    # Single calls do not go through the multiplexed session of batches
+    assert postal._batch_session is not None
+    assert not postal._session.multiplexed
+    postal.close()
+
+
+def test_error_response_raises_with_its_payload(postal_server):
+    postal_server.missing.add(1)
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL)
+    with pytest.raises(PostalPyMessageNotFoundError) as info:
+        postal.get_message_details(RequestMessageDetailsSchema(id=1))
+    postal.close()
+    payload, = info.value.args
+    assert payload['status'] == 'error'
+    assert payload['data'] == {'code': 'MessageNotFound', 'message': 'No message found matching provided ID'}
@@ -0,0 +1,79 @@
+import base64
+import email
+import email.policy
+import logging
+import os
+
+import pytest
+
+from postal_py.api.schemas import (RequestAttachmentSchema,
+                                   RequestMessageSchema)
+from postal_py.api.wrapper import PostalPyAPI
+from postal_py.attachments import (AttachmentCache,
+                                   set_attachment_cache)
+from postal_py.smtp.schemas import (SMTPAttachmentSchema,
+                                    SMTPMessageSchema)
+from postal_py.smtp.wrapper import PostalPySMTP
+
+
+@pytest.fixture
+def cache() -> AttachmentCache:
+    cache = AttachmentCache(max_bytes=1024 ** 2, min_size=1024)
+    set_attachment_cache(cache)
+    yield cache
+    set_attachment_cache(None)
+
+
+def test_api_messages_encode_a_repeated_attachment_once(postal_server, cache: AttachmentCache):
+    data = os.urandom(10000)
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    for name in ('a.bin', 'b.bin'):
+        # A new object with the same content is found in the cache too
+        postal.send_message(RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', attachments=[
+            RequestAttachmentSchema(name=name, data=bytes(bytearray(data))),
+            RequestAttachmentSchema(name='small.txt', data=b'small')
+        ]))
+    postal.close()
+    assert [request['json']['attachments'] for request in postal_server.requests] == [
+        [{'name': name, 'data': base64.b64encode(data).decode()},
+         {'name': 'small.txt', 'data': base64.b64encode(b'small').decode()}]
+        for name in ('a.bin', 'b.bin')
+    ]
+    # Content shorter than min_size is not cached, an entry holds the raw bytes and their base64 string
+    assert cache.snapshot() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5, 'entries': 1,
+                                'bytes': len(data) + len(base64.b64encode(data))}
+
+
+def test_smtp_messages_share_the_mime_part_of_a_repeated_attachment(smtp_server, cache: AttachmentCache):
+    data = os.urandom(10000)
+    postal = PostalPySMTP(hostname='127.0.0.1', username='user', password='password', port=smtp_server.port,
+                          use_tls=False, level=logging.WARNING)
+    for name in ('a.bin', 'a.bin', 'b.bin'):
+        postal.send_message(SMTPMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello',
+                                              plain_body='Body', attachments=[
+            SMTPAttachmentSchema(name=name, content_type='application/octet-stream',
+                                 data=base64.b64encode(data).decode())
+        ]))
+    postal.close()
+    names = []
+    for message in smtp_server.messages:
+        attachment, = email.message_from_bytes(message['data'], policy=email.policy.default).iter_attachments()
+        assert attachment.get_payload(decode=True) == data
+        names.append(attachment.get_filename())
+    assert names == ['a.bin', 'a.bin', 'b.bin']
+    snapshot = cache.snapshot()
+    assert snapshot['entries'] == 1
+    # Decoding hits from the second message on, the MIME part from the second message with the same name
+    assert (snapshot['hits'], snapshot['misses']) == (3, 3)
+
+
+def test_least_recently_used_content_is_evicted():
+    cache = AttachmentCache(max_bytes=5000, min_size=10)
+    first, second = os.urandom(2000), os.urandom(2000)
+    cache.encode(first)
+    cache.encode(second)
+    assert cache.snapshot()['entries'] == 1
+    cache.encode(second)
+    assert cache.snapshot()['hits'] == 1
+    assert cache.decode(base64.b64encode(first).decode()) == first
+    assert cache.snapshot()['misses'] == 3
@@ -0,0 +1,82 @@
+import asyncio
+import base64
+import io
+import logging
+import os
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.schemas import (RequestAttachmentSchema,
+                                   RequestMessageSchema)
+from postal_py.api.wrapper import PostalPyAPI
+
+
+class UnseekableFile:
+    def __init__(self, data: bytes):
+        self._file = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seekable(self) -> bool:
+        return False
+
+
+def send(postal_server, client: str, attachments: list[RequestAttachmentSchema]):
+    message = RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello',
+                                   plain_body='Body', attachments=attachments)
+    if client == 'sync':
+        postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+        try:
+            return postal.send_message(message)
+        finally:
+            postal.close()
+
+    async def main():
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+        try:
+            return await postal.send_message(message)
+        finally:
+            await postal.close()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('client', ['sync', 'async'])
+def test_file_attachments_are_streamed_with_a_content_length(postal_server, tmp_path, client: str):
+    # Not a multiple of the read chunk size or of 3 bytes, so the last chunk is encoded with padding
+    data = os.urandom(1024 * 1024 + 1)
+    path = tmp_path / 'report.bin'
+    path.write_bytes(data)
+    with open(path, 'rb') as file:
+        # An open file is sent from its current position
+        file.seek(1000)
+        send(postal_server, client=client, attachments=[
+            RequestAttachmentSchema(name='report.bin', content_type='application/octet-stream', data=path),
+            RequestAttachmentSchema(name='part.bin', data=file),
+            RequestAttachmentSchema(name='inline.txt', data=b'"quoted"')
+        ])
+    request, = postal_server.requests
+    assert int(request['headers']['Content-Length']) == len(request['body'])
+    assert request['json'] == {
+        'to': ['user@example.com'], 'from': 'sender@example.com', 'subject': 'Hello', 'plain_body': 'Body',
+        'attachments': [
+            {'name': 'report.bin', 'content_type': 'application/octet-stream',
+             'data': base64.b64encode(data).decode()},
+            {'name': 'part.bin', 'data': base64.b64encode(data[1000:]).decode()},
+            {'name': 'inline.txt', 'data': base64.b64encode(b'"quoted"').decode()}
+        ]
+    }
+
+
+@pytest.mark.parametrize('client', ['sync', 'async'])
+def test_attachments_of_unknown_size_are_sent_chunked(postal_server, client: str):
+    data = os.urandom(300 * 1024)
+    send(postal_server, client=client, attachments=[RequestAttachmentSchema(name='a.bin', data=UnseekableFile(data)),
+                                                    RequestAttachmentSchema(name='b.bin', data=io.BytesIO(data[:10]))])
+    request, = postal_server.requests
+    assert 'Content-Length' not in request['headers']
+    assert request['headers']['Transfer-Encoding'] == 'chunked'
+    assert request['json']['attachments'] == [{'name': 'a.bin', 'data': base64.b64encode(data).decode()},
+                                              {'name': 'b.bin', 'data': base64.b64encode(data[:10]).decode()}]
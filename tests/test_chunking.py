@@ -0,0 +1,62 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.exceptions import PostalPyServiceUnavailableError
+from postal_py.api.schemas import RequestBulkMessageSchema
+from postal_py.api.streaming import SharedMessageBody
+from postal_py.api.wrapper import PostalPyAPI
+
+
+def get_message(count: int, **kwargs) -> RequestBulkMessageSchema:
+    return RequestBulkMessageSchema(to=[f'user{index}@example.com' for index in range(count)],
+                                    from_='sender@example.com', subject='News', plain_body='Body', **kwargs)
+
+
+def test_shared_body_without_recipients_is_valid_json():
+    shared = SharedMessageBody.from_message(data=get_message(count=0))
+    assert json.loads(shared.with_fields(fields={})) == {'from': 'sender@example.com', 'subject': 'News',
+                                                                 'plain_body': 'Body'}
+    assert json.loads(SharedMessageBody(shared=b'{}').with_fields(fields={})) == {}
+
+
+def test_chunked_send_splits_recipients(postal_server):
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    result = postal.send_message_chunked(get_message(count=120, cc=['cc@example.com']), concurrency=2)
+    postal.close()
+    bodies = [request['json'] for request in postal_server.requests]
+    assert [len(body['to']) for body in bodies] == [50, 50, 20]
+    # Every chunk carries the shared fields, cc only goes with the first
+    assert all(body['subject'] == 'News' and body['plain_body'] == 'Body' for body in bodies)
+    assert [body.get('cc') for body in bodies] == [['cc@example.com'], None, None]
+    assert len(result.message_ids) == 3
+    assert len(result.messages) == 121
+    assert result.failed_recipients == {}
+
+
+def test_async_chunked_send_maps_failed_recipients(postal_server):
+    # The second request fails, the retry policy is off, so its chunk is reported
+    postal_server.statuses = [200, 503]
+
+    async def main():
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL)
+        try:
+            return await postal.send_message_chunked(get_message(count=60), chunk_size=30, concurrency=1)
+        finally:
+            await postal.close()
+
+    result = asyncio.run(main())
+    assert len(result.messages) == 30
+    assert sorted(result.failed_recipients) == sorted(f'user{index}@example.com' for index in range(30, 60))
+    assert all(PostalPyServiceUnavailableError.__name__ in error for error in result.failed_recipients.values())
+
+
+def test_chunked_send_needs_recipients(postal_server):
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    with pytest.raises(ValueError, match='recipient'):
+        postal.send_message_chunked(get_message(count=0))
+    postal.close()
+    assert postal_server.requests == []
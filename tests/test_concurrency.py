@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.exceptions import PostalPyUnauthenticatedFromAddressError
+from postal_py.api.schemas import RequestMessageSchema
+
+
+class SlowRoute:
+    def __init__(self, route, delays: dict[str, float], rejected: str | None = None):
+        """
+        Answers `/api/v1/send/message` after the delay of the message's recipient, counting requests in flight.
+        """
+        self.route = route
+        self.delays = delays
+        self.rejected = rejected
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request: dict[str, Any]) -> tuple[str, Any]:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        recipient, = request['to']
+        time.sleep(self.delays[recipient])
+        with self.lock:
+            self.in_flight -= 1
+        if recipient == self.rejected:
+            return 'error', {'code': 'UnauthenticatedFromAddress', 'message': 'The From address is not authorised'}
+        return self.route(request)
+
+
+def send_messages(postal_server, count: int, **kwargs) -> list[tuple[int, Any]]:
+    async def main() -> list[tuple[int, Any]]:
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL)
+        messages = (RequestMessageSchema(to=[f'user{index}@example.com'], from_='sender@example.com', subject='Hello')
+                    for index in range(count))
+        try:
+            return [result async for result in postal.send_messages(messages, **kwargs)]
+        finally:
+            await postal.close()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_send_messages_bounds_requests_in_flight(postal_server, ordered: bool):
+    # Later messages are answered sooner, so completion order is the reverse of input order within a wave
+    route = SlowRoute(route=postal_server.routes['/api/v1/send/message'],
+                      delays={f'user{index}@example.com': 0.05 * (3 - index % 3) for index in range(9)})
+    postal_server.routes['/api/v1/send/message'] = route
+    results = send_messages(postal_server, count=9, concurrency=3, ordered=ordered)
+    assert route.max_in_flight == 3
+    indexes = [index for index, _ in results]
+    if ordered:
+        assert indexes == list(range(9))
+    else:
+        assert sorted(indexes) == list(range(9)) and indexes != list(range(9))
+    for index, result in results:
+        assert list(result.data.messages) == [f'user{index}@example.com']
+
+
+def test_send_messages_yields_errors_without_stopping(postal_server):
+    route = SlowRoute(route=postal_server.routes['/api/v1/send/message'],
+                      delays={f'user{index}@example.com': 0 for index in range(4)}, rejected='user1@example.com')
+    postal_server.routes['/api/v1/send/message'] = route
+    results = send_messages(postal_server, count=4, concurrency=2)
+    assert [index for index, _ in results] == [0, 1, 2, 3]
+    assert isinstance(results[1][1], PostalPyUnauthenticatedFromAddressError)
+    assert all(not isinstance(result, Exception) for index, result in results if index != 1)
+    assert len(postal_server.requests) == 4
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import email
+import email.policy
+import logging
+from email.message import EmailMessage
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.exceptions import PostalPyServiceUnavailableError
+from postal_py.api.wrapper import PostalPyAPI
+from postal_py.smtp.schemas import (SMTPAttachmentSchema,
+                                    SMTPMessageSchema)
+
+
+def test_fanout_sends_one_encoding_to_every_recipient_chunk(postal_server):
+    message = SMTPMessageSchema(to=['user0@example.com', 'User 1 <user1@example.com>'], cc=['cc@example.com'],
+                                bcc=['bcc@example.com'], from_='Sender <sender@example.com>', subject='Report',
+                                plain_body='See attached',
+                                attachments=[SMTPAttachmentSchema(name='report.bin', data=b'\x00' * 1000)])
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    result = postal.send_raw_message_fanout(message, chunk_size=2, concurrency=2)
+    postal.close()
+    # Chunks are sent concurrently, so the server may receive them in either order
+    bodies = sorted((request['json'] for request in postal_server.requests), key=lambda body: body['rcpt_to'])
+    assert {request['path'] for request in postal_server.requests} == {'/api/v1/send/raw'}
+    assert [body['rcpt_to'] for body in bodies] == [['cc@example.com', 'bcc@example.com'],
+                                                    ['user0@example.com', 'user1@example.com']]
+    assert {body['mail_from'] for body in bodies} == {'sender@example.com'}
+    data, = {body['data'] for body in bodies}
+    sent = email.message_from_bytes(base64.b64decode(data), policy=email.policy.default)
+    assert (sent['To'], sent['Cc'], sent['Bcc']) == ('user0@example.com, User 1 <user1@example.com>',
+                                                     'cc@example.com', None)
+    attachment, = sent.iter_attachments()
+    assert attachment.get_payload(decode=True) == b'\x00' * 1000
+    assert len(result.message_ids) == 2
+    assert sorted(result.messages) == ['bcc@example.com', 'cc@example.com', 'user0@example.com', 'user1@example.com']
+    assert result.failed_recipients == {}
+
+
+def test_async_fanout_of_an_email_message_maps_failed_recipients(postal_server):
+    postal_server.statuses = [200, 503]
+    message = EmailMessage()
+    message['From'] = 'Sender <sender@example.com>'
+    message['To'] = 'User 0 <user0@example.com>, user1@example.com'
+    message['Bcc'] = 'bcc@example.com'
+    message['Subject'] = 'Report'
+    message.set_content('Body')
+
+    async def main():
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL)
+        try:
+            return await postal.send_raw_message_fanout(message, chunk_size=2, concurrency=1, bounce=False)
+        finally:
+            await postal.close()
+
+    result = asyncio.run(main())
+    first, second = (request['json'] for request in postal_server.requests)
+    assert (first['rcpt_to'], second['rcpt_to']) == (['user0@example.com', 'user1@example.com'], ['bcc@example.com'])
+    assert first['bounce'] is False and first['data'] == second['data']
+    assert 'Bcc' not in email.message_from_bytes(base64.b64decode(first['data']))
+    # The caller's message is left as it is
+    assert message['Bcc'] == 'bcc@example.com'
+    assert sorted(result.messages) == ['user0@example.com', 'user1@example.com']
+    assert list(result.failed_recipients) == ['bcc@example.com']
+    assert PostalPyServiceUnavailableError.__name__ in result.failed_recipients['bcc@example.com']
+
+
+def test_raw_bytes_fanout(postal_server):
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    raw = b'From: sender@example.com\r\nSubject: Hello\r\n\r\nBody\r\n'
+    with pytest.raises(ValueError, match='rcpt_to'):
+        postal.send_raw_message_fanout(raw, mail_from='sender@example.com')
+    assert postal_server.requests == []
+    result = postal.send_raw_message_fanout(raw, rcpt_to=['User <user@example.com>'], mail_from='sender@example.com')
+    postal.close()
+    request, = postal_server.requests
+    assert request['json'] == {'rcpt_to': ['user@example.com'], 'mail_from': 'sender@example.com',
+                               'data': base64.b64encode(raw).decode()}
+    assert list(result.messages) == ['user@example.com']
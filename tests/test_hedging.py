@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+
+from postal_py.api.hedging import HedgingPolicy
+from postal_py.api.retry import RetryPolicy
+from postal_py.api.wrapper import PostalPyAPI
+
+URL = '/api/v1/messages/deliveries'
+
+
+def get_client(postal_server, hedging: HedgingPolicy, **kwargs) -> PostalPyAPI:
+    return PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL, hedging=hedging, **kwargs)
+
+
+def test_slow_reads_are_hedged(postal_server):
+    hedging = HedgingPolicy(min_samples=1, max_delay=0.05)
+    # Fast reads earn the hedge spent below
+    for _ in range(10):
+        hedging.record(endpoint=f'{postal_server.url}{URL}', duration=0.001)
+    postal_server.delays = [1]
+    postal = get_client(postal_server, hedging=hedging)
+    started = time.monotonic()
+    result = postal.get_message_deliveries(1)
+    assert time.monotonic() - started < 0.5
+    postal.close()
+    assert result.data[0].status == 'Sent'
+    assert len(postal_server.requests) == 2
+    assert hedging.snapshot()[f'{postal_server.url}{URL}']['hedges'] == 1
+
+
+def test_retry_delays_are_not_recorded_as_latency(postal_server):
+    postal_server.statuses = [503]
+    hedging = HedgingPolicy(min_samples=1)
+    postal = get_client(postal_server, hedging=hedging, retry_policy=RetryPolicy(backoff=0.2, jitter=False))
+    postal.get_message_deliveries(1)
+    postal.close()
+    assert len(postal_server.requests) == 2
+    assert hedging.get_percentile(q=100, endpoint=f'{postal_server.url}{URL}') < 0.1
+
+
+def test_reads_are_not_queued_behind_busy_hedging_threads(postal_server):
+    hedging = HedgingPolicy(min_samples=1, max_workers=2)
+    # A single fast read makes reads eligible for hedging, without earning a hedge
+    hedging.record(endpoint=f'{postal_server.url}{URL}', duration=0.001)
+    postal_server.delays = [1, 1]
+    postal = get_client(postal_server, hedging=hedging)
+    threads = [threading.Thread(target=postal.get_message_deliveries, args=(1,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while len(postal_server.requests) < 2:
+        time.sleep(0.01)
+    # Both hedging threads wait for a slow read, so this one is sent on the calling thread
+    started = time.monotonic()
+    postal.get_message_deliveries(1)
+    assert time.monotonic() - started < 0.5
+    for thread in threads:
+        thread.join()
+    postal.close()
+    assert len(postal_server.requests) == 3
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from smtplib import SMTPRecipientsRefused
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.exceptions import PostalPyServiceUnavailableError
+from postal_py.api.retry import RetryPolicy
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.wrapper import PostalPyAPI
+from postal_py.instrumentation import (LatencyHistogram,
+                                       MultiObserver,
+                                       Observer,
+                                       OpenTelemetryObserver,
+                                       RequestEvent)
+from postal_py.smtp.schemas import SMTPMessageSchema
+from postal_py.smtp.wrapper import PostalPySMTP
+
+
+class RecordingObserver(Observer):
+    def __init__(self):
+        self.events: list[RequestEvent] = []
+
+    def on_event(self, event: RequestEvent):
+        self.events.append(event)
+
+
+class FakeInstrument:
+    def __init__(self):
+        self.values = []
+
+    def record(self, value: float, attributes: dict):
+        self.values.append((value, attributes))
+
+    add = record
+
+
+class FakeMeter:
+    def __init__(self):
+        self.instruments = {}
+
+    def create_histogram(self, name: str, **kwargs) -> FakeInstrument:
+        return self.instruments.setdefault(name, FakeInstrument())
+
+    create_counter = create_histogram
+
+
+def get_message() -> RequestMessageSchema:
+    return RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello')
+
+
+def get_smtp_message(to: str) -> SMTPMessageSchema:
+    return SMTPMessageSchema(to=[to], from_='sender@example.com', subject='Hello', plain_body='Body')
+
+
+@pytest.mark.parametrize('client', ['sync', 'async'])
+def test_api_events_per_attempt(postal_server, client: str):
+    postal_server.statuses = [503]
+    observer = RecordingObserver()
+    kwargs = dict(base_url=postal_server.url, api_key='key', level=logging.CRITICAL, observer=observer,
+                  retry_policy=RetryPolicy(backoff=0.01))
+    if client == 'sync':
+        postal = PostalPyAPI(**kwargs)
+        postal.send_message(get_message())
+        postal.close()
+    else:
+        async def main():
+            postal = AsyncPostalPyAPI(**kwargs)
+            await postal.send_message(get_message())
+            await postal.close()
+
+        asyncio.run(main())
+    failed, sent = observer.events
+    assert (failed.client, failed.operation, failed.status_code, failed.attempt) == (
+        'api', '/api/v1/send/message', 503, 0
+    )
+    assert isinstance(failed.error, PostalPyServiceUnavailableError)
+    assert failed.error_type == 'PostalPyServiceUnavailableError'
+    assert (sent.status_code, sent.error, sent.attempt) == (200, None, 1)
+    assert sent.request_bytes == len(postal_server.requests[1]['body'])
+    assert sent.response_bytes > 0
+    assert {'parse', 'wait'} <= set(sent.timings)
+    assert 0 < sent.duration and sent.started_at >= failed.started_at
+
+
+def test_smtp_events_for_connections_and_messages(smtp_server):
+    smtp_server.rcpt_codes = {'refused@example.com': 550}
+    observer = RecordingObserver()
+    postal = PostalPySMTP(hostname='127.0.0.1', username='user', password='password', port=smtp_server.port,
+                          use_tls=False, level=logging.CRITICAL, observer=observer)
+    postal.send_message(get_smtp_message(to='user@example.com'))
+    with pytest.raises(SMTPRecipientsRefused):
+        postal.send_message(get_smtp_message(to='refused@example.com'))
+    postal.close()
+    connect, sent, refused = observer.events
+    assert (connect.client, connect.operation, connect.error) == ('smtp', 'connect', None)
+    assert {'connect', 'auth'} <= set(connect.timings)
+    assert (sent.operation, sent.status_code, sent.error) == ('send_message', 250, None)
+    assert sent.request_bytes >= len(smtp_server.messages[0]['data'])
+    assert (refused.operation, refused.error_type) == ('send_message', 'SMTPRecipientsRefused')
+
+
+def test_histogram_and_opentelemetry_observers(postal_server):
+    postal_server.statuses = [503]
+    histogram = LatencyHistogram(buckets=(1, 10))
+    meter = FakeMeter()
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         observer=MultiObserver(histogram, OpenTelemetryObserver(meter=meter)))
+    with pytest.raises(PostalPyServiceUnavailableError):
+        postal.send_message(get_message())
+    postal.send_message(get_message())
+    postal.close()
+    stats = histogram.snapshot()[('api', '/api/v1/send/message')]
+    assert (stats['count'], stats['errors']) == (2, 1)
+    assert 0 < stats['p50'] <= stats['p99'] <= 1
+    durations = meter.instruments['postal_py.client.duration'].values
+    assert [attributes for _, attributes in durations] == [
+        {'postal_py.client': 'api', 'postal_py.operation': '/api/v1/send/message', 'postal_py.status_code': 503,
+         'error.type': 'PostalPyServiceUnavailableError'},
+        {'postal_py.client': 'api', 'postal_py.operation': '/api/v1/send/message', 'postal_py.status_code': 200}
+    ]
+    sent_bytes = sum(value for value, _ in meter.instruments['postal_py.client.request.size'].values)
+    assert sent_bytes == sum(len(request['body']) for request in postal_server.requests)
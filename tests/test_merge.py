@@ -0,0 +1,55 @@
+import json
+import logging
+
+import pytest
+
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.wrapper import PostalPyAPI
+from postal_py.merge import (MailMerge,
+                             MergeTemplate)
+from postal_py.smtp.schemas import SMTPMessageSchema
+
+
+@pytest.mark.parametrize('template, rendered', [
+    ('Hello $name', 'Hello Ann'),
+    ('Only $5 today, ${name}', 'Only $5 today, Ann'),
+    ('$$name costs $', '$name costs $'),
+    ('<script>$(function () {})</script>', '<script>$(function () {})</script>')
+])
+def test_render(template: str, rendered: str):
+    assert MergeTemplate(template).render({'name': 'Ann'}) == rendered
+
+
+def test_literal_dollar_in_an_untemplated_field():
+    merge = MailMerge(SMTPMessageSchema(to=['$name <user@example.com>'], from_='sender@example.com',
+                                        subject='Hello $name', html_body='<p>Only $5 today</p>'))
+    assert merge.identifiers == {'name'}
+    message = merge.render({'name': 'Ann'})
+    assert message.subject == 'Hello Ann'
+    assert message.html_body == '<p>Only $5 today</p>'
+
+
+def test_prepared_messages_match_rendered_ones(postal_server):
+    template = RequestMessageSchema(to=['$email'], from_='Sender <sender@example.com>', subject='Hello $name',
+                                    html_body='<p>Dear ${name}, only $5 today</p>', headers={'X-Order': '$order'},
+                                    tag='news', attachments=[{'name': 'terms.pdf', 'data': b'%PDF' * 1000}])
+    merge = MailMerge(template)
+    recipients = [{'email': f'user{index}@example.com', 'name': f'Ann {index}', 'order': index} for index in range(3)]
+    prepared = list(merge.iter_prepared(recipients))
+    for message, variables in zip(prepared, recipients):
+        rendered = merge.render(variables)
+        assert json.loads(message.body) == rendered.model_dump(exclude_none=True, by_alias=True)
+        assert message.json == {'to': [variables['email']], 'from': 'Sender <sender@example.com>',
+                                'subject': f'Hello {variables["name"]}', 'tag': 'news'}
+
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING)
+    results = postal.send_messages_batch(prepared)
+    postal.close()
+    assert all(not isinstance(result, Exception) for result in results)
+    assert [request['json']['to'] for request in postal_server.requests] == [[item['email']] for item in recipients]
+
+
+def test_prepared_messages_need_an_api_template():
+    merge = MailMerge(SMTPMessageSchema(to=['$email'], from_='sender@example.com', subject='Hello'))
+    with pytest.raises(TypeError):
+        merge.render_prepared({'email': 'user@example.com'})
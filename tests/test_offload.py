@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.offload import MessageOffload
+
+
+def get_message(body: str) -> RequestMessageSchema:
+    return RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello', plain_body=body)
+
+
+def test_only_messages_from_min_size_are_offloaded(postal_server):
+    offload = MessageOffload(mode='thread', min_size=1000)
+
+    async def main():
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.WARNING, offload=offload)
+        try:
+            for body in ('x' * 999, 'x' * 1000):
+                await postal.send_message(get_message(body=body))
+        finally:
+            await postal.close()
+
+    asyncio.run(main())
+    offload.shutdown()
+    assert offload.snapshot() == {'mode': 'thread', 'offloaded': 1, 'inline': 1}
+    # Both paths send the same request
+    assert [request['json'] for request in postal_server.requests] == [
+        {'to': ['user@example.com'], 'from': 'sender@example.com', 'subject': 'Hello', 'plain_body': 'x' * size}
+        for size in (999, 1000)
+    ]
@@ -0,0 +1,32 @@
+import asyncio
+import sqlite3
+import threading
+
+from postal_py.ratelimit import (RateLimiter,
+                                 SQLiteRateLimitBackend)
+
+
+def test_acquire_async_does_not_block_the_loop_on_a_locked_backend(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    limiter = RateLimiter(messages_per_second=100, backend=SQLiteRateLimitBackend(path=path))
+    # Another process holding the write lock
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    threading.Timer(0.3, lambda: other.execute('COMMIT')).start()
+
+    async def main() -> int:
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        await limiter.acquire_async()
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 10
+    other.close()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from postal_py.api.async_wrapper import PostalPyAPI as AsyncPostalPyAPI
+from postal_py.api.exceptions import (PostalPyCircuitOpenError,
+                                      PostalPyInternalServerError,
+                                      PostalPyServiceUnavailableError)
+from postal_py.api.retry import (CircuitBreaker,
+                                 RetryPolicy)
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.wrapper import PostalPyAPI
+
+
+def get_message() -> RequestMessageSchema:
+    return RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello')
+
+
+def test_transient_errors_are_retried(postal_server):
+    postal_server.statuses = [503, 503]
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         retry_policy=RetryPolicy(backoff=0.01))
+    result = postal.send_message(get_message())
+    postal.close()
+    assert list(result.data.messages) == ['user@example.com']
+    assert len(postal_server.requests) == 3
+
+
+def test_async_client_raises_once_retries_run_out(postal_server):
+    postal_server.statuses = [503] * 3
+
+    async def main():
+        postal = AsyncPostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                                  retry_policy=RetryPolicy(retries={PostalPyServiceUnavailableError: 2}, backoff=0.01))
+        try:
+            await postal.send_message(get_message())
+        finally:
+            await postal.close()
+
+    with pytest.raises(PostalPyServiceUnavailableError):
+        asyncio.run(main())
+    assert len(postal_server.requests) == 3
+
+
+def test_internal_server_errors_are_not_retried_by_default(postal_server):
+    postal_server.statuses = [500]
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         retry_policy=RetryPolicy(backoff=0.01))
+    with pytest.raises(PostalPyInternalServerError):
+        postal.send_message(get_message())
+    postal.close()
+    assert len(postal_server.requests) == 1
+
+
+@pytest.mark.parametrize('retry_after, retried', [('1', True), ('60', False)])
+def test_retry_after_raises_the_delay_up_to_max_backoff(postal_server, retry_after: str, retried: bool):
+    postal_server.statuses = [503]
+    postal_server.error_headers = {'Retry-After': retry_after}
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         retry_policy=RetryPolicy(backoff=0.01, max_backoff=30, jitter=False))
+    started = time.monotonic()
+    if retried:
+        postal.send_message(get_message())
+        assert time.monotonic() - started >= 1
+    else:
+        with pytest.raises(PostalPyServiceUnavailableError):
+            postal.send_message(get_message())
+    postal.close()
+    assert len(postal_server.requests) == 1 + retried
+
+
+def test_circuit_opens_after_consecutive_failures_and_closes_after_a_probe(postal_server):
+    postal_server.statuses = [500, 503]
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.2)
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         circuit_breaker=breaker)
+    for error in (PostalPyInternalServerError, PostalPyServiceUnavailableError):
+        with pytest.raises(error):
+            postal.send_message(get_message())
+    assert breaker.is_open
+    # Rejected without a request while open
+    with pytest.raises(PostalPyCircuitOpenError):
+        postal.send_message(get_message())
+    assert len(postal_server.requests) == 2
+    time.sleep(0.2)
+    postal.send_message(get_message())
+    assert not breaker.is_open
+    assert len(postal_server.requests) == 3
+    postal.close()
+
+
+def test_failed_probe_opens_the_circuit_again(postal_server):
+    postal_server.statuses = [503, 503]
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.2)
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL,
+                         circuit_breaker=breaker)
+    with pytest.raises(PostalPyServiceUnavailableError):
+        postal.send_message(get_message())
+    time.sleep(0.2)
+    with pytest.raises(PostalPyServiceUnavailableError):
+        postal.send_message(get_message())
+    with pytest.raises(PostalPyCircuitOpenError):
+        postal.send_message(get_message())
+    assert len(postal_server.requests) == 2
+    postal.close()
@@ -0,0 +1,123 @@
+import logging
+
+import pytest
+
+from postal_py.api.exceptions import (PostalPyAPIError,
+                                      PostalPyBadGatewayError,
+                                      PostalPyGatewayTimeoutError,
+                                      PostalPyInternalServerError,
+                                      PostalPyServiceUnavailableError)
+from postal_py.api.router import (Endpoint,
+                                  EndpointPool,
+                                  PostalPyAPIRouter)
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.wrapper import PostalPyAPI
+
+
+class FakeClient:
+    def __init__(self, name: str, error: BaseException | None = None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def get_message_deliveries(self, id: int) -> str:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    def send_message(self, data) -> str:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    def get_deliveries_batch(self, ids: list[int], batch_size: int) -> list[str]:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return [self.name] * len(ids)
+
+    def close(self):
+        pass
+
+
+def get_router(endpoints: list[Endpoint], errors: dict[str, BaseException] | None = None) -> PostalPyAPIRouter:
+    router = PostalPyAPIRouter(endpoints=endpoints, level=logging.WARNING)
+    router._clients = {endpoint.name: FakeClient(name=endpoint.name, error=(errors or {}).get(endpoint.name))
+                       for endpoint in endpoints}
+    return router
+
+
+def test_unknown_endpoint():
+    pool = EndpointPool(endpoints=[Endpoint(base_url='https://a.example', api_key='a')])
+    with pytest.raises(ValueError, match="'b'"):
+        pool.acquire(name='b')
+
+
+def test_reads_need_an_endpoint_with_several_mail_servers():
+    router = get_router(endpoints=[Endpoint(base_url='https://a.example', api_key='a', name='a'),
+                                   Endpoint(base_url='https://b.example', api_key='b', name='b')])
+    with pytest.raises(ValueError):
+        router.get_message_deliveries(1)
+    assert router.get_message_deliveries(1, endpoint='b') == 'b'
+    router.close()
+
+
+def test_reads_fail_over_only_within_the_mail_server():
+    router = get_router(endpoints=[Endpoint(base_url='https://a.example', api_key='a', name='a'),
+                                   Endpoint(base_url='https://a2.example', api_key='a', name='a2'),
+                                   Endpoint(base_url='https://b.example', api_key='b', name='b')],
+                        errors={'a': PostalPyServiceUnavailableError(), 'a2': PostalPyServiceUnavailableError()})
+    with pytest.raises(PostalPyServiceUnavailableError):
+        router.get_message_deliveries(1, endpoint='a')
+    assert router._clients['a'].calls == router._clients['a2'].calls == 1
+    assert router._clients['b'].calls == 0
+    router.close()
+
+
+def test_batch_failure_leaves_nothing_in_flight():
+    router = get_router(endpoints=[Endpoint(base_url='https://a.example', api_key='a', name='a'),
+                                   Endpoint(base_url='https://a2.example', api_key='a', name='a2')],
+                        errors={'a': RuntimeError()})
+    with pytest.raises(RuntimeError):
+        router.get_deliveries_batch(range(10))
+    assert [state['in_flight'] for state in router.get_health().values()] == [0, 0]
+    router.close()
+
+
+@pytest.mark.parametrize('error, failover', [
+    (PostalPyInternalServerError(), False),
+    (PostalPyBadGatewayError(), True),
+    (PostalPyServiceUnavailableError(), True),
+    (PostalPyGatewayTimeoutError(), True)
+])
+def test_sends_fail_over_only_when_the_endpoint_is_down(error: PostalPyAPIError, failover: bool):
+    router = get_router(endpoints=[Endpoint(base_url='https://a.example', api_key='a', name='a'),
+                                   Endpoint(base_url='https://b.example', api_key='b', name='b')],
+                        errors={'a': error})
+    message = RequestMessageSchema(to=['user@example.com'], from_='sender@example.com', subject='Hello')
+    if failover:
+        assert router.send_message(message) == 'b'
+    else:
+        with pytest.raises(type(error)):
+            router.send_message(message)
+    assert router._clients['b'].calls == failover
+    router.close()
+
+
+def test_reads_fail_over_after_an_internal_server_error():
+    router = get_router(endpoints=[Endpoint(base_url='https://a.example', api_key='a', name='a'),
+                                   Endpoint(base_url='https://a2.example', api_key='a', name='a2')],
+                        errors={'a': PostalPyInternalServerError()})
+    assert router.get_message_deliveries(1, endpoint='a') == 'a2'
+    router.close()
+
+
+@pytest.mark.parametrize('status_code, error', [(502, PostalPyBadGatewayError), (504, PostalPyGatewayTimeoutError)])
+def test_gateway_errors(postal_server, status_code: int, error: type[PostalPyAPIError]):
+    postal_server.statuses = [status_code]
+    postal = PostalPyAPI(base_url=postal_server.url, api_key='key', level=logging.CRITICAL)
+    with pytest.raises(error):
+        postal.get_message_deliveries(1)
+    postal.close()
@@ -0,0 +1,365 @@
+import asyncio
+import email
+import logging
+import os
+import smtplib
+import time
+from collections.abc import Callable
+from unittest.mock import ANY
+
+import aiosmtplib
+import pytest
+
+from postal_py.smtp.async_wrapper import PostalPySMTP as AsyncPostalPySMTP
+from postal_py.smtp.schemas import SMTPMessageSchema
+from postal_py.smtp.wrapper import PostalPySMTP
+
+
+def get_client(server, client: type = PostalPySMTP, **kwargs):
+    return client(hostname='127.0.0.1', username='user', password='password', port=server.port, use_tls=False,
+                  level=logging.WARNING, **kwargs)
+
+
+def get_message(to: str = 'user@example.com', from_: str = 'Sender <sender@example.com>') -> SMTPMessageSchema:
+    return SMTPMessageSchema(to=[to], from_=from_, subject='Subject', plain_body='Body\n.line with a dot')
+
+
+def test_send_message(smtp_server):
+    postal = get_client(server=smtp_server)
+    assert postal.send_message(get_message()) == {}
+    postal.close()
+    message, = smtp_server.messages
+    assert message['mail_from'] == b'<sender@example.com>'
+    assert message['rcpt_to'] == [b'user@example.com']
+    assert b'\r\n..line with a dot\r\n' in message['data']
+
+
+def test_non_ascii_address_with_smtputf8(smtp_server):
+    smtp_server.extensions.append(b'SMTPUTF8')
+    postal = get_client(server=smtp_server)
+    assert postal.send_message(get_message(to='josé@exämple.com')) == {}
+    postal.close()
+    message, = smtp_server.messages
+    assert message['mail_from'] == b'<sender@example.com> SMTPUTF8 BODY=8BITMIME'
+    assert message['rcpt_to'] == ['josé@exämple.com'.encode()]
+    assert 'To: josé@exämple.com'.encode() in message['data']
+
+
+def test_non_ascii_address_without_smtputf8(smtp_server):
+    postal = get_client(server=smtp_server)
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        postal.send_message(get_message(to='josé@exämple.com'))
+    # The session stays usable
+    assert postal.send_message(get_message()) == {}
+    postal.close()
+    assert smtp_server.connections == 1
+    assert len(smtp_server.messages) == 1
+
+
+def test_non_ascii_display_name_does_not_need_smtputf8(smtp_server):
+    postal = get_client(server=smtp_server)
+    assert postal.send_message(get_message(from_='José <jose@example.com>')) == {}
+    postal.close()
+    assert smtp_server.messages[0]['mail_from'] == b'<jose@example.com>'
+
+
+def test_async_non_ascii_address(smtp_server):
+    async def main():
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP)
+        with pytest.raises(aiosmtplib.SMTPNotSupported):
+            await postal.send_message(get_message(to='josé@exämple.com'))
+        smtp_server.extensions.append(b'SMTPUTF8')
+        # Extensions are read again by a new session
+        await postal.close()
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP)
+        refused, _ = await postal.send_message(get_message(to='josé@exämple.com'))
+        await postal.close()
+        return refused
+
+    assert asyncio.run(main()) == {}
+    assert smtp_server.messages[0]['rcpt_to'] == ['josé@exämple.com'.encode()]
+
+
+@pytest.mark.parametrize('buffer, reply, rest', [
+    (b'250 OK\r\n', (250, b'OK'), b''),
+    (b'250-first\r\n250-second\r\n250 last\r\n354 Go', (250, b'first\nsecond\nlast'), b'354 Go'),
+    (b'250-first\r\n250 la', None, b'250-first\r\n250 la'),
+    (b'', None, b'')
+])
+def test_parse_reply(buffer: bytes, reply: tuple[int, bytes] | None, rest: bytes):
+    buffer = bytearray(buffer)
+    assert PostalPySMTP._parse_reply(buffer=buffer) == reply
+    assert buffer == rest
+
+
+def test_pipelined_envelope(smtp_server):
+    smtp_server.rcpt_codes['refused@example.com'] = 550
+    message = SMTPMessageSchema(to=['user@example.com', 'refused@example.com'], from_='sender@example.com',
+                                plain_body='Body')
+    postal = get_client(server=smtp_server)
+    refused = postal.send_message(message)
+    postal.close()
+    assert refused == {'refused@example.com': (550, b'Recipient')}
+    assert smtp_server.messages[0]['rcpt_to'] == [b'user@example.com']
+
+
+def test_async_pipelined_envelope(smtp_server):
+    smtp_server.rcpt_codes['refused@example.com'] = 550
+    message = SMTPMessageSchema(to=['user@example.com', 'refused@example.com'], from_='sender@example.com',
+                                plain_body='Body')
+
+    async def main():
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP)
+        result = await postal.send_message(message)
+        results = await postal.send_messages([message, get_message()])
+        await postal.close()
+        return result, results
+
+    (refused, reply), results = asyncio.run(main())
+    assert {recipient: response.code for recipient, response in refused.items()} == {'refused@example.com': 550}
+    assert reply == 'Queued'
+    assert [sorted(result) for result in results] == [['refused@example.com', 'user@example.com'],
+                                                      ['user@example.com']]
+    assert len(smtp_server.messages) == 3
+
+
+def test_async_pipelined_connection_lost(smtp_server):
+    smtp_server.close_on = lambda line: line.startswith(b'RCPT')
+
+    async def main():
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP, timeout=30)
+        try:
+            await postal.send_message(get_message())
+        finally:
+            await postal.close()
+
+    started = time.perf_counter()
+    with pytest.raises(aiosmtplib.SMTPServerDisconnected):
+        asyncio.run(main())
+    # Signalled as the connection ends, not after the timeout
+    assert time.perf_counter() - started < 5
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+def test_send_messages_keeps_results_before_a_lost_connection(smtp_server, client: type):
+    # The connection is lost once the server answered MAIL FROM, so the message in progress is not sent again
+    datas = 0
+
+    def close_on(line: bytes) -> bool:
+        nonlocal datas
+        datas += line == b'DATA'
+        return datas == 2
+
+    smtp_server.close_on = close_on
+    postal = get_client(server=smtp_server, client=client)
+    messages = [get_message(to=f'user{index}@example.com') for index in range(3)]
+    if client is PostalPySMTP:
+        results = postal.send_messages(messages)
+        postal.close()
+    else:
+        async def main() -> list:
+            try:
+                return await postal.send_messages(messages)
+            finally:
+                await postal.close()
+
+        results = asyncio.run(main())
+    assert isinstance(results[0], dict)
+    assert all(isinstance(result, (smtplib.SMTPException, aiosmtplib.SMTPException, OSError))
+               for result in results[1:])
+    assert len(smtp_server.messages) == 1
+
+
+def test_positional_arguments_keep_their_order(smtp_server):
+    postal = PostalPySMTP('127.0.0.1', 'user', 'password', smtp_server.port, False, 5, logging.WARNING)
+    assert postal.send_message(get_message()) == {}
+    postal.close()
+    postal = AsyncPostalPySMTP('127.0.0.1', 'user', 'password', smtp_server.port, False, 5, logging.WARNING)
+    assert postal._logger.level == logging.WARNING
+    assert postal._pool_size == 1
+
+
+def test_recently_used_session_is_reused_without_a_check(smtp_server):
+    postal = get_client(server=smtp_server)
+    for _ in range(3):
+        postal.send_message(get_message())
+    # An idle session is checked before it is used again
+    postal._pool._idle[0].last_used_at -= 10
+    postal.send_message(get_message())
+    postal.close()
+    assert smtp_server.connections == 1
+    assert [command.upper() for command in smtp_server.commands].count(b'RSET') == 1
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+def test_send_messages_replaces_sessions_after_max_messages(smtp_server, client: type):
+    postal = get_client(server=smtp_server, client=client, max_messages_per_connection=2)
+    messages = [get_message(to=f'user{index}@example.com') for index in range(5)]
+    if client is PostalPySMTP:
+        results = postal.send_messages(messages)
+        postal.close()
+    else:
+        async def main() -> list:
+            try:
+                return await postal.send_messages(messages)
+            finally:
+                await postal.close()
+
+        results = asyncio.run(main())
+    assert results == [{'user%d@example.com' % index: ANY} for index in range(5)]
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 3
+
+
+def test_async_streamed_attachment_waits_for_the_transport(smtp_server, tmp_path):
+    smtp_server.pause_data = 0.5
+    content = os.urandom(4 * 1024 * 1024)
+    (path := tmp_path / 'data.bin').write_bytes(content)
+    message = SMTPMessageSchema(to=['user@example.com'], from_='sender@example.com', plain_body='Body',
+                                attachments=[{'name': 'data.bin', 'data': path}])
+
+    async def main():
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP)
+        try:
+            return await postal.send_message(message)
+        finally:
+            await postal.close()
+
+    assert asyncio.run(main()) == ({}, 'Queued')
+    attachment, = email.message_from_bytes(smtp_server.messages[0]['data']).get_payload()[1:]
+    assert attachment.get_payload(decode=True) == content
+
+
+def test_async_stalled_server_times_out_writing_message_data(smtp_server):
+    # The server never reads the message, so writing it pauses until the timeout
+    smtp_server.pause_data = 60
+    message = SMTPMessageSchema(to=['user@example.com'], from_='sender@example.com', plain_body='Body',
+                                attachments=[{'name': 'data.bin', 'data': os.urandom(16 * 1024 * 1024)}])
+
+    async def main():
+        postal = get_client(server=smtp_server, client=AsyncPostalPySMTP, timeout=1)
+        try:
+            await postal.send_message(message)
+        finally:
+            await postal.close()
+
+    with pytest.raises(aiosmtplib.SMTPTimeoutError, match='writing'):
+        asyncio.run(main())
+
+
+
+def send_each(postal, messages: list[SMTPMessageSchema], prepare: Callable[[int], None] = lambda index: None) -> list:
+    """
+    Sends `messages` one at a time with `send_message` of a sync or async client, calling `prepare` with the index
+    of each message first, and closes the client. Returns the result or the error of every message.
+    """
+    if isinstance(postal, PostalPySMTP):
+        results = []
+        for index, message in enumerate(messages):
+            prepare(index)
+            try:
+                results.append(postal.send_message(message))
+            except Exception as e:
+                results.append(e)
+        postal.close()
+        return results
+
+    async def main() -> list:
+        results = []
+        try:
+            for index, message in enumerate(messages):
+                prepare(index)
+                try:
+                    results.append(await postal.send_message(message))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            await postal.close()
+        return results
+
+    return asyncio.run(main())
+
+
+def close_on_mail(*numbers: int):
+    mails = 0
+
+    def close_on(line: bytes) -> bool:
+        nonlocal mails
+        if not line.startswith(b'MAIL'):
+            return False
+        mails += 1
+        return mails in numbers
+
+    return close_on
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+def test_reused_session_closed_by_the_server_is_replaced(smtp_server, client: type):
+    smtp_server.close_on = close_on_mail(2)
+    results = send_each(postal=get_client(server=smtp_server, client=client),
+                        messages=[get_message(to=f'user{index}@example.com') for index in range(3)])
+    assert not any(isinstance(result, Exception) for result in results)
+    assert smtp_server.connections == 2
+    assert [message['rcpt_to'] for message in smtp_server.messages] == [[b'user0@example.com'],
+                                                                       [b'user1@example.com'],
+                                                                       [b'user2@example.com']]
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+@pytest.mark.parametrize('numbers, connections', [((1,), 1), ((2, 3), 2)])
+def test_lost_connection_is_retried_once_on_a_reused_session_only(smtp_server, client: type, numbers: tuple,
+                                                                  connections: int):
+    smtp_server.close_on = close_on_mail(*numbers)
+    messages = [get_message()] * (1 if numbers == (1,) else 2)
+    *_, result = send_each(postal=get_client(server=smtp_server, client=client), messages=messages)
+    assert isinstance(result, (smtplib.SMTPServerDisconnected, aiosmtplib.SMTPServerDisconnected))
+    assert smtp_server.connections == connections
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+@pytest.mark.parametrize('pipelining', [True, False])
+def test_multi_line_replies(smtp_server, client: type, pipelining: bool):
+    if not pipelining:
+        smtp_server.extensions.remove(b'PIPELINING')
+    smtp_server.replies[b'MAIL'] = b'250-Sender\r\n250 OK\r\n'
+    smtp_server.data_reply = b'250-Queued\r\n250 as 1234\r\n'
+    smtp_server.rcpt_codes['refused@example.com'] = 550
+    message = SMTPMessageSchema(to=['user@example.com', 'refused@example.com'], from_='sender@example.com',
+                                plain_body='Body')
+    result, = send_each(postal=get_client(server=smtp_server, client=client), messages=[message])
+    refused = result if client is PostalPySMTP else result[0]
+    assert {recipient: tuple(reply) for recipient, reply in refused.items()} == {
+        'refused@example.com': (550, b'Recipient' if client is PostalPySMTP else 'Recipient')
+    }
+    if client is AsyncPostalPySMTP:
+        assert result[1] == 'Queued\nas 1234'
+    assert len(smtp_server.messages) == 1
+
+
+@pytest.mark.parametrize('client', [PostalPySMTP, AsyncPostalPySMTP])
+@pytest.mark.parametrize('pipelining', [True, False])
+@pytest.mark.parametrize('replies, data_reply, errors, code', [
+    ({b'MAIL': b'550-Sender\r\n550 refused\r\n'}, b'250 Queued\r\n',
+     (smtplib.SMTPSenderRefused, aiosmtplib.SMTPSenderRefused), 550),
+    ({b'DATA': b'554 No valid recipients\r\n'}, b'250 Queued\r\n',
+     (smtplib.SMTPDataError, aiosmtplib.SMTPDataError), 554),
+    ({}, b'552-Message\r\n552 too big\r\n', (smtplib.SMTPDataError, aiosmtplib.SMTPDataError), 552)
+])
+def test_refused_transaction_keeps_the_session(smtp_server, client: type, pipelining: bool, replies: dict,
+                                               data_reply: bytes, errors: tuple, code: int):
+    if not pipelining:
+        smtp_server.extensions.remove(b'PIPELINING')
+
+    def prepare(index: int):
+        # Only the first message is refused
+        smtp_server.replies = replies if index == 0 else {}
+        smtp_server.data_reply = data_reply if index == 0 else b'250 Queued\r\n'
+
+    error, result = send_each(postal=get_client(server=smtp_server, client=client),
+                              messages=[get_message(), get_message()], prepare=prepare)
+    assert isinstance(error, errors)
+    assert getattr(error, 'smtp_code', getattr(error, 'code', None)) == code
+    assert not isinstance(result, Exception)
+    assert smtp_server.connections == 1
+    # A message refused after it was sent was still received
+    assert len(smtp_server.messages) == 1 + (code == 552)
@@ -0,0 +1,119 @@
+import smtplib
+import time
+
+import aiosmtplib
+import pytest
+
+from postal_py.api.exceptions import (PostalPyServiceUnavailableError,
+                                      PostalPyValidationError)
+from postal_py.smtp.schemas import SMTPMessageSchema
+from postal_py.spool import (Spool,
+                             SpoolWorker,
+                             SpoolWorkerBase)
+
+
+def get_message(index: int = 0) -> SMTPMessageSchema:
+    return SMTPMessageSchema(to=[f'user{index}@example.com'], from_='sender@example.com', subject='Subject',
+                             plain_body='Body')
+
+
+@pytest.fixture
+def spool(tmp_path) -> Spool:
+    spool = Spool(path=str(tmp_path / 'spool.db'), max_attempts=2)
+    yield spool
+    spool.close()
+
+
+@pytest.mark.parametrize('error, transient', [
+    (PostalPyServiceUnavailableError(), True),
+    (PostalPyValidationError(), False),
+    (smtplib.SMTPSenderRefused(451, b'Try later', 'sender@example.com'), True),
+    (smtplib.SMTPSenderRefused(550, b'No such sender', 'sender@example.com'), False),
+    (smtplib.SMTPDataError(554, b'Rejected'), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')}), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user'), 'b@example.com': (451, b'Later')}),
+     True),
+    (aiosmtplib.SMTPSenderRefused(550, 'No such sender', 'sender@example.com'), False),
+    (aiosmtplib.SMTPDataError(554, 'Rejected'), False),
+    (aiosmtplib.SMTPDataError(451, 'Try later'), True),
+    (aiosmtplib.SMTPRecipientRefused(550, 'No such user', 'a@example.com'), False),
+    (aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, 'No such user', 'a@example.com')]),
+     False),
+    (aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(450, 'Mailbox busy', 'a@example.com')]),
+     True),
+    (aiosmtplib.SMTPServerDisconnected('Connection lost'), True),
+    (smtplib.SMTPNotSupportedError('SMTPUTF8 required'), False),
+    (aiosmtplib.SMTPNotSupported('SMTPUTF8 required'), False),
+    (ConnectionResetError(), True)
+])
+def test_is_transient(error: BaseException, transient: bool):
+    assert SpoolWorkerBase._is_transient(error=error) is transient
+
+
+def get_worker(spool: Spool, client: object = None) -> SpoolWorker:
+    return SpoolWorker(spool=spool, client=client, backoff=60)
+
+
+def test_settle_acks_retries_and_dead_letters(spool: Spool):
+    spool.enqueue_many(get_message(index=index) for index in range(3))
+    items = spool.lease(kind='smtp', limit=10)
+    delivered = get_worker(spool=spool)._settle(items=items, results=[
+        {},
+        smtplib.SMTPSenderRefused(451, b'Try later', 'sender@example.com'),
+        aiosmtplib.SMTPDataError(554, 'Rejected')
+    ])
+    assert delivered == 1
+    assert spool.count() == 1
+    assert [item.id for item in spool.get_dead_letters()] == [items[2].id]
+    assert 'SMTPDataError' in spool.get_dead_letters()[0].last_error
+    # Retried after the backoff, not right away
+    assert spool.lease(kind='smtp', limit=10) == []
+
+
+def test_settle_dead_letters_after_max_attempts(spool: Spool):
+    spool.enqueue(get_message())
+    worker = get_worker(spool=spool)
+    worker._backoff = 0
+    for _ in range(2):
+        items = spool.lease(kind='smtp', limit=10)
+        worker._settle(items=items, results=[ConnectionResetError()])
+    assert spool.count() == 0
+    assert spool.count(dead=True) == 1
+
+
+def test_expired_lease_is_dead_lettered_after_max_attempts(spool: Spool):
+    spool._lease_timeout = 0
+    spool.enqueue(get_message())
+    assert len(spool.lease(kind='smtp', limit=10)) == 1
+    time.sleep(0.01)
+    assert len(spool.lease(kind='smtp', limit=10)) == 1
+    time.sleep(0.01)
+    assert spool.lease(kind='smtp', limit=10) == []
+    assert spool.get_dead_letters()[0].last_error == 'Lease expired'
+
+
+class FailingClient:
+    def __init__(self, results: list):
+        self.results = results
+
+    def send_messages(self, data: list) -> list:
+        if isinstance(self.results, BaseException):
+            raise self.results
+        return self.results
+
+
+def test_run_once_keeps_results_before_a_session_failure(spool: Spool):
+    spool.enqueue_many(get_message(index=index) for index in range(3))
+    lost = aiosmtplib.SMTPServerDisconnected('Connection lost')
+    worker = get_worker(spool=spool, client=FailingClient(results=[{}, lost, lost]))
+    assert worker.run_once() == 3
+    # The accepted message is acknowledged, only the other two are retried
+    assert spool.count() == 2
+    assert spool.count(dead=True) == 0
+
+
+def test_run_once_retries_the_batch_when_sending_fails(spool: Spool):
+    spool.enqueue_many(get_message(index=index) for index in range(2))
+    worker = get_worker(spool=spool, client=FailingClient(results=ConnectionRefusedError()))
+    assert worker.run_once() == 2
+    assert spool.count() == 2
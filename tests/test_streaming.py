@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from postal_py.api.schemas import RequestMessageSchema
+from postal_py.api.streaming import PreparedMessage
+
+
+@pytest.mark.parametrize('fields, attachments', [
+    ({'to': ['user@example.com'], 'from_': 'sender@example.com', 'subject': 'Quote "this"'}, None),
+    ({'to': ['user@example.com'], 'plain_body': 'Body'},
+     [('a.bin', 'application/octet-stream', b'\x00\xff' * 100), ('b.txt', None, b'text')]),
+    ({}, [('a.bin', None, b'data')])
+])
+def test_build_matches_the_validated_message(fields: dict, attachments: list | None):
+    prepared = PreparedMessage.build(**fields, attachments=attachments)
+    validated = RequestMessageSchema(**fields, attachments=[
+        {'name': name, 'content_type': content_type, 'data': data} for name, content_type, data in attachments
+    ] if attachments is not None else None)
+    assert json.loads(prepared.body) == validated.model_dump(exclude_none=True, by_alias=True)
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from postal_py.api.tracker import DeliveryTracker
+
+
+class FlakyClient:
+    def __init__(self, error: BaseException):
+        self.error = error
+        self.calls = 0
+
+    async def get_message_details(self, data) -> SimpleNamespace:
+        self.calls += 1
+        if self.calls == 1:
+            raise self.error
+        status = SimpleNamespace(status='Sent', last_delivery_attempt=None, held=False)
+        return SimpleNamespace(data=SimpleNamespace(status=status))
+
+
+def test_unexpected_poll_error_reschedules_the_message(tmp_path):
+    client = FlakyClient(error=ValueError('Malformed response'))
+    tracker = DeliveryTracker(client, path=str(tmp_path / 'tracker.db'), initial_interval=0.01,
+                              level=logging.CRITICAL)
+    tracker.add([1])
+
+    async def main() -> list:
+        return [change async for change in tracker.track()]
+
+    changes = asyncio.run(main())
+    tracker.close()
+    assert client.calls == 2
+    assert [(change.id, change.status, change.final) for change in changes] == [(1, 'Sent', True)]
+    # Progress is kept, so a restarted tracker has nothing left to poll
+    tracker = DeliveryTracker(client, path=str(tmp_path / 'tracker.db'))
+    assert len(tracker) == 0
+    tracker.close()
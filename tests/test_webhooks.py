@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import json
+import logging
+
+import pytest
+from cryptography.hazmat.primitives import (hashes,
+                                            serialization)
+from cryptography.hazmat.primitives.asymmetric import (padding,
+                                                       rsa)
+
+from postal_py.webhooks import (MessageBouncedEventSchema,
+                                MessageDeliveryEventSchema,
+                                WebhookEventSchema,
+                                WebhookReceiver)
+
+MESSAGE = {'id': 1, 'token': 'token', 'direction': 'outgoing', 'message_id': '1@postal.example',
+           'to': 'user@example.com', 'from': 'sender@example.com', 'subject': 'Hello', 'timestamp': 1.0,
+           'spam_status': 'NotChecked', 'tag': None}
+SENT = {'event': 'MessageSent', 'timestamp': 1.0, 'uuid': 'a', 'payload': {
+    'message': MESSAGE, 'status': 'Sent', 'details': 'Message accepted', 'output': '250 OK', 'sent_with_ssl': False,
+    'timestamp': 1.0, 'time': 0.1
+}}
+BOUNCED = {'event': 'MessageBounced', 'timestamp': 2.0, 'uuid': 'b', 'payload': {
+    'original_message': MESSAGE, 'bounce': {**MESSAGE, 'id': 2, 'direction': 'incoming'}
+}}
+DNS_ERROR = {'event': 'DomainDNSError', 'timestamp': 3.0, 'uuid': 'c', 'payload': {'domain': 'example.com'}}
+
+
+async def post(receiver: WebhookReceiver, body: bytes, path: str = '/', method: str = 'POST',
+               headers: dict[str, str] | None = None) -> int:
+    reader, writer = await asyncio.open_connection('127.0.0.1', receiver.port)
+    head = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n'
+                 f'Connection: close\r\n{head}\r\n'.encode() + body)
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+def run(receiver: WebhookReceiver, *requests: dict) -> list[int]:
+    async def main() -> list[int]:
+        await receiver.start(host='127.0.0.1', port=0)
+        try:
+            return list(await asyncio.gather(*(post(receiver, **request) for request in requests)))
+        finally:
+            await receiver.stop()
+
+    return asyncio.run(main())
+
+
+def test_events_are_parsed_and_handled_in_batches():
+    batches = []
+
+    async def handler(events: list[WebhookEventSchema]):
+        batches.append(events)
+
+    receiver = WebhookReceiver(handler=handler, max_delay=0.5, level=logging.CRITICAL)
+    statuses = run(receiver, *({'body': json.dumps(event).encode()} for event in (SENT, BOUNCED, DNS_ERROR)))
+    assert statuses == [200, 200, 200]
+    events, = batches
+    events = {event.uuid: event for event in events}
+    assert isinstance(events['a'], MessageDeliveryEventSchema)
+    assert (events['a'].payload.status, events['a'].payload.message.from_) == ('Sent', 'sender@example.com')
+    assert isinstance(events['b'], MessageBouncedEventSchema)
+    assert events['b'].payload.bounce.id == 2
+    assert type(events['c']) is WebhookEventSchema
+    assert events['c'].payload == {'domain': 'example.com'}
+
+
+def test_events_the_handler_fails_on_are_answered_with_an_error():
+    calls = []
+
+    def handler(events: list[WebhookEventSchema]):
+        calls.append(events)
+        if len(calls) == 1:
+            raise RuntimeError('Database is down')
+
+    receiver = WebhookReceiver(handler=handler, level=logging.CRITICAL)
+    # Postal sends the event again after an error
+    assert run(receiver, {'body': json.dumps(SENT).encode()}) == [500]
+    assert run(receiver, {'body': json.dumps(SENT).encode()}) == [200]
+    assert len(calls) == 2
+
+
+def test_rejected_requests():
+    calls = []
+    receiver = WebhookReceiver(handler=calls.append, path='/webhooks', level=logging.CRITICAL)
+    body = json.dumps(SENT).encode()
+    assert run(receiver, {'body': body, 'path': '/other'}, {'body': body, 'path': '/webhooks', 'method': 'PUT'},
+               {'body': b'{"event": "MessageSent"}', 'path': '/webhooks'},
+               {'body': body, 'path': '/webhooks?token=1'}) == [404, 405, 400, 200]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('algorithm, header', [(hashes.SHA256(), 'X-Postal-Signature-256'),
+                                               (hashes.SHA1(), 'X-Postal-Signature')])
+def test_signatures_are_verified(algorithm: hashes.HashAlgorithm, header: str):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    # Postal publishes the key in its DNS record as base64 DER
+    public_key = base64.b64encode(key.public_key().public_bytes(serialization.Encoding.DER,
+                                                                serialization.PublicFormat.SubjectPublicKeyInfo))
+    body = json.dumps(SENT).encode()
+
+    def sign(private_key: rsa.RSAPrivateKey) -> str:
+        return base64.b64encode(private_key.sign(body, padding.PKCS1v15(), algorithm)).decode()
+
+    calls = []
+    receiver = WebhookReceiver(handler=calls.append, public_key=b'p=' + public_key, level=logging.CRITICAL)
+    assert run(receiver, {'body': body, 'headers': {header: sign(key)}},
+               {'body': body, 'headers': {header: sign(other_key)}},
+               {'body': body}) == [200, 401, 401]
+    assert len(calls) == 1